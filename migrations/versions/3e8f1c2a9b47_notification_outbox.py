@@ -0,0 +1,38 @@
+"""notification outbox
+
+Revision ID: 3e8f1c2a9b47
+Revises: 0b0924ab237e
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3e8f1c2a9b47'
+down_revision: Union[str, Sequence[str], None] = '0b0924ab237e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('notifications', sa.Column('attempts', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('notifications', sa.Column('next_attempt_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False))
+    op.add_column('notifications', sa.Column('last_error', sa.Text(), nullable=True))
+    op.add_column('notifications', sa.Column('sent_at', sa.DateTime(timezone=True), nullable=True))
+    # до outbox таблица не использовалась для отправки — старые записи считаем обработанными
+    op.execute("UPDATE notifications SET is_sent = true WHERE is_sent IS NOT true")
+    op.create_index('ix_notifications_outbox', 'notifications', ['is_sent', 'next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_notifications_outbox', table_name='notifications')
+    op.drop_column('notifications', 'sent_at')
+    op.drop_column('notifications', 'last_error')
+    op.drop_column('notifications', 'next_attempt_at')
+    op.drop_column('notifications', 'attempts')
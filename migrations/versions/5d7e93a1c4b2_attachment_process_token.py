@@ -0,0 +1,30 @@
+"""attachment process token
+
+Revision ID: 5d7e93a1c4b2
+Revises: e4b81c6f2a90
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d7e93a1c4b2'
+down_revision: Union[str, Sequence[str], None] = 'e4b81c6f2a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('task_attachments', sa.Column('process_token', sa.Integer(), server_default='0', nullable=False))
+    # токен не меньше числа уже сделанных захватов — задания в работе не совпадут с новыми
+    op.execute("UPDATE task_attachments SET process_token = process_attempts")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('task_attachments', 'process_token')
@@ -0,0 +1,33 @@
+"""task reminder_sent_for
+
+Revision ID: 8d41b6e7c2f0
+Revises: 3e8f1c2a9b47
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41b6e7c2f0'
+down_revision: Union[str, Sequence[str], None] = '3e8f1c2a9b47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('tasks', sa.Column('reminder_sent_for', sa.DateTime(timezone=True), nullable=True))
+    # задачи, по которым старый сканер уже мог напомнить, повторно не напоминаем
+    op.execute(
+        "UPDATE tasks SET reminder_sent_for = scheduled_at "
+        "WHERE scheduled_at IS NOT NULL AND scheduled_at <= now() + interval '1 hour'"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('tasks', 'reminder_sent_for')
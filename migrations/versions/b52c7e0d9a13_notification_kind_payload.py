@@ -0,0 +1,31 @@
+"""notification kind and payload
+
+Revision ID: b52c7e0d9a13
+Revises: 8d41b6e7c2f0
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b52c7e0d9a13'
+down_revision: Union[str, Sequence[str], None] = '8d41b6e7c2f0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('notifications', sa.Column('kind', sa.String(), nullable=True))
+    op.add_column('notifications', sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('notifications', 'payload')
+    op.drop_column('notifications', 'kind')
@@ -0,0 +1,40 @@
+"""user skills
+
+Revision ID: c7a95f3d1e68
+Revises: b52c7e0d9a13
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7a95f3d1e68'
+down_revision: Union[str, Sequence[str], None] = 'b52c7e0d9a13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_skills',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('category', sa.String(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'category', name='uq_user_skills_user_category')
+    )
+    op.create_index(op.f('ix_user_skills_category'), 'user_skills', ['category'], unique=False)
+    op.create_index(op.f('ix_work_types_category'), 'work_types', ['category'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_work_types_category'), table_name='work_types')
+    op.drop_index(op.f('ix_user_skills_category'), table_name='user_skills')
+    op.drop_table('user_skills')
@@ -0,0 +1,40 @@
+"""attachment processing queue
+
+Revision ID: e4b81c6f2a90
+Revises: c7a95f3d1e68
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b81c6f2a90'
+down_revision: Union[str, Sequence[str], None] = 'c7a95f3d1e68'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('task_attachments', sa.Column('process_after', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('task_attachments', sa.Column('process_attempts', sa.Integer(), server_default='0', nullable=False))
+    # вложения, застрявшие после рестартов (processed=False без ошибки), сразу ставим в очередь
+    op.execute(
+        "UPDATE task_attachments SET process_after = now() "
+        "WHERE processed IS NOT true AND error_text IS NULL AND deleted_at IS NULL"
+    )
+    op.create_index(
+        'ix_task_attachments_process_queue', 'task_attachments', ['process_after'], unique=False,
+        postgresql_where=sa.text('process_after IS NOT NULL'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_task_attachments_process_queue', table_name='task_attachments')
+    op.drop_column('task_attachments', 'process_attempts')
+    op.drop_column('task_attachments', 'process_after')
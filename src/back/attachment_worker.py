@@ -0,0 +1,64 @@
+# back/attachment_worker.py
+# Отдельный процесс обработки вложений (миниатюры, контрольные суммы): python -m back.attachment_worker (из каталога src)
+# Вернуть в очередь зависшие вложения: python -m back.attachment_worker requeue [--failed] [--id 12 --id 15] [--dry-run]
+import argparse
+import asyncio
+import logging
+
+from back.db.config import ATTACHMENT_WORKER_CONCURRENCY
+from back.db.database import engine
+from back.files.media import start_media_pool, shutdown_media_pool
+from back.files.processing_queue import requeue_attachments, run_attachment_worker
+from back.utils.selectel import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+
+async def run(concurrency: int):
+    await get_s3_client().start()
+    start_media_pool()
+    try:
+        await run_attachment_worker(concurrency)
+    finally:
+        shutdown_media_pool()
+        await get_s3_client().close()
+        await engine.dispose()
+
+
+async def requeue(args):
+    try:
+        count = await requeue_attachments(
+            ids=args.id,
+            stuck_minutes=args.stuck_minutes,
+            include_failed=args.failed,
+            dry_run=args.dry_run,
+        )
+    finally:
+        await engine.dispose()
+    action = "подходит под условия" if args.dry_run else "возвращено в очередь"
+    print(f"Вложений {action}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обработка вложений задач")
+    parser.add_argument("--concurrency", type=int, default=ATTACHMENT_WORKER_CONCURRENCY, help="вложений одновременно")
+    commands = parser.add_subparsers(dest="command")
+    requeue_parser = commands.add_parser("requeue", help="вернуть в очередь зависшие вложения")
+    requeue_parser.add_argument("--stuck-minutes", type=float, default=30, help="просрочка задания, после которой оно считается зависшим")
+    requeue_parser.add_argument("--failed", action="store_true", help="также вложения с ошибкой обработки (dead letter)")
+    requeue_parser.add_argument("--id", type=int, action="append", help="только указанные вложения (можно несколько раз)")
+    requeue_parser.add_argument("--dry-run", action="store_true", help="только посчитать")
+    args = parser.parse_args()
+
+    if args.command == "requeue":
+        asyncio.run(requeue(args))
+        return
+    asyncio.run(run(args.concurrency))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        main()
+    except KeyboardInterrupt:
+        logger.info("Воркер вложений остановлен")
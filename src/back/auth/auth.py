@@ -1,5 +1,13 @@
+import asyncio
+import hashlib
+import hmac
 import json
 import logging
+import time
+from urllib.parse import parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from uuid import uuid4
 from datetime import datetime, timedelta,timezone
 from typing import Any, Dict, Optional
 
@@ -10,20 +18,24 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from sqlalchemy import select, update, delete
 from sqlalchemy.ext.asyncio import AsyncSession
-from back.db.config import SECRET_KEY,TOKEN as BOT_TOKEN
+from back.db.config import SECRET_KEY,TOKEN as BOT_TOKEN, BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, LOGIN_MAX_ATTEMPTS, LOGIN_ATTEMPTS_WINDOW, AUTH_STATELESS_ROLES, TELEGRAM_INIT_DATA_MAX_AGE
 from back.db.database import get_db
 from back.db.models import  User,Role
-from back.auth.auth_schemas import  LoginWithTelegramRequest,  UserCreate,UserResponse,Token,TokenVerificationResponse,LogoutResponse
+from back.auth.auth_schemas import  LoginWithTelegramRequest,  UserCreate,UserResponse,Token,TokenVerificationResponse,LogoutResponse,VerifyWebAppRequest
 from typing import Optional
 from fastapi import Request
 from back.utils.redis_client import redis_client
+from back.auth.user_cache import user_cache, invalidate_user, get_user_auth_state
+from back.auth.revocation import revoke_jti, is_jti_revoked, is_legacy_token_revoked
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+# bcrypt блокирует поток на сотни мс — выполняем его в отдельном ограниченном пуле, а не в event loop
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
 ALGORITHM = "HS256"
 access_token_expire_minutes = 60*24*10
 
@@ -43,12 +55,95 @@ router = APIRouter(
 #
 
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+async def get_password_hash(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, pwd_context.hash, password)
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    """
+    Проверка пароля в пуле потоков.
+    Возвращает (ok, new_hash): new_hash не None, если хэш нужно пересчитать (например, сменилась стоимость bcrypt).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, pwd_context.verify_and_update, plain_password, hashed_password)
+
+
+def _webapp_secret_key() -> bytes:
+    # ключ проверки initData: HMAC_SHA256(key="WebAppData", msg=<bot token>)
+    return hmac.new(b"WebAppData", (BOT_TOKEN or "").encode(), hashlib.sha256).digest()
+
+
+def validate_webapp_init_data(init_data: str) -> Dict[str, Any]:
+    """
+    Проверка подписи Telegram WebApp initData (HMAC-SHA256) и её свежести.
+    Возвращает разобранные поля, user — уже как dict.
+    """
+    if not BOT_TOKEN:
+        raise HTTPException(status_code=503, detail="Telegram bot token не настроен")
+
+    fields = dict(parse_qsl(init_data, keep_blank_values=True))
+    received_hash = fields.pop("hash", None)
+    if not received_hash:
+        raise HTTPException(status_code=401, detail="initData без подписи")
+
+    data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    expected_hash = hmac.new(_webapp_secret_key(), data_check_string.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected_hash, received_hash):
+        raise HTTPException(status_code=401, detail="Неверная подпись initData")
+
+    try:
+        auth_date = int(fields.get("auth_date", 0))
+    except ValueError:
+        auth_date = 0
+    if TELEGRAM_INIT_DATA_MAX_AGE > 0 and time.time() - auth_date > TELEGRAM_INIT_DATA_MAX_AGE:
+        raise HTTPException(status_code=401, detail="initData устарела")
+
+    try:
+        fields["user"] = json.loads(fields.get("user") or "{}")
+    except ValueError:
+        raise HTTPException(status_code=401, detail="Некорректные данные пользователя в initData")
+    return fields
+
+
+def _login_attempts_key(login: str) -> str:
+    return f"login_attempts:{login.lower()}"
+
+
+# INCR и установка окна одной операцией: ключ не останется без TTL, если процесс упадёт между ними
+_LOGIN_ATTEMPT_SCRIPT = """
+local attempts = redis.call('incr', KEYS[1])
+if attempts == 1 then
+    redis.call('expire', KEYS[1], ARGV[1])
+end
+return attempts
+"""
+
+
+async def _check_login_rate_limit(login: str) -> None:
+    """
+    Не даём перебирать пароль одного логина: попытка учитывается атомарным INCR до проверки
+    пароля, и решение принимается по возвращённому значению — параллельные запросы не проскочат
+    между чтением и увеличением счётчика. После LOGIN_MAX_ATTEMPTS попыток за окно отвечаем 429,
+    не тратя bcrypt; успешный вход сбрасывает счётчик.
+    """
+    try:
+        attempts = await redis_client.eval(_LOGIN_ATTEMPT_SCRIPT, 1, _login_attempts_key(login), LOGIN_ATTEMPTS_WINDOW)
+    except Exception as e:
+        logger.warning(f"Redis недоступен, пропускаем ограничение попыток входа: {e}")
+        return
+    if int(attempts) > LOGIN_MAX_ATTEMPTS:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Слишком много попыток входа, попробуйте позже",
+        )
+
+
+async def _reset_login_failures(login: str) -> None:
+    try:
+        await redis_client.delete(_login_attempts_key(login))
+    except Exception:
+        pass
 
 
 def create_access_token(
@@ -64,6 +159,7 @@ def create_access_token(
         "full_name": f"{user.name} {user.lastname}",
         "telegram_id": user.telegram_id,  # если есть
         "exp": expire,
+        "jti": uuid4().hex,  # идентификатор токена для отзыва
     }
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
@@ -75,7 +171,7 @@ def create_access_token(
 
 
 async def create_user(db: AsyncSession, user_in: UserCreate) -> User:
-    hashed_password = get_password_hash(user_in.password)
+    hashed_password = await get_password_hash(user_in.password)
     db_user = User(
         login=user_in.login,
         telegram_id=user_in.telegram_id,   
@@ -91,50 +187,136 @@ async def create_user(db: AsyncSession, user_in: UserCreate) -> User:
     return db_user
 
 async def authenticate_user(db: AsyncSession, login: str, password: str) -> Optional[User]:
+    await _check_login_rate_limit(login)
+
     result = await db.execute(select(User).where(User.login == login))
     user = result.scalars().first()
-    if not user or not verify_password(password, user.hashed_password) or not user.is_active:
+    if not user:
+        return None
+
+    ok, new_hash = await verify_password(password, user.hashed_password)
+    if not ok or not user.is_active:
         return None
+
+    await _reset_login_failures(login)
+    if new_hash:
+        # прозрачно пересчитываем хэш под текущую стоимость bcrypt
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
 
-async def verify_token(token: str) -> int:
+async def _is_token_revoked(token: str, payload: Dict[str, Any]) -> bool:
+    jti = payload.get("jti")
     try:
-        # если Redis недоступен — пропускаем
-        if await redis_client.sismember("token_blacklist", token):
-            logger.info(f"Token {token} is blacklisted")
-            raise HTTPException(status_code=403, detail="Токен отозван")
+        if jti:
+            return await is_jti_revoked(jti)
+        # токены без jti выпущены до перехода на отзыв по jti
+        return await is_legacy_token_revoked(token)
     except Exception as e:
+        # если Redis недоступен — пропускаем
         logger.warning(f"Redis недоступен, пропускаем blacklist check: {e}")
+        return False
 
+
+async def decode_token(token: str) -> Dict[str, Any]:
+    """
+    Проверяет подпись и срок действия JWT, затем — что токен не отозван.
+    Возвращает payload.
+    """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        if not user_id:
-            raise HTTPException(status_code=403, detail="Не удалось извлечь ID из токена")
-        return int(user_id)
     except JWTError as e:
         logger.warning(f"JWT decode error: {e}")
         raise HTTPException(status_code=403, detail="Неверный токен или истек срок действия")
 
+    if await _is_token_revoked(token, payload):
+        logger.info(f"Token jti={payload.get('jti')} is revoked")
+        raise HTTPException(status_code=403, detail="Токен отозван")
+    return payload
+
+
+def _user_id_from_payload(payload: Dict[str, Any]) -> int:
+    user_id = payload.get("sub")
+    if not user_id:
+        raise HTTPException(status_code=403, detail="Не удалось извлечь ID из токена")
+    return int(user_id)
+
+
+async def verify_token(token: str) -> int:
+    payload = await decode_token(token)
+    return _user_id_from_payload(payload)
+
+
+@dataclass(frozen=True)
+class TokenPrincipal:
+    """
+    Минимальные данные о текущем пользователе для проверки прав: id и роль.
+    """
+    id: int
+    role: Role
+
+
+async def get_token_payload(token: str = Depends(oauth2_scheme)) -> Dict[str, Any]:
+    # отдельная зависимость — FastAPI кэширует её в рамках запроса, токен проверяется один раз
+    return await decode_token(token)
+
+
+async def _load_active_user(db: AsyncSession, user_id: int) -> User:
+    user = user_cache.get(user_id)
+    if user is None:
+        result = await db.execute(select(User).where(User.id == user_id))
+        user = result.scalars().first()
+        if user:
+            user_cache.set(user)
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    if not user.is_active:
+        raise HTTPException(status_code=403, detail="Аккаунт пользователя деактивирован")
+    return user
 
 
 async def get_current_user(
         db: AsyncSession = Depends(get_db),
-        token: str = Depends(oauth2_scheme)
+        payload: Dict[str, Any] = Depends(get_token_payload)
 ) -> User:
     """
     Зависимость для получения текущего пользователя по JWT.
     Также проверяет, активен ли пользователь.
     """
-    user_id = await verify_token(token)
-    result = await db.execute(select(User).where(User.id == user_id))
-    user = result.scalars().first()
-    if not user:
+    return await _load_active_user(db, _user_id_from_payload(payload))
+
+
+async def get_current_principal(
+        payload: Dict[str, Any] = Depends(get_token_payload),
+        db: AsyncSession = Depends(get_db),
+) -> TokenPrincipal:
+    """
+    Зависимость для проверки прав без полной строки пользователя.
+    При AUTH_STATELESS_ROLES роль берётся из проверенных claims токена, а деактивация и смена роли
+    отслеживаются по короткоживущему ключу user_version в Redis. Иначе — как get_current_user
+    В обоих режимах промах кэша читается через сессию запроса; соединение берётся из пула только при обращении.
+    """
+    user_id = _user_id_from_payload(payload)
+
+    if not AUTH_STATELESS_ROLES:
+        user = await _load_active_user(db, user_id)
+        return TokenPrincipal(id=user.id, role=user.role)
+
+    try:
+        claim_role = Role(payload.get("role"))
+    except ValueError:
+        raise HTTPException(status_code=403, detail="Неверная роль в токене")
+
+    state = await get_user_auth_state(db, user_id)
+    if state is None:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
-    if not user.is_active:
+    role, is_active = state
+    if not is_active:
         raise HTTPException(status_code=403, detail="Аккаунт пользователя деактивирован")
-    return user
+    if role != claim_role.value:
+        raise HTTPException(status_code=403, detail="Роль пользователя изменилась, войдите заново")
+    return TokenPrincipal(id=user_id, role=claim_role)
 
 
 #
@@ -201,8 +383,19 @@ async def verify_user_token(token: str):
     summary="Выход и отзыв токена"
 )
 async def logout(token: str = Depends(oauth2_scheme)):
-    await redis_client.sadd("token_blacklist", token)
-    logger.info(f"Token {token} успешно отозван")
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        # истёкший или невалидный токен отзывать не нужно
+        return LogoutResponse(message="Вы успешно вышли из системы")
+
+    jti = payload.get("jti")
+    if jti:
+        expires_at = datetime.fromtimestamp(payload["exp"], tz=timezone.utc)
+        await revoke_jti(jti, expires_at)
+    else:
+        await redis_client.sadd("token_blacklist", token)
+    logger.info(f"Token jti={jti} успешно отозван")
     return LogoutResponse(message="Вы успешно вышли из системы")
 
 
@@ -231,6 +424,7 @@ async def login_for_access_with_telegram(
 
         await db.commit()
         await db.refresh(user) # Обновляем объект, чтобы убедиться, что telegram_id установлен
+        await invalidate_user(user.id)
         logger.info(f"Telegram ID {telegram_id} успешно привязан к пользователю {user.id}")
 
 
@@ -242,4 +436,46 @@ async def login_for_access_with_telegram(
         "user_id": user.id,
         "role": user.role.value,
         "fullname": f"{user.name} {user.lastname}"
-    }
\ No newline at end of file
+    }
+
+
+@router.post(
+    "/token_with_init_data",
+    response_model=Token,
+    summary="Вход из мини-приложения по Telegram initData",
+    description="Проверяет подпись initData ключом бота и выдаёт JWT пользователю с привязанным telegram_id. Пароль не нужен.",
+)
+async def login_with_webapp_init_data(
+    payload: VerifyWebAppRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    fields = validate_webapp_init_data(payload.init_data)
+    telegram_id = fields["user"].get("id")
+    if not telegram_id:
+        raise HTTPException(status_code=401, detail="В initData нет Telegram ID")
+
+    # поиск по индексу users.telegram_id; берём максимум две строки, чтобы заметить дубли
+    result = await db.execute(
+        select(User).where(User.telegram_id == int(telegram_id)).order_by(User.id).limit(2)
+    )
+    users = result.scalars().all()
+    if not users:
+        raise HTTPException(status_code=401, detail="Telegram аккаунт не привязан, войдите по логину и паролю")
+    if len(users) > 1:
+        logger.warning(f"Telegram ID {telegram_id} привязан к нескольким пользователям: {[u.id for u in users]}")
+        raise HTTPException(status_code=409, detail="Telegram аккаунт привязан к нескольким пользователям, войдите по логину и паролю")
+
+    user = users[0]
+    if not user.is_active:
+        raise HTTPException(status_code=403, detail="Аккаунт пользователя деактивирован")
+    user_cache.set(user)
+
+    access_token = create_access_token(user)
+
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "user_id": user.id,
+        "role": user.role.value,
+        "fullname": f"{user.name} {user.lastname}"
+    }
@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from back.db.config import (
+    TOKEN_REVOCATION_BLOOM,
+    TOKEN_BLOOM_CAPACITY,
+    TOKEN_BLOOM_ERROR_RATE,
+    TOKEN_BLOOM_REBUILD_SECONDS,
+)
+from back.utils.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+REVOKED_JTI_PREFIX = "revoked_jti:"
+REVOKED_JTI_CHANNEL = "token_revoked"
+
+# Старый набор целых JWT: нужен только для токенов без jti, выпущенных до перехода.
+# После истечения срока жизни таких токенов ключ можно удалить.
+LEGACY_BLACKLIST_KEY = "token_blacklist"
+
+
+class BloomFilter:
+    """
+    Простой Bloom-фильтр на bytearray (double hashing по blake2b).
+    Ложноотрицательных ответов не бывает, поэтому "нет в фильтре" == "токен не отозван".
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, value: str) -> None:
+        for pos in self._positions(value):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+_bloom: Optional[BloomFilter] = None
+_bloom_ready = False
+
+
+def _key(jti: str) -> str:
+    return f"{REVOKED_JTI_PREFIX}{jti}"
+
+
+async def revoke_jti(jti: str, expires_at: datetime) -> None:
+    """
+    Отозвать токен: ключ revoked_jti:<jti> живёт ровно до истечения самого токена.
+    """
+    ttl = int((expires_at - datetime.now(timezone.utc)).total_seconds())
+    if ttl <= 0:
+        return
+    await redis_client.set(_key(jti), 1, ex=ttl)
+    if _bloom is not None:
+        _bloom.add(jti)
+    try:
+        await redis_client.publish(REVOKED_JTI_CHANNEL, jti)
+    except Exception as e:
+        logger.warning(f"Не удалось разослать отзыв токена {jti}: {e}")
+
+
+async def is_jti_revoked(jti: str) -> bool:
+    # Bloom-фильтр синхронизирован — отрицательный ответ точный, в Redis не ходим
+    if _bloom_ready and _bloom is not None and jti not in _bloom:
+        return False
+    return bool(await redis_client.exists(_key(jti)))
+
+
+async def is_legacy_token_revoked(token: str) -> bool:
+    return bool(await redis_client.sismember(LEGACY_BLACKLIST_KEY, token))
+
+
+async def _rebuild_bloom() -> None:
+    global _bloom, _bloom_ready
+    bloom = BloomFilter(TOKEN_BLOOM_CAPACITY, TOKEN_BLOOM_ERROR_RATE)
+    count = 0
+    async for key in redis_client.scan_iter(match=f"{REVOKED_JTI_PREFIX}*", count=1000):
+        if isinstance(key, bytes):
+            key = key.decode()
+        bloom.add(key[len(REVOKED_JTI_PREFIX):])
+        count += 1
+    _bloom = bloom
+    _bloom_ready = True
+    logger.info(f"Bloom-фильтр отозванных токенов перестроен: {count} записей")
+
+
+async def revocation_listener():
+    """
+    Фоновая задача (только при TOKEN_REVOCATION_BLOOM): держит локальный Bloom-фильтр
+    в актуальном состоянии — подписка на отзывы из других воркеров и периодическая
+    перестройка, чтобы выкинуть истёкшие jti.
+    """
+    global _bloom_ready
+    if not TOKEN_REVOCATION_BLOOM:
+        return
+
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            # сначала подписка, потом SCAN — так не теряем отзывы, пришедшие во время перестройки
+            await pubsub.subscribe(REVOKED_JTI_CHANNEL)
+            await _rebuild_bloom()
+            rebuild_at = time.monotonic() + TOKEN_BLOOM_REBUILD_SECONDS
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message and message.get("type") == "message" and _bloom is not None:
+                    data = message["data"]
+                    _bloom.add(data.decode() if isinstance(data, bytes) else str(data))
+                if time.monotonic() >= rebuild_at:
+                    await _rebuild_bloom()
+                    rebuild_at = time.monotonic() + TOKEN_BLOOM_REBUILD_SECONDS
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # без подписки фильтр может отстать — до восстановления проверяем только Redis
+            _bloom_ready = False
+            logger.warning(f"Синхронизация Bloom-фильтра токенов прервана: {e}")
+            await asyncio.sleep(5)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from back.db.config import USER_CACHE_TTL, USER_CACHE_MAX_SIZE, USER_VERSION_TTL
+from back.db.models import User
+from back.utils.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_CHANNEL = "user_cache_invalidate"
+USER_VERSION_PREFIX = "user_version:"
+
+_USER_COLUMNS = [c.key for c in User.__table__.columns]
+
+
+class UserCache:
+    """
+    LRU-кэш строк users с ограничением по времени жизни записи.
+    Хранит только значения колонок; на каждый hit отдаётся новый (transient) объект User,
+    чтобы разные запросы не делили один экземпляр.
+    """
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, max_size: int = USER_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: "OrderedDict[int, tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Optional[User]:
+        item = self._items.get(user_id)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                self._items.pop(user_id, None)
+            self.misses += 1
+            return None
+        self._items.move_to_end(user_id)
+        self.hits += 1
+        return User(**item[1])
+
+    def set(self, user: User) -> None:
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        values = {key: getattr(user, key) for key in _USER_COLUMNS}
+        self._items[user.id] = (time.monotonic() + self.ttl, values)
+        self._items.move_to_end(user.id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._items.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+user_cache = UserCache()
+
+
+async def get_user_auth_state(db: AsyncSession, user_id: int) -> Optional[tuple[str, bool]]:
+    """
+    Актуальные роль и активность пользователя для stateless-проверки токена.
+    Берутся из короткоживущего ключа user_version:<id>, при промахе — одним лёгким запросом
+    через сессию запроса (соединение из пула берётся только при этом запросе).
+    Возвращает (role, is_active) или None, если пользователя нет.
+    """
+    key = f"{USER_VERSION_PREFIX}{user_id}"
+    try:
+        cached = await redis_client.get(key)
+    except Exception as e:
+        logger.warning(f"Redis недоступен, состояние пользователя {user_id} читаем из БД: {e}")
+        cached = None
+    if cached:
+        if isinstance(cached, bytes):
+            cached = cached.decode()
+        role, _, active = cached.partition(":")
+        return role, active == "1"
+
+    row = (await db.execute(select(User.role, User.is_active).where(User.id == user_id))).first()
+    if row is None:
+        return None
+    state = (row.role.value, bool(row.is_active))
+    try:
+        await redis_client.set(key, f"{state[0]}:{int(state[1])}", ex=USER_VERSION_TTL)
+    except Exception:
+        pass
+    return state
+
+
+async def invalidate_user(user_id: int) -> None:
+    """
+    Сбросить пользователя из кэша в этом процессе и во всех остальных воркерах (Redis pub/sub),
+    а также ключ user_version, по которому проверяются stateless-токены.
+    """
+    user_cache.invalidate(user_id)
+    try:
+        await redis_client.delete(f"{USER_VERSION_PREFIX}{user_id}")
+        await redis_client.publish(USER_CACHE_CHANNEL, str(user_id))
+    except Exception as e:
+        # остальные воркеры сбросят запись по TTL
+        logger.warning(f"Redis недоступен, инвалидация пользователя {user_id} только локально: {e}")
+
+
+async def user_cache_listener():
+    """
+    Фоновая задача: слушает канал инвалидации и сбрасывает записи локального кэша.
+    При переподключении к Redis кэш очищается целиком — сообщения за время разрыва потеряны.
+    """
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(USER_CACHE_CHANNEL)
+            user_cache.clear()
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                try:
+                    user_cache.invalidate(int(message["data"]))
+                except (TypeError, ValueError):
+                    logger.warning(f"Некорректное сообщение инвалидации кэша: {message.get('data')}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Подписка на инвалидацию кэша пользователей прервана: {e}")
+            await asyncio.sleep(5)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
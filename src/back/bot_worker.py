@@ -1,13 +1,39 @@
 # back/bot_worker.py
+# Отдельный процесс бота (long polling): python -m back.bot_worker (из каталога src)
 import asyncio
+import hmac
+import logging
 from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
+from fastapi import APIRouter, HTTPException, Request
 from back.db.config import TOKEN as BOT_TOKEN
-from back.db.config import WEB_APP_URL
+from back.db.config import WEB_APP_URL, BOT_MODE, BOT_WEBHOOK_URL, BOT_WEBHOOK_PATH, BOT_WEBHOOK_SECRET, TELEGRAM_API_BASE_URL
+from back.utils.leader import run_as_leader
 
-bot = Bot(token=BOT_TOKEN)
+logger = logging.getLogger(__name__)
+
+# тот же адрес Bot API, что и у рассылок (в тестах — локальная заглушка)
+bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_BASE_URL)))
 dp = Dispatcher()
 
+# Webhook-режим: Telegram сам присылает апдейты, бот работает в процессах API без polling
+webhook_router = APIRouter()
+
+BOT_MODES = ("polling", "webhook", "external")
+
+
+def check_bot_config():
+    """
+    Проверка настроек бота при старте API: опечатка в BOT_MODE иначе молча отключала бы и polling,
+    и webhook, а webhook без секрета принимал бы поддельные апдейты от любого, кто знает путь.
+    """
+    if BOT_MODE not in BOT_MODES:
+        raise RuntimeError(f"Неизвестный BOT_MODE={BOT_MODE!r}, допустимо: {', '.join(BOT_MODES)}")
+    if BOT_MODE == "webhook" and not BOT_WEBHOOK_SECRET:
+        raise RuntimeError("BOT_MODE=webhook требует BOT_WEBHOOK_SECRET")
+
 
 @dp.message(Command(commands=["start"]))
 async def handle_start(message: types.Message):
@@ -21,8 +47,53 @@ async def handle_start(message: types.Message):
 
 async def start_polling():
     try:
-        await dp.start_polling(bot)
+        # polling не работает при установленном webhook — снимаем его (апдейты в очереди Telegram сохраняются)
+        await bot.delete_webhook(drop_pending_updates=False)
+        await dp.start_polling(bot, handle_signals=False)
     except asyncio.CancelledError:
         pass
     finally:
         await bot.session.close()
+
+
+@webhook_router.post(BOT_WEBHOOK_PATH, include_in_schema=False)
+async def telegram_webhook(request: Request):
+    received = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not BOT_WEBHOOK_SECRET or not hmac.compare_digest(received, BOT_WEBHOOK_SECRET):
+        raise HTTPException(status_code=403, detail="Invalid webhook secret")
+    update = types.Update.model_validate(await request.json(), context={"bot": bot})
+    await dp.feed_webhook_update(bot, update)
+    return {"ok": True}
+
+
+async def setup_webhook():
+    """
+    Регистрирует webhook в Telegram. Вызов идемпотентный, поэтому его можно делать из каждого воркера API.
+    """
+    if not BOT_WEBHOOK_URL:
+        logger.error("BOT_MODE=webhook, но BOT_WEBHOOK_URL не задан — webhook не зарегистрирован")
+        return
+    await bot.set_webhook(
+        url=BOT_WEBHOOK_URL.rstrip("/") + BOT_WEBHOOK_PATH,
+        secret_token=BOT_WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=False,
+    )
+    logger.info("Webhook бота зарегистрирован")
+
+
+async def main():
+    check_bot_config()
+    if BOT_MODE != "polling":
+        # start_polling снимает webhook — в webhook-развёртывании это отключило бы приём апдейтов
+        raise RuntimeError(f"Отдельный процесс бота работает только при BOT_MODE=polling, сейчас {BOT_MODE!r}")
+    # тот же ключ аренды, что и у polling внутри API: одновременно getUpdates делает только один процесс
+    await run_as_leader("bot_polling", start_polling)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Бот остановлен")
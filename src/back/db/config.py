@@ -18,3 +18,122 @@ BUCKET_NAME_S3 = os.environ.get('BUCKET_NAME_S3')
 WEB_APP_URL = os.environ.get('WEB_APP_URL')
 REDIS_CLIENT_URL = os.environ.get('REDIS_CLIENT_URL')
 
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Настройки пула соединений с БД (общие для API и фоновых задач)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = _env_bool('DB_POOL_PRE_PING', True)
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))  # 0 — без ограничения
+DB_ECHO = _env_bool('DB_ECHO', False)
+
+# Реплика только для чтения (sqlalchemy URL); если не задана — чтение идёт с основной БД
+DB_REPLICA_URL = os.environ.get('DB_REPLICA_URL')
+
+# Диагностика запросов к БД
+DB_SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', 200))
+DB_N_PLUS_ONE_THRESHOLD = int(os.environ.get('DB_N_PLUS_ONE_THRESHOLD', 5))  # сколько одинаковых запросов за запрос считать N+1
+DB_N_PLUS_ONE_ASSERT = _env_bool('DB_N_PLUS_ONE_ASSERT', False)  # dev-режим: падать с AssertionError при N+1
+
+# Кэш авторизованных пользователей (в памяти процесса)
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))  # секунды
+USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', 1000))
+
+# Локальный Bloom-фильтр перед проверкой отозванных токенов в Redis
+TOKEN_REVOCATION_BLOOM = _env_bool('TOKEN_REVOCATION_BLOOM', False)
+TOKEN_BLOOM_CAPACITY = int(os.environ.get('TOKEN_BLOOM_CAPACITY', 100000))
+TOKEN_BLOOM_ERROR_RATE = float(os.environ.get('TOKEN_BLOOM_ERROR_RATE', 0.01))
+TOKEN_BLOOM_REBUILD_SECONDS = int(os.environ.get('TOKEN_BLOOM_REBUILD_SECONDS', 6 * 60 * 60))
+
+# Хэширование паролей и защита логина от перебора
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 4))
+LOGIN_MAX_ATTEMPTS = int(os.environ.get('LOGIN_MAX_ATTEMPTS', 10))  # неудачных попыток на логин за окно
+LOGIN_ATTEMPTS_WINDOW = int(os.environ.get('LOGIN_ATTEMPTS_WINDOW', 15 * 60))  # секунды
+
+# Stateless-авторизация: проверка ролей по claims JWT без загрузки пользователя из БД
+AUTH_STATELESS_ROLES = _env_bool('AUTH_STATELESS_ROLES', False)
+USER_VERSION_TTL = int(os.environ.get('USER_VERSION_TTL', 300))  # секунды жизни ключа user_version:<id>
+
+# Вход через Telegram WebApp initData: максимальный возраст auth_date в секундах
+TELEGRAM_INIT_DATA_MAX_AGE = int(os.environ.get('TELEGRAM_INIT_DATA_MAX_AGE', 24 * 60 * 60))
+
+# HTTP-клиент Telegram Bot API (один на процесс)
+TELEGRAM_HTTP_TIMEOUT = float(os.environ.get('TELEGRAM_HTTP_TIMEOUT', 10))
+TELEGRAM_HTTP_MAX_CONNECTIONS = int(os.environ.get('TELEGRAM_HTTP_MAX_CONNECTIONS', 50))
+TELEGRAM_HTTP_MAX_KEEPALIVE = int(os.environ.get('TELEGRAM_HTTP_MAX_KEEPALIVE', 20))
+TELEGRAM_HTTP2 = _env_bool('TELEGRAM_HTTP2', True)  # используется, только если установлен пакет h2
+
+# Ограничения скорости отправки в Telegram
+TELEGRAM_GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', 30))  # сообщений в секунду на бота
+TELEGRAM_PER_CHAT_INTERVAL = float(os.environ.get('TELEGRAM_PER_CHAT_INTERVAL', 1.0))  # секунд между сообщениями в один чат
+TELEGRAM_SEND_CONCURRENCY = int(os.environ.get('TELEGRAM_SEND_CONCURRENCY', 10))
+TELEGRAM_MAX_RETRIES = int(os.environ.get('TELEGRAM_MAX_RETRIES', 3))
+
+# Воркер уведомлений: по умолчанию внутри API, но только в процессе-лидере "notify_outbox" (аренда в Redis) —
+# лимиты TELEGRAM_GLOBAL_RATE и на чат действуют в пределах процесса, поэтому отправлять должен один процесс.
+# False — если запущен отдельный процесс back.notify_worker (он берёт ту же аренду)
+NOTIFY_WORKER_EMBEDDED = _env_bool('NOTIFY_WORKER_EMBEDDED', True)
+
+# Outbox уведомлений (таблица notifications): пакетная отправка с повторами
+NOTIFY_OUTBOX_BATCH_SIZE = int(os.environ.get('NOTIFY_OUTBOX_BATCH_SIZE', 100))
+NOTIFY_OUTBOX_POLL_INTERVAL = float(os.environ.get('NOTIFY_OUTBOX_POLL_INTERVAL', 2))  # секунды между опросами пустой очереди
+NOTIFY_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('NOTIFY_OUTBOX_MAX_ATTEMPTS', 8))
+NOTIFY_OUTBOX_BACKOFF_BASE = float(os.environ.get('NOTIFY_OUTBOX_BACKOFF_BASE', 5))  # секунды, удваивается с каждой попыткой
+NOTIFY_OUTBOX_BACKOFF_MAX = float(os.environ.get('NOTIFY_OUTBOX_BACKOFF_MAX', 60 * 60))
+NOTIFY_OUTBOX_LEASE = float(os.environ.get('NOTIFY_OUTBOX_LEASE', 120))  # секунды на отправку пачки; потом строки снова в очереди
+
+# Напоминания монтажникам о предстоящих задачах
+TASK_REMINDER_LEAD_MINUTES = int(os.environ.get('TASK_REMINDER_LEAD_MINUTES', 60))  # за сколько до начала напоминать
+TASK_REMINDER_MAX_SLEEP = float(os.environ.get('TASK_REMINDER_MAX_SLEEP', 15 * 60))  # страховочная перепроверка, секунды
+
+# Выборы лидера (Redis-аренда) для задач, которые должны работать в одном процессе
+LEADER_LEASE_TTL = float(os.environ.get('LEADER_LEASE_TTL', 10))  # секунды; за это время другой процесс подхватит задачу
+LEADER_RENEW_INTERVAL = float(os.environ.get('LEADER_RENEW_INTERVAL', 3))
+
+# Режим бота: polling — long polling в процессе-лидере API (по умолчанию),
+# webhook — апдейты приходят на маршрут FastAPI, external — бот запущен отдельно (python -m back.bot_worker)
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+BOT_WEBHOOK_URL = os.environ.get('BOT_WEBHOOK_URL')  # публичный адрес API, например https://example.com
+BOT_WEBHOOK_PATH = os.environ.get('BOT_WEBHOOK_PATH', '/api/v1/telegram/webhook')
+BOT_WEBHOOK_SECRET = os.environ.get('BOT_WEBHOOK_SECRET')
+
+# Окно склейки уведомлений "задача обновлена" для одного пользователя и задачи, секунды (0 — без склейки)
+NOTIFY_COALESCE_WINDOW = float(os.environ.get('NOTIFY_COALESCE_WINDOW', 30))
+
+# Адрес Telegram Bot API; для нагрузочных тестов — локальная заглушка, например http://127.0.0.1:8081
+TELEGRAM_API_BASE_URL = os.environ.get('TELEGRAM_API_BASE_URL', 'https://api.telegram.org')
+
+# Клиент S3 (один на процесс): пул соединений, таймауты и повторы botocore
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 50))
+S3_CONNECT_TIMEOUT = float(os.environ.get('S3_CONNECT_TIMEOUT', 5))
+S3_READ_TIMEOUT = float(os.environ.get('S3_READ_TIMEOUT', 60))
+S3_MAX_ATTEMPTS = int(os.environ.get('S3_MAX_ATTEMPTS', 3))
+S3_RETRY_MODE = os.environ.get('S3_RETRY_MODE', 'standard')  # legacy / standard / adaptive
+S3_PRESIGN_CACHE_BUCKET = int(os.environ.get('S3_PRESIGN_CACHE_BUCKET', 600))  # интервал кэша подписанных ссылок, секунды
+
+# Обработка вложений: чтение объекта из S3 потоком, без загрузки целиком в память
+ATTACHMENT_STREAM_CHUNK_SIZE = int(os.environ.get('ATTACHMENT_STREAM_CHUNK_SIZE', 1024 * 1024))
+THUMB_MAX_SOURCE_BYTES = int(os.environ.get('THUMB_MAX_SOURCE_BYTES', 50 * 1024 * 1024))  # больше — без миниатюры
+
+# Пул процессов для миниатюр: число процессов и предел задач в пуле (в работе + в очереди)
+MEDIA_POOL_WORKERS = int(os.environ.get('MEDIA_POOL_WORKERS', 2))
+MEDIA_QUEUE_DEPTH = int(os.environ.get('MEDIA_QUEUE_DEPTH', 8))
+
+# Очередь обработки вложений (строки task_attachments): воркер, повторы и dead letter в error_text
+ATTACHMENT_WORKER_EMBEDDED = _env_bool('ATTACHMENT_WORKER_EMBEDDED', True)  # иначе — отдельный процесс back.attachment_worker
+ATTACHMENT_WORKER_CONCURRENCY = int(os.environ.get('ATTACHMENT_WORKER_CONCURRENCY', 4))
+ATTACHMENT_WORKER_POLL_INTERVAL = float(os.environ.get('ATTACHMENT_WORKER_POLL_INTERVAL', 10))  # страховочный опрос, секунды
+ATTACHMENT_JOB_TIMEOUT = float(os.environ.get('ATTACHMENT_JOB_TIMEOUT', 15 * 60))  # после этого задание снова доступно другим воркерам
+ATTACHMENT_JOB_MAX_ATTEMPTS = int(os.environ.get('ATTACHMENT_JOB_MAX_ATTEMPTS', 5))
+ATTACHMENT_JOB_BACKOFF_BASE = float(os.environ.get('ATTACHMENT_JOB_BACKOFF_BASE', 30))  # секунды, удваивается с каждой попыткой
+ATTACHMENT_JOB_BACKOFF_MAX = float(os.environ.get('ATTACHMENT_JOB_BACKOFF_MAX', 60 * 60))
@@ -1,16 +1,148 @@
-from sqlalchemy.ext.asyncio import create_async_engine,async_sessionmaker,AsyncSession
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine,async_sessionmaker,AsyncSession
 from sqlalchemy.orm import declarative_base
-from back.db.config import DB_USER,DB_PASS,DB_HOST,DB_PORT,DB_NAME
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from back.db.config import (
+    DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+    DB_STATEMENT_TIMEOUT_MS, DB_ECHO, DB_REPLICA_URL,
+)
+
 
+logger = logging.getLogger(__name__)
 
 DATABASE_URL = f"postgresql+psycopg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Пул соединений, который дополнительно считает ожидание свободного соединения:
+    количество выдач, суммарное и максимальное время ожидания, число таймаутов.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts_total = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.timeouts_total = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts_total += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.checkouts_total += 1
+            self.wait_time_total += waited
+            if waited > self.wait_time_max:
+                self.wait_time_max = waited
+
+    def recreate(self):
+        # при пересоздании пула (например, после разрыва соединений) сохраняем накопленную статистику
+        new_pool = super().recreate()
+        new_pool.checkouts_total = self.checkouts_total
+        new_pool.wait_time_total = self.wait_time_total
+        new_pool.wait_time_max = self.wait_time_max
+        new_pool.timeouts_total = self.timeouts_total
+        return new_pool
+
+
+def create_engine_from_config(url: str = DATABASE_URL, **overrides: Any) -> AsyncEngine:
+    """
+    Единая фабрика async-движка: все параметры пула берутся из конфигурации.
+    Используется и API, и фоновыми задачами — один пул на процесс.
+    """
+    connect_args: Dict[str, Any] = {}
+    if DB_STATEMENT_TIMEOUT_MS > 0:
+        connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+
+    params: Dict[str, Any] = dict(
+        echo=DB_ECHO,
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+    params.update(overrides)
+    return create_async_engine(url, **params)
+
+
+def get_pool_stats(target: Optional[AsyncEngine] = None) -> Dict[str, Any]:
+    """
+    Текущее состояние пула соединений: занятые/свободные соединения, overflow и время ожидания.
+    """
+    pool = (target or engine).pool
+    stats: Dict[str, Any] = {
+        "pool_class": type(pool).__name__,
+        "size": pool.size() if hasattr(pool, "size") else None,
+        "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+        "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+        "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+        "max_overflow": getattr(pool, "_max_overflow", None),
+    }
+    if isinstance(pool, InstrumentedQueuePool):
+        checkouts = pool.checkouts_total
+        stats.update({
+            "checkouts_total": checkouts,
+            "timeouts_total": pool.timeouts_total,
+            "wait_time_total_ms": round(pool.wait_time_total * 1000, 3),
+            "wait_time_avg_ms": round(pool.wait_time_total * 1000 / checkouts, 3) if checkouts else 0.0,
+            "wait_time_max_ms": round(pool.wait_time_max * 1000, 3),
+        })
+    return stats
+
+
+engine = create_engine_from_config()
 
 SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 
+# Движок реплики создаётся только если она настроена
+replica_engine: Optional[AsyncEngine] = create_engine_from_config(DB_REPLICA_URL) if DB_REPLICA_URL else None
+
+ReadOnlySessionLocal = (
+    async_sessionmaker(bind=replica_engine, class_=AsyncSession, expire_on_commit=False)
+    if replica_engine is not None else SessionLocal
+)
+
 Base = declarative_base()
 
 async def get_db():
     async with SessionLocal() as session:
         yield session
+
+
+async def _open_readonly_session() -> AsyncSession:
+    """
+    Открывает сессию на реплике; если реплика не настроена или недоступна — на основной БД.
+    """
+    if replica_engine is None:
+        return SessionLocal()
+
+    session = ReadOnlySessionLocal()
+    try:
+        await session.connection()
+        return session
+    except (DBAPIError, PoolTimeoutError, OSError) as e:
+        logger.warning(f"Реплика БД недоступна, чтение переключено на основную БД: {e}")
+        await session.close()
+        return SessionLocal()
+
+
+async def get_db_readonly():
+    """
+    Зависимость для GET-эндпоинтов: сессия только для чтения (реплика с откатом на основную БД).
+    """
+    session = await _open_readonly_session()
+    async with session:
+        yield session
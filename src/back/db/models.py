@@ -1,5 +1,5 @@
 from sqlalchemy import (
-    JSON, Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Enum, Numeric, BigInteger, func
+    JSON, Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Enum, Numeric, BigInteger, Index, UniqueConstraint, func
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.asyncio import AsyncAttrs
@@ -69,6 +69,26 @@ class User(AsyncAttrs, Base):
     notifications = relationship("Notification", back_populates="user", cascade="all, delete-orphan")
     tasks = relationship("Task", back_populates="assigned_user", foreign_keys="[Task.assigned_user_id]")
     reports = relationship("TaskReport", back_populates="author", cascade="all, delete-orphan")
+    skills = relationship("UserSkill", back_populates="user", cascade="all, delete-orphan")
+
+
+class UserSkill(AsyncAttrs, Base):
+    """
+    Навык монтажника: категория работ (WorkType.category), которую он выполняет.
+    """
+    __tablename__ = "user_skills"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    category = Column(String, nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), default=now_ekb)
+
+    user = relationship("User", back_populates="skills")
+
+    __table_args__ = (
+        # уникальность заодно служит индексом для выборки навыков пользователя
+        UniqueConstraint("user_id", "category", name="uq_user_skills_user_category"),
+    )
     
 
 # TASKS
@@ -80,6 +100,8 @@ class Task(AsyncAttrs, Base):
     id = Column(Integer, primary_key=True)
     created_at = Column(DateTime(timezone=True), default=now_ekb)
     scheduled_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    # scheduled_at, для которого уже отправлено напоминание; при переносе задачи напоминание снова становится ожидающим
+    reminder_sent_for = Column(DateTime(timezone=True), nullable=True)
     location = Column(String, nullable=True)
     contact_person_id = Column(Integer, ForeignKey("contact_persons.id", ondelete="SET NULL"), index=True, nullable=True)
     contact_person_phone = Column(String, nullable=True)
@@ -129,7 +151,7 @@ class WorkType(AsyncAttrs, Base):
     name = Column(String, nullable=False)                      # Название работы (АТ, тахография и т.д.)
     created_at = Column(DateTime(timezone=True), default=now_ekb)
     client_price = Column(Numeric(10, 2), nullable=False)
-    category = Column(String,nullable=True)
+    category = Column(String,nullable=True, index=True)
     mont_price = Column(Numeric(10,2),nullable=False)
     is_active = Column(Boolean, default=True)                  # Активен ли тип работы
     tech_supp_require = Column(Boolean,default=False)
@@ -176,10 +198,25 @@ class TaskAttachment(AsyncAttrs, Base):
     uploaded_at = Column(DateTime(timezone=True), default=now_ekb)
     deleted_at = Column(DateTime(timezone=True), nullable=True)      # soft delete
 
+    # очередь обработки (back.files.processing_queue): NULL — не в очереди, иначе момент следующей попытки
+    process_after = Column(DateTime(timezone=True), nullable=True)
+    process_attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    # растёт при каждом захвате задания и никогда не сбрасывается — по нему воркер проверяет, что задание всё ещё его
+    process_token = Column(Integer, nullable=False, default=0, server_default="0")
+
     task = relationship("Task", back_populates="attachments")
     report = relationship("TaskReport")
     uploader = relationship("User")
 
+    __table_args__ = (
+        # частичный индекс: в нём только строки, стоящие в очереди
+        Index(
+            "ix_task_attachments_process_queue",
+            "process_after",
+            postgresql_where=process_after.isnot(None),
+        ),
+    )
+
 
 class ClientCompany(AsyncAttrs, Base):
     __tablename__ = "client_companies"
@@ -343,10 +380,22 @@ class Notification(AsyncAttrs,Base):
     message = Column(Text,nullable=False)
     created_at = Column(DateTime(timezone=True),default=now_ekb)
     is_sent = Column(Boolean,default=False)
+    # поля outbox: воркер забирает неотправленные записи, у которых подошло время попытки
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    next_attempt_at = Column(DateTime(timezone=True), default=now_ekb, server_default=func.now(), nullable=False)
+    last_error = Column(Text, nullable=True)
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+    # тип и данные уведомления для склейки однотипных событий (например, правок задачи)
+    kind = Column(String, nullable=True)
+    payload = Column(JSONB, nullable=True)
 
     user = relationship("User", back_populates="notifications")
     task = relationship("Task")
 
+    __table_args__ = (
+        Index("ix_notifications_outbox", "is_sent", "next_attempt_at"),
+    )
+
     
 
 
@@ -0,0 +1,85 @@
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from back.db.config import DB_SLOW_QUERY_MS, DB_N_PLUS_ONE_THRESHOLD, DB_N_PLUS_ONE_ASSERT
+
+logger = logging.getLogger(__name__)
+
+
+class RequestQueryStats:
+    """
+    Статистика SQL-запросов в рамках одного HTTP-запроса.
+    """
+
+    def __init__(self, route: str):
+        self.route = route
+        self.count = 0
+        self.total_time = 0.0
+        self.statements: Counter = Counter()
+
+    def repeated_statements(self, threshold: int = DB_N_PLUS_ONE_THRESHOLD) -> list:
+        return [(stmt, n) for stmt, n in self.statements.most_common() if n >= threshold]
+
+
+_current_stats: ContextVar[Optional[RequestQueryStats]] = ContextVar("db_request_stats", default=None)
+
+
+def _short_sql(statement: str, limit: int = 500) -> str:
+    text = " ".join(statement.split())
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_start_time"].pop()
+    elapsed = time.perf_counter() - started
+
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.total_time += elapsed
+        stats.statements[statement] += 1
+        if stats.statements[statement] == DB_N_PLUS_ONE_THRESHOLD:
+            logger.warning(
+                f"Возможный N+1 на {stats.route}: запрос выполнен {DB_N_PLUS_ONE_THRESHOLD} раз: {_short_sql(statement)}"
+            )
+
+    if elapsed * 1000 >= DB_SLOW_QUERY_MS:
+        route = stats.route if stats is not None else "-"
+        logger.warning(f"Медленный запрос ({elapsed * 1000:.1f} мс) на {route}: {_short_sql(statement)}")
+
+
+async def db_query_stats_middleware(request: Request, call_next):
+    """
+    Считает количество SQL-запросов и суммарное время БД на HTTP-запрос
+    и отдаёт их в заголовках X-DB-Queries / X-DB-Time (мс).
+    """
+    stats = RequestQueryStats(f"{request.method} {request.url.path}")
+    token = _current_stats.set(stats)
+    try:
+        response = await call_next(request)
+    finally:
+        _current_stats.reset(token)
+
+    response.headers["X-DB-Queries"] = str(stats.count)
+    response.headers["X-DB-Time"] = f"{stats.total_time * 1000:.2f}"
+
+    if DB_N_PLUS_ONE_ASSERT:
+        repeated = stats.repeated_statements()
+        assert not repeated, (
+            f"N+1 на {stats.route}: "
+            + "; ".join(f"{n}x {_short_sql(stmt, 200)}" for stmt, n in repeated)
+        )
+    return response
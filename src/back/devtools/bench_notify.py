@@ -0,0 +1,189 @@
+# back/devtools/bench_notify.py
+# Нагрузочный тест рассылок против локальной заглушки Bot API (back.devtools.fake_telegram).
+# Запуск (из каталога src):
+#   TELEGRAM_API_BASE_URL=http://127.0.0.1:8081 TOKEN=test python -m back.devtools.bench_notify --sizes 10,100,1000
+# С флагом --db дополнительно меряются notify_broadcast_task и доставка напоминаний через outbox:
+# во временной БД создаются монтажники bench_*, после прогона они удаляются.
+import argparse
+import asyncio
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import httpx
+from sqlalchemy import delete, func, select
+
+from back.db.database import SessionLocal, engine
+from back.db.models import Notification, Role, User
+from back.utils.notify import notify_broadcast_task, send_to_chats, telegram_client
+from back.utils.outbox import add_notification, drain_outbox_batch
+
+BENCH_CHAT_BASE = 9_000_000_000
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+async def _fake_stats(control: httpx.AsyncClient, since: Optional[float] = None) -> Dict:
+    response = await control.get("/_control/stats", params={"since": since} if since else None)
+    response.raise_for_status()
+    return response.json()
+
+
+async def _measure(name: str, size: int, control: httpx.AsyncClient, run) -> Dict:
+    await control.post("/_control/reset")
+    telegram_client.reset_stats()
+    started_wall = time.time()
+    started = time.perf_counter()
+    await run()
+    elapsed = time.perf_counter() - started
+
+    fake = await _fake_stats(control, since=started_wall)
+    delivery = [t - started_wall for t in fake["delivered_at"]]
+    client = telegram_client.stats()
+    return {
+        "job": name,
+        "recipients": size,
+        "delivered": fake["sent_total"],
+        "elapsed_s": round(elapsed, 3),
+        "throughput_msg_s": round(fake["sent_total"] / elapsed, 1) if elapsed else 0.0,
+        "delivery_p50_s": round(_percentile(delivery, 50), 3),
+        "delivery_p95_s": round(_percentile(delivery, 95), 3),
+        "delivery_p99_s": round(_percentile(delivery, 99), 3),
+        "delivery_max_s": round(max(delivery), 3) if delivery else 0.0,
+        "request_avg_ms": client["latency_avg_ms"],
+        "request_max_ms": client["latency_max_ms"],
+        "requests": client["requests_total"],
+        "responses_429": fake["errors_429"],
+        "responses_5xx": fake["errors_5xx"],
+    }
+
+
+async def bench_fanout(size: int, control: httpx.AsyncClient) -> Dict:
+    """
+    Отправка одного сообщения size получателям — тот же путь, что у notify_broadcast_task
+    после выборки получателей, без обращения к БД.
+    """
+    chat_ids = {i: BENCH_CHAT_BASE + i for i in range(size)}
+
+    async def run():
+        await send_to_chats(chat_ids, "Бенчмарк: новая задача опубликована")
+
+    return await _measure("fanout", size, control, run)
+
+
+async def _create_bench_users(prefix: str, size: int) -> List[int]:
+    async with SessionLocal() as db:
+        users = [
+            User(
+                name="Bench",
+                lastname=str(i),
+                role=Role.montajnik,
+                is_active=True,
+                login=f"{prefix}{i}"[:30],
+                hashed_password="!",
+                telegram_id=BENCH_CHAT_BASE + i,
+            )
+            for i in range(size)
+        ]
+        db.add_all(users)
+        await db.commit()
+        return [u.id for u in users]
+
+
+async def _drop_bench_users(prefix: str) -> None:
+    async with SessionLocal() as db:
+        await db.execute(delete(User).where(User.login.like(f"{prefix}%")))
+        await db.commit()
+
+
+async def bench_broadcast_task(size: int, control: httpx.AsyncClient, prefix: str) -> Dict:
+    await _create_bench_users(prefix, size)
+    try:
+        async def run():
+            # несуществующая задача без работ — подходят все активные монтажники
+            await notify_broadcast_task(0, message="Бенчмарк: рассылка задачи")
+
+        return await _measure("notify_broadcast_task", size, control, run)
+    finally:
+        await _drop_bench_users(prefix)
+
+
+async def bench_reminders(size: int, control: httpx.AsyncClient, prefix: str, timeout: float) -> Dict:
+    """
+    Напоминания уходят через outbox: кладём size уведомлений и меряем, за сколько воркер их разберёт.
+    """
+    user_ids = await _create_bench_users(prefix, size)
+    try:
+        async with SessionLocal() as db:
+            for user_id in user_ids:
+                add_notification(db, user_id, "Бенчмарк: задача начнется примерно через час")
+            await db.commit()
+
+        async def run():
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                if await drain_outbox_batch():
+                    continue
+                async with SessionLocal() as db:
+                    pending = await db.scalar(
+                        select(func.count(Notification.id)).where(
+                            Notification.user_id.in_(user_ids),
+                            Notification.is_sent == False,
+                        )
+                    )
+                if not pending:
+                    return
+                # часть строк отложена по retry_after/backoff — ждём и разбираем дальше
+                await asyncio.sleep(0.2)
+
+        return await _measure("reminders_outbox", size, control, run)
+    finally:
+        await _drop_bench_users(prefix)
+
+
+def _print_table(rows: List[Dict]) -> None:
+    if not rows:
+        return
+    columns = list(rows[0].keys())
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row[c]).ljust(widths[c]) for c in columns))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест рассылок Telegram")
+    parser.add_argument("--sizes", default="10,100,1000", help="количество получателей через запятую")
+    parser.add_argument("--db", action="store_true", help="также мерить notify_broadcast_task и outbox (нужна тестовая БД)")
+    parser.add_argument("--timeout", type=float, default=600, help="предел на разбор outbox, секунды")
+    args = parser.parse_args()
+
+    if "api.telegram.org" in telegram_client.base_url:
+        raise SystemExit("TELEGRAM_API_BASE_URL указывает на настоящий Telegram — запустите заглушку back.devtools.fake_telegram")
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    rows = []
+    await telegram_client.start()
+    try:
+        async with httpx.AsyncClient(base_url=telegram_client.base_url) as control:
+            print(f"Заглушка: {(await _fake_stats(control))['config']}")
+            for size in sizes:
+                rows.append(await bench_fanout(size, control))
+                if args.db:
+                    prefix = f"bench_{uuid.uuid4().hex[:6]}_"
+                    rows.append(await bench_broadcast_task(size, control, prefix))
+                    rows.append(await bench_reminders(size, control, prefix, args.timeout))
+    finally:
+        await telegram_client.close()
+        await engine.dispose()
+    _print_table(rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,224 @@
+# back/devtools/fake_telegram.py
+# Локальная заглушка Telegram Bot API для нагрузочных тестов рассылок.
+# Запуск (из каталога src): python -m back.devtools.fake_telegram --port 8081 --latency-ms 50 --rate-429 0.05
+# Приложение указывает на неё через TELEGRAM_API_BASE_URL=http://127.0.0.1:8081
+import argparse
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
+
+
+class FakeTelegramState:
+    """
+    Настройки сбоев и статистика заглушки. Меняются на лету через /_control/config.
+    """
+
+    def __init__(self):
+        self.latency_ms = 0.0
+        self.jitter_ms = 0.0
+        self.rate_429 = 0.0
+        self.retry_after = 1
+        self.rate_5xx = 0.0
+        self.global_rate = 0.0  # сообщений в секунду; 0 — без ограничения, иначе 429 как у Telegram
+        self.reset()
+
+    def reset(self) -> None:
+        self.requests_total = 0
+        self.sent_total = 0
+        self.errors_429 = 0
+        self.errors_5xx = 0
+        self.chats: Dict[str, int] = {}
+        # время приёма сообщений (time.time()) — по нему бенчмарк считает задержку доставки
+        self.delivered_at: deque = deque(maxlen=100000)
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._message_id = 0
+        self._update_id = 0
+        self.updates: asyncio.Queue = asyncio.Queue()
+
+    def config(self) -> Dict[str, Any]:
+        return {
+            "latency_ms": self.latency_ms,
+            "jitter_ms": self.jitter_ms,
+            "rate_429": self.rate_429,
+            "retry_after": self.retry_after,
+            "rate_5xx": self.rate_5xx,
+            "global_rate": self.global_rate,
+        }
+
+    def over_global_rate(self) -> bool:
+        if self.global_rate <= 0:
+            return False
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start = now
+            self._window_count = 0
+        self._window_count += 1
+        return self._window_count > self.global_rate
+
+
+state = FakeTelegramState()
+app = FastAPI(title="Fake Telegram Bot API")
+
+
+def _ok(result: Any) -> Dict[str, Any]:
+    return {"ok": True, "result": result}
+
+
+def _too_many_requests() -> JSONResponse:
+    state.errors_429 += 1
+    return JSONResponse(
+        status_code=429,
+        content={
+            "ok": False,
+            "error_code": 429,
+            "description": f"Too Many Requests: retry after {state.retry_after}",
+            "parameters": {"retry_after": state.retry_after},
+        },
+    )
+
+
+async def _params(request: Request) -> Dict[str, Any]:
+    if request.method == "GET":
+        return dict(request.query_params)
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        body = await request.body()
+        return await request.json() if body else {}
+    form = await request.form()
+    return dict(form)
+
+
+async def _simulate_network() -> None:
+    delay = state.latency_ms + random.uniform(-state.jitter_ms, state.jitter_ms)
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+
+
+async def _send_message(params: Dict[str, Any]):
+    if state.over_global_rate() or random.random() < state.rate_429:
+        return _too_many_requests()
+    if random.random() < state.rate_5xx:
+        state.errors_5xx += 1
+        return JSONResponse(
+            status_code=502,
+            content={"ok": False, "error_code": 502, "description": "Bad Gateway"},
+        )
+
+    chat_id = str(params.get("chat_id"))
+    state.sent_total += 1
+    state.chats[chat_id] = state.chats.get(chat_id, 0) + 1
+    state.delivered_at.append(time.time())
+    state._message_id += 1
+    return _ok({
+        "message_id": state._message_id,
+        "date": int(time.time()),
+        "chat": {"id": params.get("chat_id"), "type": "private"},
+        "text": params.get("text"),
+    })
+
+
+async def _get_updates(params: Dict[str, Any]):
+    timeout = float(params.get("timeout") or 0)
+    updates = []
+    try:
+        if state.updates.empty() and timeout > 0:
+            updates.append(await asyncio.wait_for(state.updates.get(), timeout=timeout))
+        while not state.updates.empty():
+            updates.append(state.updates.get_nowait())
+    except asyncio.TimeoutError:
+        pass
+    offset = int(params.get("offset") or 0)
+    return _ok([u for u in updates if u["update_id"] >= offset])
+
+
+@app.api_route("/bot{token}/{method}", methods=["GET", "POST"])
+async def bot_api(token: str, method: str, request: Request):
+    state.requests_total += 1
+    params = await _params(request)
+    await _simulate_network()
+
+    if method == "sendMessage":
+        return await _send_message(params)
+    if method == "getUpdates":
+        return await _get_updates(params)
+    if method == "getMe":
+        return _ok({"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"})
+    if method in ("deleteWebhook", "setWebhook", "close", "logOut"):
+        return _ok(True)
+    return JSONResponse(
+        status_code=404,
+        content={"ok": False, "error_code": 404, "description": f"Not Found: method {method} is not emulated"},
+    )
+
+
+@app.get("/_control/stats")
+async def control_stats(since: Optional[float] = None):
+    delivered = [t for t in state.delivered_at if since is None or t >= since]
+    return {
+        "config": state.config(),
+        "requests_total": state.requests_total,
+        "sent_total": state.sent_total,
+        "errors_429": state.errors_429,
+        "errors_5xx": state.errors_5xx,
+        "unique_chats": len(state.chats),
+        "delivered_at": delivered,
+    }
+
+
+@app.post("/_control/config")
+async def control_config(request: Request):
+    data = await request.json()
+    for key, value in data.items():
+        if key in state.config():
+            setattr(state, key, type(getattr(state, key))(value))
+    return state.config()
+
+
+@app.post("/_control/reset")
+async def control_reset():
+    state.reset()
+    return {"ok": True}
+
+
+@app.post("/_control/updates")
+async def control_push_update(request: Request):
+    """
+    Положить апдейт в очередь getUpdates (например, сообщение /start для проверки бота).
+    """
+    update = await request.json()
+    state._update_id += 1
+    update.setdefault("update_id", state._update_id)
+    await state.updates.put(update)
+    return {"ok": True, "update_id": update["update_id"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная заглушка Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="задержка ответа")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="разброс задержки, +-")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429 (0..1)")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, секунды")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="доля ответов 502 (0..1)")
+    parser.add_argument("--global-rate", type=float, default=0.0, help="лимит сообщений в секунду (0 — без лимита)")
+    args = parser.parse_args()
+
+    state.latency_ms = args.latency_ms
+    state.jitter_ms = args.jitter_ms
+    state.rate_429 = args.rate_429
+    state.retry_after = args.retry_after
+    state.rate_5xx = args.rate_5xx
+    state.global_rate = args.global_rate
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
-import json
 from fastapi import APIRouter, Body, Depends, HTTPException, BackgroundTasks, UploadFile, File, Query
 from pydantic import BaseModel, Field
 from typing import List, Optional, Any, Dict
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import Text, cast, func, insert, select, update
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from datetime import datetime, timezone
 from back.db.database import get_db
 from back.auth.auth import get_current_user
@@ -14,7 +14,8 @@ from back.db.models import FileType
 import aiofiles
 import hashlib
 from sqlalchemy.orm import selectinload
-from back.files.handlers import delete_object_from_s3, validate_and_process_attachment
+from back.files.handlers import delete_object_from_s3
+from back.files.processing_queue import queued_values, wake_attachment_worker
 from fastapi import Path
 from back.files.handlers import delete_object_from_s3
 
@@ -54,12 +55,69 @@ class AttachmentOut(BaseModel):
     storage_key: str
     presigned_url: Optional[str] = None
     thumb_key: Optional[str] = None
+    thumb_url: Optional[str] = None
     uploader_id: Optional[int] = None
     uploaded_at: Optional[datetime] = None
     size: Optional[int] = None
     original_name: Optional[str] = None
 
 
+async def _attachments_with_urls(items: List[TaskAttachment]) -> List[AttachmentOut]:
+    """
+    Ссылки на оригиналы и миниатюры для всего списка одним вызовом presign_get_many.
+    """
+    s3 = get_s3_client()
+    keys = [it.storage_key for it in items] + [it.thumb_key for it in items if it.thumb_key]
+    try:
+        urls = await s3.presign_get_many(keys, expires=15000)
+    except Exception:
+        urls = {}
+    return [
+        AttachmentOut(
+            id=it.id,
+            storage_key=it.storage_key,
+            presigned_url=urls.get(it.storage_key),
+            thumb_key=it.thumb_key,
+            thumb_url=urls.get(it.thumb_key) if it.thumb_key else None,
+            uploader_id=it.uploader_id,
+            uploaded_at=it.uploaded_at,
+            size=it.size,
+            original_name=it.original_name,
+        )
+        for it in items
+    ]
+
+
+async def _insert_attachment(db: AsyncSession, values: Dict[str, Any], report_id: Optional[int] = None) -> int:
+    """
+    Вставляет TaskAttachment через INSERT ... RETURNING и, если указан отчёт,
+    в той же транзакции пересобирает его photos_json одним UPDATE.
+    Коммит — один, без refresh и повторного чтения ключей.
+    """
+    attach_id = (await db.execute(
+        insert(TaskAttachment).values(**values).returning(TaskAttachment.id)
+    )).scalar_one()
+
+    if report_id:
+        keys_subq = (
+            select(func.coalesce(
+                cast(func.json_agg(aggregate_order_by(TaskAttachment.storage_key, TaskAttachment.id)), Text),
+                "[]",
+            ))
+            .where(TaskAttachment.report_id == report_id)
+            .scalar_subquery()
+        )
+        await db.execute(
+            update(TaskReport)
+            .where(TaskReport.id == report_id)
+            .values(photos_json=keys_subq)
+            .execution_options(synchronize_session=False)
+        )
+
+    await db.commit()
+    return attach_id
+
+
 @router.post("/init-multipart", response_model=InitMultipartOut)
 async def init_multipart(
     payload: InitMultipartIn = Body(...),
@@ -149,8 +207,8 @@ async def complete_multipart(
         if not report or report.author_id != current_user.id or current_user.role != Role.montajnik:
             raise HTTPException(status_code=403, detail="Недостаточно прав для добавления вложения к отчёту")
 
-    # Создаём запись TaskAttachment
-    attach = TaskAttachment(
+    # Создаём запись TaskAttachment и обновляем photos_json отчёта (report уже проверен выше)
+    attach_id = await _insert_attachment(db, dict(
         task_id=payload.task_id if payload.task_id is not None else 0,
         report_id=payload.report_id,  # Указываем report_id если есть
         storage_key=payload.storage_key,
@@ -161,27 +219,12 @@ async def complete_multipart(
         uploader_id=getattr(current_user, "id", None),
         uploader_role=getattr(current_user, "role", None).value if getattr(current_user, "role", None) else None,
         processed=False,
-    )
-    db.add(attach)
-    await db.flush()
-    await db.commit()
-    await db.refresh(attach)
-
-    # --- НОВОЕ: Обновить photos_json у отчёта ---
-    if attach.report_id and report: # report уже загружен выше
-        # Получить все storage_key вложений этого отчёта
-        attachments_res = await db.execute(
-            select(TaskAttachment.storage_key)
-            .where(TaskAttachment.report_id == attach.report_id)
-        )
-        keys = [row[0] for row in attachments_res.fetchall()]
-        report.photos_json = json.dumps(keys)
-        await db.flush()
-        await db.commit()
+        **queued_values(),
+    ), report_id=report.id if report else None)
 
-    # запуск обработки: thumbnail, checksum, validation
-    background_tasks.add_task(validate_and_process_attachment, attach.id)
-    return {"attachment_id": attach.id, "storage_key": attach.storage_key}
+    # обработка (thumbnail, checksum, validation) — через очередь, запись в неё уже закоммичена
+    background_tasks.add_task(wake_attachment_worker)
+    return {"attachment_id": attach_id, "storage_key": payload.storage_key}
 
 
 
@@ -245,8 +288,8 @@ async def upload_fallback_report(
         content_disposition="inline"
     )
 
-    # Создаем запись в БД
-    attach = TaskAttachment(
+    # Создаем запись в БД и обновляем photos_json отчёта в той же транзакции
+    attach_id = await _insert_attachment(db, dict(
         task_id=task_id,
         report_id=report_id,  
         storage_key=key,
@@ -257,27 +300,13 @@ async def upload_fallback_report(
         uploader_id=getattr(current_user, "id", None),
         uploader_role=getattr(current_user, "role", None).value if getattr(current_user, "role", None) else None,
         processed=True,
-    )
-    db.add(attach)
-    await db.flush()
-    await db.commit()
-    await db.refresh(attach)
+        **queued_values(),
+    ), report_id=report.id if report else None)
 
-    # --- НОВОЕ: Обновить photos_json у отчёта ---
-    if attach.report_id and report:
-        attachments_res = await db.execute(
-            select(TaskAttachment.storage_key)
-            .where(TaskAttachment.report_id == attach.report_id)
-        )
-        keys = [row[0] for row in attachments_res.fetchall()]
-        report.photos_json = json.dumps(keys)
-        await db.flush()
-        await db.commit()
-
-    # Фоновая обработка
-    background_tasks.add_task(validate_and_process_attachment, attach.id)
+    # Фоновая обработка через очередь
+    background_tasks.add_task(wake_attachment_worker)
 
-    return {"attachment_id": attach.id, "storage_key": key}
+    return {"attachment_id": attach_id, "storage_key": key}
 
 # Список вложений задачи
 @router.get("/attachments/tasks/{task_id}/attachments", response_model=List[AttachmentOut])
@@ -299,25 +328,7 @@ async def list_attachments(
         .where(TaskAttachment.task_id == task_id, TaskAttachment.deleted_at.is_(None), TaskAttachment.processed == True)
     )
     items = res.scalars().all()
-    s3 = get_s3_client()
-    out = []
-    for it in items:
-        url = None
-        try:
-            url = await s3.presign_get(it.storage_key, expires=15000)  # 1 час
-        except Exception:
-            url = None
-        out.append(AttachmentOut(
-            id=it.id,
-            storage_key=it.storage_key,
-            presigned_url=url,  # ✅ Включаем предварительный URL
-            thumb_key=it.thumb_key,
-            uploader_id=it.uploader_id,
-            uploaded_at=it.uploaded_at,
-            size=it.size,
-            original_name=it.original_name,
-        ))
-    return out
+    return await _attachments_with_urls(items)
 
 
 @router.get("/reports/{report_id}/attachments", response_model=List[AttachmentOut])
@@ -368,25 +379,7 @@ async def list_report_attachments(
         .where(TaskAttachment.report_id == report_id, TaskAttachment.deleted_at.is_(None), TaskAttachment.processed == True)
     )
     items = res.scalars().all()
-    s3 = get_s3_client()
-    out = []
-    for it in items:
-        url = None
-        try:
-            url = await s3.presign_get(it.storage_key, expires=15000)  # 1 час
-        except Exception:
-            url = None
-        out.append(AttachmentOut(
-            id=it.id,
-            storage_key=it.storage_key,
-            presigned_url=url,
-            thumb_key=it.thumb_key,
-            uploader_id=it.uploader_id,
-            uploaded_at=it.uploaded_at,
-            size=it.size,
-            original_name=it.original_name,
-        ))
-    return out
+    return await _attachments_with_urls(items)
 
 
 # Удаление вложения (soft delete + background S3 delete)
@@ -1,97 +1,195 @@
 import asyncio
-from PIL import Image
+import base64
+import binascii
 from io import BytesIO
 import hashlib
-from sqlalchemy import select
+import logging
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from back.db.config import ATTACHMENT_STREAM_CHUNK_SIZE, THUMB_MAX_SOURCE_BYTES
 from back.db.database import SessionLocal, get_db
 from back.db.models import TaskAttachment
+from back.files.media import generate_thumbnail
 from back.utils.selectel import get_s3_client
 from datetime import datetime, timezone
 
-THUMB_WIDTH = 320
+logger = logging.getLogger(__name__)
 
 
-async def validate_and_process_attachment(attachment_id: int):
+class AttachmentProcessingError(Exception):
+    """
+    Временная ошибка обработки (S3 недоступен, пул процессов упал): результат не записывается,
+    очередь повторит задание позже, а после исчерпания попыток запишет текст в error_text.
+    """
+
+
+class AttachmentLeaseLost(Exception):
+    """
+    Задание успело перейти к другому воркеру (истекла аренда) — результат этой попытки не пишем.
+    """
+
+
+async def _ensure_owner(db: AsyncSession, attachment_id: int, token: Optional[int]) -> None:
+    """
+    Перед записью результата: блокирует строку и проверяет, что задание всё ещё у этого захвата
+    (process_token растёт при каждом захвате и не сбрасывается при повторной постановке в очередь).
+    token=None — вызов вне очереди, проверка не нужна.
+    """
+    if token is None:
+        return
+    current = await db.scalar(
+        select(TaskAttachment.process_token)
+        .where(TaskAttachment.id == attachment_id, TaskAttachment.process_after.isnot(None))
+        .with_for_update()
+    )
+    if current != token:
+        raise AttachmentLeaseLost(f"attachment {attachment_id}: claim {token} is no longer current")
+
+
+def _s3_sha256(meta: Dict[str, Any]) -> Optional[str]:
+    """
+    SHA-256 всего объекта из ответа head_object (hex) или None.
+    У multipart-загрузок ChecksumSHA256 бывает составным ("<base64>-<число частей>") —
+    это хэш хэшей частей, а не файла, такой не используем.
+    """
+    value = meta.get("ChecksumSHA256")
+    if not value or "-" in value or meta.get("ChecksumType") == "COMPOSITE":
+        return None
+    try:
+        digest = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return digest.hex() if len(digest) == 32 else None
+
+
+async def _stream_object(s3, key: str, want_sha: bool, want_data: bool):
+    """
+    Читает объект кусками по ATTACHMENT_STREAM_CHUNK_SIZE: считает SHA-256 на лету
+    и, если нужно для миниатюры, собирает байты (не больше THUMB_MAX_SOURCE_BYTES — это проверено по head).
+    Возвращает (sha256 hex или None, размер, bytes или None).
+    """
+    sha = hashlib.sha256() if want_sha else None
+    buf = BytesIO() if want_data else None
+    size = 0
+    async with s3.get_client() as client:
+        resp = await client.get_object(Bucket=s3.bucket_name, Key=key)
+        # контекст тела возвращает соединение в пул даже при ошибке посреди чтения
+        async with resp["Body"] as body:
+            while True:
+                chunk = await body.read(ATTACHMENT_STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if sha is not None:
+                    sha.update(chunk)
+                if buf is not None:
+                    buf.write(chunk)
+    return (sha.hexdigest() if sha is not None else None), size, (buf.getvalue() if buf is not None else None)
+
+
+async def _save_result(attachment_id: int, token: Optional[int], values: Dict[str, Any]) -> None:
+    """
+    Запись результата — короткой транзакцией: проверка владельца под блокировкой строки и один UPDATE.
+    """
     async with SessionLocal() as db:
         async with db.begin():
-            att = (await db.execute(
-                select(TaskAttachment).where(TaskAttachment.id == attachment_id)
-            )).scalars().first()
-            if not att:
-                print(f"[DEBUG] validate_and_process_attachment: attachment {attachment_id} not found") # <--- Добавить
-                return
-            print(f"[DEBUG] validate_and_process_attachment: processing {att.storage_key}, current processed={att.processed}") # <--- Добавить
-            s3 = get_s3_client()
-
-            # head
-            try:
-                meta = await s3.head_object(att.storage_key)
-            except Exception as e:
-                print(f"[DEBUG] S3 head failed: {e}") # <--- Добавить
-                att.error_text = f"S3 head failed: {e}"
-                att.processed = True # <--- Помечаем как обработанное, но с ошибкой
-                await db.flush()
-                return
-
-            # check content-type
-            ctype = meta.get("ContentType") or att.mime_type
-            if ctype not in ("image/jpeg", "image/png", "image/webp", "image/jpg"):
-                print(f"[DEBUG] Invalid content type: {ctype}") # <--- Добавить
-                att.error_text = f"Invalid content type: {ctype}"
-                att.processed = True # <--- Помечаем как обработанное, но с ошибкой
-                await db.flush()
-                return
-
-            # download object
-            try:
-                async with s3.get_client() as client:
-                    resp = await client.get_object(Bucket=s3.bucket_name, Key=att.storage_key)
-                    body_stream = resp["Body"]
-                    data = await body_stream.read()
-            except Exception as e:
-                print(f"[DEBUG] S3 get failed: {e}") # <--- Добавить
-                att.error_text = f"S3 get failed: {e}"
-                att.processed = True # <--- Помечаем как обработанное, но с ошибкой
-                await db.flush()
-                return
-
-            # compute checksum
-            sha = hashlib.sha256()
-            sha.update(data)
-            att.checksum = sha.hexdigest()
-            att.size = len(data)
-
-            # generate thumbnail
+            await _ensure_owner(db, attachment_id, token)
+            await db.execute(
+                update(TaskAttachment)
+                .where(TaskAttachment.id == attachment_id)
+                .values(**values, processed=True, process_after=None)
+                .execution_options(synchronize_session=False)
+            )
+
+
+async def validate_and_process_attachment(attachment_id: int, token: Optional[int] = None):
+    """
+    token — токен захвата из очереди обработки; результат записывается, только если
+    задание не перехватил другой воркер.
+    Обращения к S3, хэширование и миниатюра идут без открытой транзакции и без соединения с БД:
+    строка читается отдельным запросом, результат пишется в конце через _save_result.
+    """
+    async with SessionLocal() as db:
+        att = (await db.execute(
+            select(TaskAttachment.storage_key, TaskAttachment.mime_type, TaskAttachment.processed)
+            .where(TaskAttachment.id == attachment_id)
+        )).first()
+    if not att:
+        print(f"[DEBUG] validate_and_process_attachment: attachment {attachment_id} not found") # <--- Добавить
+        return
+    print(f"[DEBUG] validate_and_process_attachment: processing {att.storage_key}, current processed={att.processed}") # <--- Добавить
+    s3 = get_s3_client()
+
+    # head (вместе с контрольной суммой, если хранилище её сохранило)
+    try:
+        meta = await s3.head_object(att.storage_key, checksum=True)
+    except Exception as e:
+        print(f"[DEBUG] S3 head failed: {e}") # <--- Добавить
+        raise AttachmentProcessingError(f"S3 head failed: {e}") from e
+
+    # check content-type
+    ctype = meta.get("ContentType") or att.mime_type
+    if ctype not in ("image/jpeg", "image/png", "image/webp", "image/jpg"):
+        print(f"[DEBUG] Invalid content type: {ctype}") # <--- Добавить
+        # Помечаем как обработанное, но с ошибкой
+        await _save_result(attachment_id, token, {"error_text": f"Invalid content type: {ctype}"})
+        return
+
+    content_length = meta.get("ContentLength")
+    checksum = _s3_sha256(meta)
+    # миниатюру делаем только из картинок разумного размера — байты для неё держим в памяти
+    want_thumb = content_length is not None and content_length <= THUMB_MAX_SOURCE_BYTES
+    data = None
+
+    # download object — только если нужна контрольная сумма или миниатюра
+    if checksum is None or want_thumb:
+        try:
+            sha, size, data = await _stream_object(
+                s3, att.storage_key, want_sha=checksum is None, want_data=want_thumb
+            )
+        except Exception as e:
+            print(f"[DEBUG] S3 get failed: {e}") # <--- Добавить
+            raise AttachmentProcessingError(f"S3 get failed: {e}") from e
+        checksum = checksum or sha
+        content_length = size
+
+    result: Dict[str, Any] = {"checksum": checksum, "size": content_length, "error_text": None}
+
+    # generate thumbnail
+    if not want_thumb:
+        # это не ошибка: большой файл просто остаётся без превью (thumb_key пустой)
+        logger.info(f"Вложение {attachment_id}: превью не создаётся, объект больше {THUMB_MAX_SOURCE_BYTES} байт")
+    else:
+        thumb_bytes = None
+        try:
+            thumb_bytes = await generate_thumbnail(data)
+        except BrokenProcessPool as e:
+            raise AttachmentProcessingError(f"Media pool failed: {e}") from e
+        except Exception as e:
+            # битое или неподдерживаемое изображение — повтор не поможет
+            print(f"[DEBUG] Thumb generation failed: {e}") # <--- Добавить
+            result["error_text"] = f"Thumb generation failed: {e}"
+        finally:
+            data = None
+
+        if thumb_bytes is not None:
+            thumb_key = att.storage_key + ".thumb.webp"
             try:
-                im = Image.open(BytesIO(data))
-                # конвертация только если нужно
-                if im.mode in ("RGBA", "LA", "P"):
-                    im = im.convert("RGB")
-                im.thumbnail((320, 320))
-                buf = BytesIO()
-                im.save(buf, format="WEBP", quality=80)
-                buf.seek(0)
-                thumb_bytes = buf.read()
-                thumb_key = att.storage_key + ".thumb.webp"
                 await s3.put_object(
                     thumb_key,
                     thumb_bytes,
                     content_type="image/webp",
                     content_disposition="inline"
                 )
-                att.thumb_key = thumb_key
-                print(f"[DEBUG] Thumbnail generated: {thumb_key}") # <--- Добавить
             except Exception as e:
-                print(f"[DEBUG] Thumb generation failed: {e}") # <--- Добавить
-                att.error_text = f"Thumb generation failed: {e}"
-
-            att.processed = True
-            att.error_text = att.error_text or None
-            await db.flush()
-            print(f"[DEBUG] Attachment {att.id} marked as processed=True") # <--- Добавить
+                raise AttachmentProcessingError(f"S3 thumb upload failed: {e}") from e
+            result["thumb_key"] = thumb_key
+            print(f"[DEBUG] Thumbnail generated: {thumb_key}") # <--- Добавить
 
-            
+    await _save_result(attachment_id, token, result)
+    print(f"[DEBUG] Attachment {attachment_id} marked as processed=True") # <--- Добавить
 
 
 async def delete_object_from_s3(storage_key: str):
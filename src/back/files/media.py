@@ -0,0 +1,107 @@
+# back/files/media.py
+# Пул процессов для обработки изображений: декодирование и сжатие Pillow не блокируют event loop.
+# Модуль импортируется в дочерних процессах, поэтому здесь нет зависимостей от БД и S3.
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Optional
+
+from PIL import Image
+
+from back.db.config import MEDIA_POOL_WORKERS, MEDIA_QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+THUMB_WIDTH = 320
+
+_pool: Optional[ProcessPoolExecutor] = None
+_slots: Optional[asyncio.Semaphore] = None
+
+
+def make_thumbnail(data: bytes, size: int = THUMB_WIDTH) -> bytes:
+    """
+    WEBP-миниатюра не больше size x size. Выполняется в дочернем процессе.
+    """
+    im = Image.open(BytesIO(data))
+    # для JPEG декодер сразу уменьшает картинку в 2/4/8 раз — полный кадр в память не разворачивается
+    im.draft("RGB", (size, size))
+    # конвертация только если нужно
+    if im.mode in ("RGBA", "LA", "P"):
+        im = im.convert("RGB")
+    im.thumbnail((size, size))
+    buf = BytesIO()
+    im.save(buf, format="WEBP", quality=80)
+    return buf.getvalue()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: fork процесса с запущенным event loop и потоками драйверов небезопасен
+        _pool = ProcessPoolExecutor(
+            max_workers=MEDIA_POOL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def _get_slots() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(MEDIA_QUEUE_DEPTH)
+    return _slots
+
+
+def _noop() -> None:
+    pass
+
+
+def start_media_pool() -> None:
+    """
+    Прогрев пула при старте воркера вложений: с контекстом spawn процессы запускаются
+    только на submit, поэтому отправляем по пустой задаче на каждый процесс —
+    первая миниатюра не ждёт запуска интерпретатора и импорта Pillow.
+    Без прогрева пул создаётся при первом обращении.
+    """
+    pool = _get_pool()
+    for _ in range(MEDIA_POOL_WORKERS):
+        pool.submit(_noop)
+
+
+def shutdown_media_pool() -> None:
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _replace_broken_pool(broken: ProcessPoolExecutor) -> None:
+    """
+    Пересоздаёт пул, только если он всё ещё тот, что сломался: упавший процесс
+    роняет все задачи в пуле, и пересоздать его должна лишь первая из них.
+    """
+    global _pool
+    if _pool is broken:
+        logger.warning("Пул обработки изображений сломан, пересоздаём")
+        _pool = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+
+async def generate_thumbnail(data: bytes, size: int = THUMB_WIDTH) -> bytes:
+    """
+    Миниатюра в пуле процессов. Одновременно в пуле (в работе и в очереди) не больше
+    MEDIA_QUEUE_DEPTH задач, остальные ждут здесь — вместе с байтами исходника,
+    которые иначе копились бы в очереди пула.
+    """
+    async with _get_slots():
+        loop = asyncio.get_running_loop()
+        pool = _get_pool()
+        try:
+            return await loop.run_in_executor(pool, make_thumbnail, data, size)
+        except BrokenProcessPool:
+            # дочерний процесс убит (OOM, сигнал) — пересоздаём пул и пробуем ещё раз
+            _replace_broken_pool(pool)
+            return await loop.run_in_executor(_get_pool(), make_thumbnail, data, size)
@@ -0,0 +1,314 @@
+# back/files/processing_queue.py
+# Очередь обработки вложений в самой таблице task_attachments: строка стоит в очереди,
+# пока у неё задан process_after. Запись в очередь — тем же commit, что и создание вложения,
+# поэтому рестарт процесса не теряет задания (в отличие от BackgroundTasks).
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, func, or_, select, update
+
+from back.db.config import (
+    ATTACHMENT_WORKER_CONCURRENCY,
+    ATTACHMENT_WORKER_POLL_INTERVAL,
+    ATTACHMENT_JOB_TIMEOUT,
+    ATTACHMENT_JOB_MAX_ATTEMPTS,
+    ATTACHMENT_JOB_BACKOFF_BASE,
+    ATTACHMENT_JOB_BACKOFF_MAX,
+)
+from back.db.database import SessionLocal
+from back.db.models import TaskAttachment, now_ekb
+from back.files.handlers import AttachmentLeaseLost, validate_and_process_attachment
+from back.utils.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+ATTACHMENTS_CHANNEL = "attachments_queued"
+
+
+# --- Постановка в очередь ---
+
+def queued_values() -> Dict:
+    """
+    Поля новой строки TaskAttachment, ставящие её в очередь (для insert().values и конструктора модели).
+    Сбрасывается только счётчик попыток; process_token не трогаем — это признак владельца задания.
+    """
+    return {"process_after": now_ekb(), "process_attempts": 0}
+
+
+def enqueue_attachment(att: TaskAttachment) -> None:
+    """
+    Поставить уже загруженное из БД вложение в очередь; фиксируется commit'ом вызывающего.
+    """
+    att.process_after = now_ekb()
+    att.process_attempts = 0
+
+
+async def wake_attachment_worker() -> None:
+    """
+    Разбудить воркеры после commit, чтобы задание не ждало страховочного опроса.
+    """
+    try:
+        await redis_client.publish(ATTACHMENTS_CHANNEL, "1")
+    except Exception as e:
+        # воркер всё равно заберёт задание через ATTACHMENT_WORKER_POLL_INTERVAL
+        logger.warning(f"Не удалось разбудить воркер обработки вложений: {e}")
+
+
+# --- Воркер ---
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(ATTACHMENT_JOB_BACKOFF_MAX, ATTACHMENT_JOB_BACKOFF_BASE * 2 ** max(attempts - 1, 0)))
+
+
+def _due_jobs(*conditions, limit: Optional[int] = None):
+    query = (
+        select(TaskAttachment.id)
+        .where(
+            TaskAttachment.process_after <= func.now(),
+            TaskAttachment.deleted_at.is_(None),
+            *conditions,
+        )
+        .order_by(TaskAttachment.process_after, TaskAttachment.id)
+        .with_for_update(skip_locked=True)
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    return query.scalar_subquery()
+
+
+async def claim_attachment_jobs(limit: int) -> List[Tuple[int, int, int]]:
+    """
+    Забрать до limit готовых заданий. Строки выбираются FOR UPDATE SKIP LOCKED и сразу
+    сдвигаются на ATTACHMENT_JOB_TIMEOUT вперёд с учётом попытки — блокировка не держится
+    на время обработки, а задание упавшего воркера само вернётся в очередь по таймауту.
+    Задания, исчерпавшие попытки без записанного результата (воркер падал на них каждый раз),
+    здесь же уходят в dead letter.
+    Возвращает [(attachment_id, токен владельца, номер попытки)].
+    """
+    async with SessionLocal() as db:
+        dead = await db.execute(
+            update(TaskAttachment)
+            .where(TaskAttachment.id.in_(_due_jobs(TaskAttachment.process_attempts >= ATTACHMENT_JOB_MAX_ATTEMPTS)))
+            .values(
+                process_after=None,
+                processed=True,
+                error_text=func.concat(
+                    "Dead letter after ", TaskAttachment.process_attempts, " attempts: job timed out without a result"
+                ),
+            )
+            .returning(TaskAttachment.id)
+            .execution_options(synchronize_session=False)
+        )
+        dead_ids = dead.scalars().all()
+        if dead_ids:
+            logger.error(f"Вложения {dead_ids}: попытки исчерпаны, воркер не вернул результат")
+
+        result = await db.execute(
+            update(TaskAttachment)
+            .where(TaskAttachment.id.in_(_due_jobs(limit=limit)))
+            .values(
+                process_after=func.now() + timedelta(seconds=ATTACHMENT_JOB_TIMEOUT),
+                process_attempts=TaskAttachment.process_attempts + 1,
+                process_token=TaskAttachment.process_token + 1,
+            )
+            .returning(TaskAttachment.id, TaskAttachment.process_token, TaskAttachment.process_attempts)
+            .execution_options(synchronize_session=False)
+        )
+        jobs = [(row.id, row.process_token, row.process_attempts) for row in result.all()]
+        await db.commit()
+        return jobs
+
+
+async def _record_failure(attachment_id: int, token: int, attempt: int, error: str) -> None:
+    """
+    Повтор с экспоненциальной паузой или, после ATTACHMENT_JOB_MAX_ATTEMPTS, dead letter:
+    строка выходит из очереди, а ошибка остаётся в error_text.
+    """
+    error = error[:1000]
+    if attempt >= ATTACHMENT_JOB_MAX_ATTEMPTS:
+        values = dict(
+            process_after=None,
+            processed=True,
+            error_text=f"Dead letter after {attempt} attempts: {error}",
+        )
+        logger.error(f"Вложение {attachment_id}: попытки исчерпаны ({attempt}), {error}")
+    else:
+        values = dict(
+            process_after=func.now() + _backoff(attempt),
+            error_text=f"Attempt {attempt} failed: {error}",
+        )
+        logger.warning(f"Вложение {attachment_id}: попытка {attempt} не удалась, {error}")
+    async with SessionLocal() as db:
+        await db.execute(
+            update(TaskAttachment)
+            .where(TaskAttachment.id == attachment_id, TaskAttachment.process_token == token)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+
+
+async def _extend_lease(attachment_id: int, token: int) -> None:
+    """
+    Продлевает аренду задания, пока идёт обработка (потоковое чтение большого объекта
+    может длиться дольше ATTACHMENT_JOB_TIMEOUT). Строку, уже снятую с очереди
+    или перехваченную другим воркером, не трогает.
+    """
+    while True:
+        await asyncio.sleep(ATTACHMENT_JOB_TIMEOUT / 3)
+        try:
+            async with SessionLocal() as db:
+                await db.execute(
+                    update(TaskAttachment)
+                    .where(
+                        TaskAttachment.id == attachment_id,
+                        TaskAttachment.process_token == token,
+                        TaskAttachment.process_after.isnot(None),
+                    )
+                    .values(process_after=func.now() + timedelta(seconds=ATTACHMENT_JOB_TIMEOUT))
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Не удалось продлить аренду вложения {attachment_id}: {e}")
+
+
+async def process_attachment_job(attachment_id: int, token: int, attempt: int) -> bool:
+    heartbeat = asyncio.create_task(_extend_lease(attachment_id, token))
+    try:
+        await validate_and_process_attachment(attachment_id, token)
+        return True
+    except asyncio.CancelledError:
+        # остановка воркера: задание вернётся в очередь по ATTACHMENT_JOB_TIMEOUT
+        raise
+    except AttachmentLeaseLost as e:
+        # задание уже у другого воркера — он и запишет результат
+        logger.warning(str(e))
+        return False
+    except Exception as e:
+        try:
+            await _record_failure(attachment_id, token, attempt, str(e) or repr(e))
+        except Exception:
+            logger.exception(f"Не удалось записать ошибку обработки вложения {attachment_id}")
+        return False
+    finally:
+        heartbeat.cancel()
+
+
+async def _listen_for_wakeups(wake: asyncio.Event) -> None:
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(ATTACHMENTS_CHANNEL)
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=30)
+                if message is not None:
+                    wake.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # без подписки воркер работает по таймеру
+            logger.warning(f"Подписка на очередь вложений прервана: {e}")
+            await asyncio.sleep(5)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+
+async def run_attachment_worker(concurrency: int = ATTACHMENT_WORKER_CONCURRENCY):
+    """
+    Цикл воркера: одновременно обрабатывается не больше concurrency вложений;
+    свободные слоты заполняются, когда задание завершилось, пришёл сигнал
+    из канала attachments_queued или прошёл ATTACHMENT_WORKER_POLL_INTERVAL.
+    """
+    logger.info(f"Воркер обработки вложений запущен (параллельно до {concurrency})")
+    wake = asyncio.Event()
+    listener = asyncio.create_task(_listen_for_wakeups(wake))
+    running: Set[asyncio.Task] = set()
+
+    def _done(task: asyncio.Task) -> None:
+        running.discard(task)
+        wake.set()
+
+    try:
+        while True:
+            wake.clear()
+            free = concurrency - len(running)
+            jobs = []
+            if free > 0:
+                try:
+                    jobs = await claim_attachment_jobs(free)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception("Ошибка при выборке заданий обработки вложений")
+            for attachment_id, token, attempt in jobs:
+                task = asyncio.create_task(process_attachment_job(attachment_id, token, attempt))
+                running.add(task)
+                task.add_done_callback(_done)
+            try:
+                await asyncio.wait_for(wake.wait(), timeout=ATTACHMENT_WORKER_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        listener.cancel()
+        for task in list(running):
+            task.cancel()
+        await asyncio.gather(listener, *running, return_exceptions=True)
+
+
+# --- Ручное восстановление ---
+
+async def requeue_attachments(
+    ids: Optional[Iterable[int]] = None,
+    stuck_minutes: float = 30,
+    include_failed: bool = False,
+    dry_run: bool = False,
+) -> int:
+    """
+    Вернуть в очередь зависшие вложения: не обработанные и не стоящие в очереди
+    (или с заданием, просроченным дольше stuck_minutes). include_failed — также
+    строки с ошибкой (dead letter, неверный тип и т.п.). ids — только указанные вложения.
+    Возвращает число строк.
+    """
+    conditions = [TaskAttachment.deleted_at.is_(None)]
+    if ids:
+        conditions.append(TaskAttachment.id.in_(list(ids)))
+    else:
+        stuck = and_(
+            TaskAttachment.processed == False,
+            or_(
+                TaskAttachment.process_after.is_(None),
+                TaskAttachment.process_after < func.now() - timedelta(minutes=stuck_minutes),
+            ),
+        )
+        if include_failed:
+            failed = and_(
+                TaskAttachment.error_text.isnot(None),
+                TaskAttachment.process_after.is_(None),
+                # раньше так помечались большие файлы без превью — это не ошибка, перекачивать их незачем
+                ~TaskAttachment.error_text.startswith("Thumb skipped"),
+            )
+            conditions.append(or_(stuck, failed))
+        else:
+            conditions.append(stuck)
+
+    async with SessionLocal() as db:
+        if dry_run:
+            return await db.scalar(select(func.count(TaskAttachment.id)).where(*conditions))
+        result = await db.execute(
+            update(TaskAttachment)
+            .where(*conditions)
+            .values(process_after=func.now(), process_attempts=0)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+    if result.rowcount:
+        await wake_attachment_worker()
+    return result.rowcount
@@ -12,8 +12,9 @@ from back.users.logist import router as logist_router
 from back.users.montajnik import router as montajnik_router
 from back.users.tech_supp import router as tech_supp_router
 from back.files.attachments import router as attachments_router
-from back.db.config import TOKEN as BOT_TOKEN,WEB_APP_URL
-from back.db.database import get_db
+from back.db.config import TOKEN as BOT_TOKEN,WEB_APP_URL,NOTIFY_WORKER_EMBEDDED,BOT_MODE,ATTACHMENT_WORKER_EMBEDDED
+from back.db.database import engine, replica_engine, get_db
+from back.db.query_stats import db_query_stats_middleware
 from sqlalchemy.ext.asyncio import AsyncSession
 from back.db.models import  User
 import asyncio
@@ -21,23 +22,63 @@ from aiogram import Bot, Dispatcher, types
 
 
 
-from back.bot_worker import start_polling
-from back.utils.notify import periodic_notification_task
+from back.bot_worker import bot, check_bot_config, setup_webhook, start_polling, webhook_router
+from back.utils.notify import telegram_client
+from back.utils.reminders import run_task_reminders
+from back.utils.leader import run_as_leader
+from back.utils.selectel import get_s3_client
+from back.files.media import start_media_pool, shutdown_media_pool
+from back.files.processing_queue import run_attachment_worker
+from back.auth.user_cache import user_cache_listener
+from back.auth.revocation import revocation_listener
+from back.utils.outbox import run_outbox_worker
 
 logger = logging.getLogger(__name__)
 
+async def _stop_task(task: asyncio.Task, name: str):
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    except Exception:
+        logger.exception(f"Ошибка при остановке {name}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
 
+    check_bot_config()
     aiogram_task = None
     notification_task = None
-
-    if BOT_TOKEN:
-        aiogram_task = asyncio.create_task(start_polling())
+    await telegram_client.start()
+    await get_s3_client().start()
+    user_cache_task = asyncio.create_task(user_cache_listener())
+    revocation_task = asyncio.create_task(revocation_listener())
+    # outbox разбирает один процесс-лидер: ограничения скорости Telegram считаются внутри процесса;
+    # можно вынести в отдельный процесс back.notify_worker (NOTIFY_WORKER_EMBEDDED=0)
+    outbox_task = (
+        asyncio.create_task(run_as_leader("notify_outbox", run_outbox_worker)) if NOTIFY_WORKER_EMBEDDED else None
+    )
+    # обработку вложений можно вынести в отдельный процесс back.attachment_worker
+    attachment_task = None
+    if ATTACHMENT_WORKER_EMBEDDED:
+        # пул процессов нужен только воркеру вложений
+        start_media_pool()
+        attachment_task = asyncio.create_task(run_attachment_worker())
+
+    # polling и планировщик напоминаний работают только в процессе-лидере (аренда в Redis)
+    if BOT_TOKEN and BOT_MODE == "polling":
+        aiogram_task = asyncio.create_task(run_as_leader("bot_polling", start_polling))
         await asyncio.sleep(0.1)
+    elif BOT_TOKEN and BOT_MODE == "webhook":
+        try:
+            await setup_webhook()
+        except Exception:
+            logger.exception("Не удалось зарегистрировать webhook бота")
     
-    logger.info("Запуск фоновой задачи уведомлений о предстоящих задачах...")
-    notification_task = asyncio.create_task(periodic_notification_task())
+    logger.info("Запуск планировщика напоминаний о предстоящих задачах...")
+    notification_task = asyncio.create_task(run_as_leader("task_reminders", run_task_reminders))
     await asyncio.sleep(0.1)
 
     try:
@@ -45,12 +86,15 @@ async def lifespan(app: FastAPI):
     finally:
 
         logger.info("Остановка фоновых задач...")
+        await _stop_task(user_cache_task, "подписки на инвалидацию кэша")
+        await _stop_task(revocation_task, "синхронизации отозванных токенов")
+        if outbox_task:
+            await _stop_task(outbox_task, "воркера outbox уведомлений")
+        if attachment_task:
+            await _stop_task(attachment_task, "воркера обработки вложений")
+
         if aiogram_task:
-            aiogram_task.cancel()
-            try:
-                await aiogram_task
-            except Exception:
-                logger.exception("Ошибка при остановке polling задачи") 
+            await _stop_task(aiogram_task, "polling задачи")
 
         if notification_task:
             logger.info("Отмена задачи уведомлений...")
@@ -62,6 +106,16 @@ async def lifespan(app: FastAPI):
             except Exception:
                 logger.exception("Ошибка при остановке задачи уведомлений") 
 
+        if BOT_TOKEN and BOT_MODE == "webhook":
+            await bot.session.close()
+
+        await telegram_client.close()
+        await get_s3_client().close()
+        shutdown_media_pool()
+        await engine.dispose()
+        if replica_engine is not None:
+            await replica_engine.dispose()
+
 
 
 app = FastAPI(
@@ -77,8 +131,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-DB-Queries", "X-DB-Time"],
 )
 
+app.middleware("http")(db_query_stats_middleware)
+
 
 app.include_router(auth_router, prefix="/api/v1/auth", tags=["Auth"])
 app.include_router(admin_router, prefix="/api/v1/admin", tags=["Admin"])
@@ -87,6 +144,9 @@ app.include_router(montajnik_router,prefix="/api/v1/montajnik",tags=["Montajnik"
 app.include_router(tech_supp_router,prefix="/api/v1/tech_supp",tags=["Tech Support"])
 app.include_router(attachments_router,prefix="/api/v1/attachments",tags=["Attachments"])
 
+if BOT_MODE == "webhook":
+    app.include_router(webhook_router, tags=["Telegram"])
+
 
 
 
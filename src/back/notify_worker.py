@@ -0,0 +1,29 @@
+# back/notify_worker.py
+# Отдельный процесс уведомлений (outbox): python -m back.notify_worker (из каталога src)
+import asyncio
+import logging
+
+from back.db.database import engine
+from back.utils.notify import telegram_client
+from back.utils.leader import run_as_leader
+from back.utils.outbox import run_outbox_worker
+
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    await telegram_client.start()
+    try:
+        # та же аренда, что и у воркера внутри API: отправляет только один процесс
+        await run_as_leader("notify_outbox", run_outbox_worker)
+    finally:
+        await telegram_client.close()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Воркер рассылок остановлен")
@@ -3,24 +3,27 @@ from decimal import Decimal
 import enum
 import json
 from fastapi import APIRouter, Body,Depends,HTTPException, Query,status
-from sqlalchemy import and_, desc, func, or_, select, update, delete
+from sqlalchemy import and_, desc, func, insert, or_, select, update, delete
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from back.db.database import get_db
-from back.db.models import AssignmentType, ClientCompany, ContactPerson, Equipment, FileType, TaskAttachment, TaskEquipment, TaskHistory, TaskHistoryEventType, TaskReport, TaskStatus, TaskWork, User,Role as RoleEnum,Task, WorkType,Role
+from back.db.database import engine, replica_engine, get_db, get_db_readonly, get_pool_stats
+from back.db.models import AssignmentType, ClientCompany, ContactPerson, Equipment, FileType, TaskAttachment, TaskEquipment, TaskHistory, TaskHistoryEventType, TaskReport, TaskStatus, TaskWork, User,Role as RoleEnum,Task, WorkType,Role, UserSkill
 from back.auth.auth import get_current_user,create_user as auth_create_user, get_password_hash
+from back.auth.user_cache import user_cache, invalidate_user
 from back.auth.auth_schemas import UserCreate,UserResponse,UserBase,RoleChange
-from back.users.users_schemas import SimpleMsg, TaskEquipmentItem, TaskHistoryItem, TaskPatch, TaskUpdate, require_roles, UpdateEquipmentRequest,UpdateWorkTypeRequest,UpdateCompanyRequest,UpdateContactPersonRequest, UpdateUserRequest
+from back.users.users_schemas import SimpleMsg, TaskEquipmentItem, TaskHistoryItem, TaskPatch, TaskUpdate, require_roles, UpdateEquipmentRequest,UpdateWorkTypeRequest,UpdateCompanyRequest,UpdateContactPersonRequest, UpdateUserRequest, UserSkillsUpdate
 from fastapi import BackgroundTasks
 from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
 from typing import Any, Counter, Dict, Optional
 from sqlalchemy.orm import selectinload
-from back.users.logist import FIELD_TRANSLATIONS_RU,format_value_rus,build_changes_summary_ru
+from back.users.logist import FIELD_TRANSLATIONS_RU,format_value_rus,build_changes_summary_ru,queue_task_updated_notification
 import logging
 from typing import Any, Dict, List
 
-from back.utils.notify import notify_user
+from back.utils.notify import telegram_client
+from back.utils.outbox import get_outbox_stats
+from back.utils.reminders import notify_reminders_changed
 from back.files.handlers import delete_object_from_s3, validate_and_process_attachment
 from back.users.logist import _attach_storage_keys_to_task, _normalize_assigned_user_id
 
@@ -35,7 +38,7 @@ def _ensure_admin_or_403(user: User):
     
 
 @router.get("/me")
-async def admin_profile(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def admin_profile(db: AsyncSession = Depends(get_db_readonly), current_user: User = Depends(get_current_user)):
     """
     Личный кабинет администратора:
     - ID, имя, фамилия, роль
@@ -57,8 +60,33 @@ async def require_admin(current_user:User=Depends(get_current_user)) -> User:
 
 
 
+@router.get("/metrics/user-cache", summary="Статистика кэша пользователей в этом воркере (только админ)")
+async def admin_user_cache_stats(_: User = Depends(require_admin)):
+    return user_cache.stats()
+
+
+@router.get("/metrics/telegram", summary="Статистика HTTP-клиента Telegram в этом воркере (только админ)")
+async def admin_telegram_client_stats(_: User = Depends(require_admin)):
+    return telegram_client.stats()
+
+
+@router.get("/metrics/db-pool", summary="Состояние пула соединений с БД (только админ)")
+async def admin_db_pool_stats(_: User = Depends(require_admin)):
+    return {
+        "primary": get_pool_stats(engine),
+        "replica": get_pool_stats(replica_engine) if replica_engine is not None else None,
+    }
+
+
+@router.get("/metrics/notifications", summary="Глубина и возраст outbox уведомлений (только админ)")
+async def admin_notification_outbox_stats(db: AsyncSession = Depends(get_db), _: User = Depends(require_admin)):
+    # читаем с primary: на реплике возраст очереди искажается задержкой репликации
+    return await get_outbox_stats(db)
+
+
+
 @router.get("/users", response_model=List[UserResponse], summary="Список всех пользователей (только админ)")
-async def admin_list_users(db: AsyncSession = Depends(get_db), _: User = Depends(require_admin)):
+async def admin_list_users(db: AsyncSession = Depends(get_db_readonly), _: User = Depends(require_admin)):
     q = await db.execute(
         select(User)
         .order_by(User.is_active.desc(), User.id) 
@@ -120,7 +148,7 @@ async def admin_update_user(
         user.login = payload.login
     if payload.password is not None:
         # Хэшируем новый пароль
-        user.hashed_password = get_password_hash(payload.password)
+        user.hashed_password = await get_password_hash(payload.password)
     if payload.role is not None:
         # Проверим, что роль валидна
         try:
@@ -131,6 +159,7 @@ async def admin_update_user(
 
     await db.commit()
     await db.refresh(user)
+    await invalidate_user(user.id)
 
     return {
         "id": user.id,
@@ -158,7 +187,8 @@ async def admin_delete_user(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Пользователь не найден")
     
     await db.delete(user)
-    db.commit()
+    await db.commit()
+    await invalidate_user(user_id)
     return UserResponse.model_validate(user)
 
 
@@ -185,6 +215,7 @@ async def deactivate_user(
     user.is_active = False
     await db.commit()
     await db.refresh(user)
+    await invalidate_user(user.id)
     return UserBase.model_validate(user)
 
 
@@ -211,6 +242,7 @@ async def activate_user(
     user.is_active = True
     await db.commit()
     await db.refresh(user)
+    await invalidate_user(user.id)
     return UserBase.model_validate(user)
 
 @router.patch(
@@ -238,9 +270,62 @@ async def admin_change_role(
 
     await db.commit()
     await db.refresh(user)
+    await invalidate_user(user.id)
     return UserResponse.model_validate(user)
 
 
+
+@router.get("/skills/categories", summary="Категории работ, доступные как навыки (только админ)")
+async def admin_skill_categories(db: AsyncSession = Depends(get_db_readonly), _: User = Depends(require_admin)):
+    res = await db.execute(
+        select(WorkType.category)
+        .where(WorkType.category.isnot(None), WorkType.is_active == True)
+        .distinct()
+        .order_by(WorkType.category)
+    )
+    return res.scalars().all()
+
+
+@router.get("/users/{user_id}/skills", summary="Навыки монтажника (только админ)")
+async def admin_get_user_skills(user_id: int, db: AsyncSession = Depends(get_db_readonly), _: User = Depends(require_admin)):
+    res = await db.execute(
+        select(UserSkill.category).where(UserSkill.user_id == user_id).order_by(UserSkill.category)
+    )
+    return {"user_id": user_id, "categories": res.scalars().all()}
+
+
+@router.put("/users/{user_id}/skills", summary="Заменить навыки монтажника (только админ)")
+async def admin_set_user_skills(
+    user_id: int,
+    skills_in: UserSkillsUpdate,
+    db: AsyncSession = Depends(get_db),
+    _: User = Depends(require_admin),
+):
+    """
+    Полностью заменяет список навыков. Пустой список — монтажник без ограничений (получает все рассылки).
+    """
+    user = await db.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Пользователь не найден")
+    if user.role != Role.montajnik:
+        raise HTTPException(status_code=400, detail="Навыки задаются только монтажникам")
+
+    categories = sorted({c.strip() for c in skills_in.categories if c and c.strip()})
+    if categories:
+        known_res = await db.execute(
+            select(WorkType.category).where(WorkType.category.in_(categories)).distinct()
+        )
+        unknown = set(categories) - set(known_res.scalars().all())
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Неизвестные категории работ: {sorted(unknown)}")
+
+    await db.execute(delete(UserSkill).where(UserSkill.user_id == user_id))
+    if categories:
+        await db.execute(insert(UserSkill), [{"user_id": user_id, "category": c} for c in categories])
+    await db.commit()
+    return {"user_id": user_id, "categories": categories}
+
+
 @router.patch("/tasks/{task_id}", summary="Админ может изменить поля заявки (включая оборудование, виды работ, вложения)")
 async def admin_update_task(
     background_tasks: BackgroundTasks,
@@ -672,6 +757,9 @@ async def admin_update_task(
         await db.flush()
         logger.info("Запись в TaskHistory добавлена и зафлашена")
 
+        if task.assigned_user_id:
+            await queue_task_updated_notification(db, task.assigned_user_id, task_id, all_changes)
+
         await db.commit()
         logger.info("Транзакция успешно зафиксирована")
 
@@ -683,19 +771,14 @@ async def admin_update_task(
             logger.exception("rollback failed")
         raise HTTPException(status_code=500, detail="Failed to update task")
 
-    if task.assigned_user_id:
-        background_tasks.add_task(
-            notify_user,
-            task.assigned_user_id,
-            f"Задача #{task_id} была обновлена"
-        )
-
+    # время начала или исполнитель могли измениться — планировщик пересчитает ближайшее напоминание
+    await notify_reminders_changed()
     return {"detail": "Updated"}
 
 
 @router.get("/tasks", summary="Получить все задачи (только админ), кроме черновиков")
 async def admin_list_tasks(
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     admin_user: User = Depends(require_admin),
 ):
     # Сначала получаем количество задач
@@ -756,7 +839,7 @@ async def admin_filter_tasks(
     task_id: Optional[int] = Query(None, description="ID задачи"),
     equipment_id: Optional[str] = Query(None, description="ID оборудования через запятую"),
     search: Optional[str] = Query(None, description="Умный поиск по всем полям"),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     admin_user: User = Depends(require_admin)
 ):
     query = select(Task).where(Task.is_draft != True)
@@ -900,7 +983,7 @@ async def admin_filter_tasks(
 @router.get("/tasks/{task_id}", summary="Получить задачу по ID (только админ), если не черновик")
 async def admin_get_task_by_id(
     task_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     admin_user: User = Depends(require_admin),
 ):
     # Загружаем задачу с контактным лицом, компанией и другими связями
@@ -1025,7 +1108,7 @@ async def admin_delete_task(
 @router.get("/tasks/{task_id}/history", response_model=List[TaskHistoryItem], dependencies=[Depends(require_roles(Role.logist, Role.admin))])
 async def admin_get_task_full_history(
     task_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     current_user=Depends(get_current_user) # Для проверки существования задачи и прав (упрощенно)
 ):
      # 1. Проверить существование задачи (можно добавить проверку прав)
@@ -1064,14 +1147,14 @@ async def admin_get_task_full_history(
 
 
 @router.get("/companies", dependencies=[Depends(require_roles(Role.logist, Role.admin))])
-async def admin_get_companies(db: AsyncSession = Depends(get_db)):
+async def admin_get_companies(db: AsyncSession = Depends(get_db_readonly)):
     res = await db.execute(select(ClientCompany))
     companies = res.scalars().all()
     return [{"id": c.id, "name": c.name} for c in companies]
 
 
 @router.get("/companies/{company_id}/contacts", dependencies=[Depends(require_roles(Role.logist, Role.admin))])
-async def admin_get_contact_persons(company_id: int, db: AsyncSession = Depends(get_db)):
+async def admin_get_contact_persons(company_id: int, db: AsyncSession = Depends(get_db_readonly)):
     res = await db.execute(select(ContactPerson).where(ContactPerson.company_id == company_id))
     contacts = res.scalars().all()
     return [{"id": c.id, "name": c.name, "phone": c.phone, "position": c.position, "company_id": c.company_id} for c in contacts]
@@ -1080,7 +1163,7 @@ async def admin_get_contact_persons(company_id: int, db: AsyncSession = Depends(
 @router.get("/contact-persons/{contact_person_id}/phone", dependencies=[Depends(require_roles(Role.logist, Role.admin))])
 async def admin_get_contact_person_phone(
     contact_person_id: int,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db_readonly)
 ):
     """
     Получить телефон контактного лица по его ID.
@@ -1129,14 +1212,14 @@ async def admin_add_contact_person(company_id: int, payload: dict = Body(...), d
 
 
 @router.get("/equipment", dependencies=[Depends(require_roles(Role.logist, Role.admin))])
-async def admin_get_equipment_list(db: AsyncSession = Depends(get_db)):
+async def admin_get_equipment_list(db: AsyncSession = Depends(get_db_readonly)):
     res = await db.execute(select(Equipment).order_by(Equipment.name)) 
     equipment_list = res.scalars().all()
     return [{"id": e.id, "name": e.name, "category": e.category, "price": str(e.price)} for e in equipment_list]
 
 
 @router.get("/work-types", dependencies=[Depends(require_roles(Role.logist, Role.admin))])
-async def admin_get_work_types_list(db: AsyncSession = Depends(get_db)):
+async def admin_get_work_types_list(db: AsyncSession = Depends(get_db_readonly)):
     res = await db.execute(select(WorkType).where(WorkType.is_active == True).order_by(WorkType.name))
     work_types_list = res.scalars().all()
     # Возвращаем старый формат, но добавляем category
@@ -1359,7 +1442,7 @@ async def admin_update_contact_person(
 
 @router.get("/tasks/completed_admin", summary="Получить все завершенные задачи (только админ)")
 async def admin_list_completed_tasks(
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     admin_user: User = Depends(require_admin),
 ):
     # Сначала получаем количество задач
@@ -1414,7 +1497,7 @@ async def admin_filter_completed_tasks(
     work_type_id: Optional[str] = Query(None, description="ID типов работ через запятую"),
     equipment_id: Optional[str] = Query(None, description="ID оборудования через запятую"),
     search: Optional[str] = Query(None, description="Умный поиск по всем полям"),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     admin_user: User = Depends(require_admin)
 ):
     query = select(Task).where(Task.status == TaskStatus.completed)
@@ -1563,7 +1646,7 @@ async def admin_filter_completed_tasks(
 @router.get("/admin_completed-tasks/{task_id}")
 async def admin_completed_task_detail(
     task_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     current_user=Depends(get_current_user)
 ):
    
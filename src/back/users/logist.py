@@ -1,8 +1,10 @@
 import enum
+import html
 from typing import Counter, List, Optional
 from fastapi import APIRouter, Body, Depends, HTTPException, Query, status, BackgroundTasks
 from sqlalchemy.ext.asyncio import AsyncSession
-from back.db.database import get_db
+from back.db.database import get_db, get_db_readonly
+from back.db.config import NOTIFY_COALESCE_WINDOW
 from back.auth.auth import get_current_user
 from back.db.models import (
     AssignmentType,
@@ -25,16 +27,17 @@ from back.db.models import (
     WorkType,
 )
 from back.users.users_schemas import DraftIn, DraftOut, PublishIn, ReportAttachmentIn, TaskEquipmentItem, TaskHistoryItem, TaskPatch, ReportReviewIn, SimpleMsg, UpdateCompanyRequest, UpdateContactPersonRequest,require_roles
-from back.utils.notify import notify_broadcast_task, notify_task_assignment, notify_user
+from back.utils.outbox import add_notification, add_role_notifications, find_pending_notification
+from back.utils.reminders import notify_reminders_changed
 from datetime import datetime, timezone
-from sqlalchemy import and_, delete, desc, func, or_, select
+from sqlalchemy import and_, delete, desc, func, insert, or_, select
 from sqlalchemy.orm import selectinload
 import json
 import logging
 from decimal import Decimal
 
 from back.utils.selectel import get_s3_client
-from back.files.handlers import validate_and_process_attachment
+from back.files.processing_queue import enqueue_attachment, queued_values, wake_attachment_worker
 
 S3_CLIENT = get_s3_client()
 
@@ -151,6 +154,59 @@ def build_changes_summary_ru(all_changes):
 
     return "\n".join(parts)
 
+
+TASK_UPDATED_KIND = "task_updated"
+
+
+def _merge_task_changes(previous, changes):
+    """
+    Склейка изменений: для каждого поля остаётся самое первое старое значение и самое последнее новое.
+    """
+    merged = {change["field"]: dict(change) for change in previous}
+    for change in changes:
+        if change["field"] in merged:
+            merged[change["field"]]["new"] = change["new"]
+        else:
+            merged[change["field"]] = dict(change)
+    return list(merged.values())
+
+
+def _task_updated_message(task_id, changes):
+    summary = build_changes_summary_ru(changes)
+    if summary in ("—", "— Нет изменений —"):
+        return f"Задача #{task_id} была обновлена"
+    return f"Задача #{task_id} была обновлена:\n{html.escape(summary)}"
+
+
+async def queue_task_updated_notification(db: AsyncSession, user_id: int, task_id: int, all_changes):
+    """
+    Уведомление "задача обновлена" через outbox с окном склейки NOTIFY_COALESCE_WINDOW:
+    правки одной задачи, пришедшие пока уведомление ждёт отправки, дописываются в него
+    одной сводкой изменений вместо отдельного сообщения на каждое сохранение.
+    Вызывается до commit, в транзакции самой правки.
+    """
+    # значения сразу приводим к строкам — так их можно хранить в JSONB и склеивать
+    changes = [
+        {"field": c["field"], "old": format_value_rus(c.get("old")), "new": format_value_rus(c.get("new"))}
+        for c in all_changes
+    ]
+    if NOTIFY_COALESCE_WINDOW > 0:
+        pending = await find_pending_notification(db, user_id, task_id, TASK_UPDATED_KIND)
+        if pending is not None:
+            changes = _merge_task_changes(pending.payload or [], changes)
+            pending.payload = changes
+            pending.message = _task_updated_message(task_id, changes)
+            return
+    add_notification(
+        db,
+        user_id,
+        _task_updated_message(task_id, changes),
+        task_id,
+        kind=TASK_UPDATED_KIND,
+        payload=changes,
+        delay=NOTIFY_COALESCE_WINDOW,
+    )
+
 def _parse_datetime(val):
     if val is None:
         return None
@@ -209,7 +265,8 @@ async def _attach_storage_keys_to_task(db: AsyncSession, storage_keys: list, tas
     """
     Привязать список storage_key к задаче: если запись уже есть (task_id == 0 или task_id NULL),
     обновить task_id; иначе создать новую запись TaskAttachment.
-    После создания/обновления планируем background обработчик validate_and_process_attachment.
+    Необработанные вложения ставятся в очередь обработки (фиксируется commit'ом вызывающего),
+    воркер будится после ответа.
     """
     s3 = get_s3_client()
     created = []
@@ -225,9 +282,11 @@ async def _attach_storage_keys_to_task(db: AsyncSession, storage_keys: list, tas
             existing.deleted_at = None
             await db.flush()
             created.append(existing)
-            # запускаем в фоне в любом случае если ещё не processed
+            # ставим в очередь, если ещё не processed
             if not existing.processed:
-                background_tasks.add_task(validate_and_process_attachment, existing.id)
+                enqueue_attachment(existing)
+                await db.flush()
+                background_tasks.add_task(wake_attachment_worker)
             continue
 
         att = TaskAttachment(
@@ -241,11 +300,12 @@ async def _attach_storage_keys_to_task(db: AsyncSession, storage_keys: list, tas
             uploader_id=uploader_id,
             uploader_role=uploader_role,
             processed=False,
+            **queued_values(),
         )
         db.add(att)
         await db.flush()
         created.append(att)
-        background_tasks.add_task(validate_and_process_attachment, att.id)
+        background_tasks.add_task(wake_attachment_worker)
     return created
 
 
@@ -354,40 +414,29 @@ async def create_draft(
     await db.flush() # flush, чтобы получить task.id
 
     # --- SAVE EQUIPMENT ---
-    for eq_item in equipment_data_raw:
-        equipment_id = eq_item.get("equipment_id")
-        serial_number = eq_item.get("serial_number")
-        quantity = eq_item.get("quantity", 1)
-
-        # Проверяем, существует ли оборудование
-        eq_res = await db.execute(select(Equipment).where(Equipment.id == equipment_id))
-        equipment_obj = eq_res.scalars().first()
-        if not equipment_obj:
-            raise HTTPException(status_code=400, detail=f"Оборудование id={equipment_id} не найдено")
-
-        db.add(TaskEquipment(
-            task_id=task.id,
-            equipment_id=equipment_id,
-            serial_number=serial_number,
-            quantity=quantity
-        ))
+    # Оборудование и типы работ уже проверены одним IN-запросом выше — вставляем связи пачкой
+    equipment_rows = [
+        {
+            "task_id": task.id,
+            "equipment_id": eq_item.get("equipment_id"),
+            "serial_number": eq_item.get("serial_number"),
+            "quantity": eq_item.get("quantity", 1),
+        }
+        for eq_item in equipment_data_raw
+    ]
+    if equipment_rows:
+        await db.execute(insert(TaskEquipment), equipment_rows)
 
     # --- SAVE WORK TYPES ---
-    for wt_id, count in work_type_counts.items():
-        # Проверяем, существует ли тип работы (уже делали выше, но на всякий случай)
-        wt_res = await db.execute(select(WorkType).where(WorkType.id == wt_id))
-        wt = wt_res.scalars().first()
-        if not wt:
-            raise HTTPException(status_code=400, detail=f"Тип работы id={wt_id} не найден")
-
-        db.add(TaskWork(
-            task_id=task.id,
-            work_type_id=wt_id,
-            quantity=count # ✅ Учитываем количество
-        ))
+    work_rows = [
+        {"task_id": task.id, "work_type_id": wt_id, "quantity": count} # ✅ Учитываем количество
+        for wt_id, count in work_type_counts.items()
+    ]
+    if work_rows:
+        await db.execute(insert(TaskWork), work_rows)
 
+    # id получен через RETURNING при flush, created_at выставлен на стороне Python — refresh не нужен
     await db.commit()
-    await db.refresh(task)
 
     return {"draft_id": task.id, "saved_at": task.created_at, "data": data}
 
@@ -395,7 +444,7 @@ async def create_draft(
 
 
 @router.get("/drafts/{draft_id}", dependencies=[Depends(require_roles(Role.logist, Role.admin))])
-async def get_draft(draft_id: int, db: AsyncSession = Depends(get_db), current_user=Depends(get_current_user)):
+async def get_draft(draft_id: int, db: AsyncSession = Depends(get_db_readonly), current_user=Depends(get_current_user)):
     res = await db.execute(
         select(Task)
         .options(
@@ -899,11 +948,13 @@ async def publish_task(
 
         calculated_works_cost_for_client = Decimal('0')
         calculated_works_cost_for_mont = Decimal('0')
+        work_types_by_id = {}
         if work_types_ids_unique:
             wt_res = await db.execute(
                 select(WorkType).where(WorkType.id.in_(work_types_ids_unique), WorkType.is_active == True)
             )
             work_types_from_db = wt_res.scalars().all()
+            work_types_by_id = {wt.id: wt for wt in work_types_from_db}
             if len(work_types_from_db) != len(work_types_ids_unique):
                 missing = set(work_types_ids_unique) - {wt.id for wt in work_types_from_db}
                 raise HTTPException(status_code=400, detail=f"Типы работ не найдены или неактивны: {list(missing)}")
@@ -920,12 +971,13 @@ async def publish_task(
             equipment_quantities[eq_id] = equipment_quantities.get(eq_id, 0) + qty
 
         calculated_equipment_cost = Decimal('0')
-        
+        equipment_by_id = {}
         if equipment_quantities:
             eq_res = await db.execute(
                 select(Equipment).where(Equipment.id.in_(list(equipment_quantities.keys())))
             )
             equipment_from_db = eq_res.scalars().all()
+            equipment_by_id = {eq.id: eq for eq in equipment_from_db}
             if len(equipment_from_db) != len(equipment_quantities):
                 missing = set(equipment_quantities.keys()) - {eq.id for eq in equipment_from_db}
                 raise HTTPException(status_code=400, detail=f"Оборудование не найдено: {list(missing)}")
@@ -965,50 +1017,43 @@ async def publish_task(
         await db.flush() # flush, чтобы получить task.id
 
         # --- SAVE EQUIPMENT для новой задачи ---
+        # Используем уже загруженные выше строки Equipment/WorkType и вставляем связи пачкой
         equipment_snapshot_for_history = [] # <--- Собираем снимок
+        equipment_rows = []
         for eq_item in equipment_data_raw:
             equipment_id = eq_item.get("equipment_id")
             serial_number = eq_item.get("serial_number")
             quantity = eq_item.get("quantity", 1)
 
-            eq_res = await db.execute(select(Equipment).where(Equipment.id == equipment_id))
-            equipment_obj = eq_res.scalars().first()
-            if not equipment_obj:
-                raise HTTPException(status_code=400, detail=f"Оборудование id={equipment_id} не найдено")
-
             # --- СОХРАНЯЕМ ДАННЫЕ В СНИМОК ---
             equipment_snapshot_for_history.append({
-                "name": equipment_obj.name,
+                "name": equipment_by_id[equipment_id].name,
                 "serial_number": serial_number,
                 "quantity": quantity
             })
 
-            db.add(TaskEquipment(
-                task_id=task.id,
-                equipment_id=equipment_id,
-                serial_number=serial_number,
-                quantity=quantity
-            ))
+            equipment_rows.append({
+                "task_id": task.id,
+                "equipment_id": equipment_id,
+                "serial_number": serial_number,
+                "quantity": quantity,
+            })
+        if equipment_rows:
+            await db.execute(insert(TaskEquipment), equipment_rows)
 
         # --- SAVE WORK TYPES для новой задачи ---
         work_types_snapshot_for_history = [] # <--- Собираем снимок
+        work_rows = []
         for wt_id, count in work_type_counts.items():
-            wt_res = await db.execute(select(WorkType).where(WorkType.id == wt_id))
-            wt = wt_res.scalars().first()
-            if not wt:
-                raise HTTPException(status_code=400, detail=f"Тип работы id={wt_id} не найден")
-
             # --- СОХРАНЯЕМ ДАННЫЕ В СНИМОК ---
             work_types_snapshot_for_history.append({
-                "name": wt.name,
+                "name": work_types_by_id[wt_id].name,
                 "quantity": count
             })
 
-            db.add(TaskWork(
-                task_id=task.id,
-                work_type_id=wt_id,
-                quantity=count
-            ))
+            work_rows.append({"task_id": task.id, "work_type_id": wt_id, "quantity": count})
+        if work_rows:
+            await db.execute(insert(TaskWork), work_rows)
 
         # Добавляем запись в историю для новой задачи
         db.add(TaskHistory(
@@ -1038,20 +1083,13 @@ async def publish_task(
 
 
 
-    await db.commit()
-    await db.refresh(task)
-
-    montajniks_res = await db.execute(
-        select(User.id).where(User.role == 'montajnik', User.is_active == True)
+    # Рассылка монтажникам с подходящими навыками — строки outbox одним INSERT ... SELECT в той же транзакции
+    await add_role_notifications(
+        db, Role.montajnik, f"Новая задача #{task.id} опубликована", task.id, only_qualified=True
     )
-    montajnik_ids = [row[0] for row in montajniks_res.fetchall()]
-    
-    for montajnik_id in montajnik_ids:
-        background_tasks.add_task(
-            notify_user, 
-            montajnik_id, 
-            f"Новая задача #{task.id} опубликована"
-        )
+
+    # id задачи уже известен после flush (INSERT ... RETURNING), повторное чтение не требуется
+    await db.commit()
 
     return {"id": task.id}
 
@@ -1490,6 +1528,9 @@ async def edit_task(
         await db.flush()
         logger.info("Запись в TaskHistory добавлена и зафлашена")
 
+        if task.assigned_user_id:
+            await queue_task_updated_notification(db, task.assigned_user_id, task_id, all_changes)
+
         await db.commit()
         logger.info("Транзакция успешно зафиксирована")
 
@@ -1501,13 +1542,8 @@ async def edit_task(
             logger.exception("rollback failed")
         raise HTTPException(status_code=500, detail="Failed to update task")
 
-    if task.assigned_user_id:
-        background_tasks.add_task(
-            notify_user,
-            task.assigned_user_id,
-            f"Задача #{task_id} была обновлена"
-        )
-
+    # время начала или исполнитель могли измениться — планировщик пересчитает ближайшее напоминание
+    await notify_reminders_changed()
     return {"detail": "Updated"}
 
 
@@ -1748,6 +1784,36 @@ async def review_report(
             )
             db.add(hist)
 
+        if task.assigned_user_id:
+            both_approved = (report.approval_logist == ReportApproval.approved and 
+                            report.approval_tech == ReportApproval.approved)
+            
+            if both_approved:
+                montajnik_msg = f"Работы по задаче {task_id} проверены и выполнены"
+            else:
+                if approval == "approved":
+                    status_msg = "принят логистом"
+                else:
+                    status_msg = "отправлен на доработку"
+                
+                montajnik_msg = f"Отчет по задаче {task_id} {status_msg}"
+                if comment:
+                    montajnik_msg += f". Комментарий: {comment}"
+            
+            add_notification(db, task.assigned_user_id, montajnik_msg, task_id)
+
+        if (
+            current_user.role == Role.logist
+            and report.approval_tech == ReportApproval.waiting
+            and requires_tech_review
+        ):
+            await add_role_notifications(
+                db,
+                Role.tech_supp,
+                f"Отчёт по задаче #{task_id} ожидает вашей проверки.",
+                task_id,
+            )
+
         await db.flush()
 
         await db.commit()
@@ -1759,51 +1825,13 @@ async def review_report(
             logger.exception("rollback failed")
         raise HTTPException(status_code=500, detail="Failed to review report")
 
-    if task.assigned_user_id:
-        both_approved = (report.approval_logist == ReportApproval.approved and 
-                        report.approval_tech == ReportApproval.approved)
-        
-        if both_approved:
-            montajnik_msg = f"Работы по задаче {task_id} проверены и выполнены"
-        else:
-            if approval == "approved":
-                status_msg = "принят логистом"
-            else:
-                status_msg = "отправлен на доработку"
-            
-            montajnik_msg = f"Отчет по задаче {task_id} {status_msg}"
-            if comment:
-                montajnik_msg += f". Комментарий: {comment}"
-        
-        background_tasks.add_task(
-            notify_user,
-            task.assigned_user_id,
-            montajnik_msg,
-            task_id
-        )
-
-    if (
-        current_user.role == Role.logist
-        and report.approval_tech == ReportApproval.waiting
-        and requires_tech_review
-    ):
-        tech_q = await db.execute(select(User).where(User.role == Role.tech_supp, User.is_active == True))
-        techs = tech_q.scalars().all()
-        for tuser in techs:
-            background_tasks.add_task(
-                notify_user,
-                tuser.id,
-                f"Отчёт по задаче #{task_id} ожидает вашей проверки.",
-                task_id
-            )
-
     return {"detail": "Reviewed", "approval": approval}
 
 
 
 
 @router.get("/tasks/active")
-async def logist_active(db: AsyncSession = Depends(get_db), current_user=Depends(get_current_user)):
+async def logist_active(db: AsyncSession = Depends(get_db_readonly), current_user=Depends(get_current_user)):
     # Сначала получаем количество активных задач
     count_query = select(func.count(Task.id)).where(
         Task.status.not_in([TaskStatus.completed, TaskStatus.archived]),
@@ -1855,7 +1883,7 @@ async def logist_active(db: AsyncSession = Depends(get_db), current_user=Depends
     }
 
 @router.get("/drafts")
-async def get_all_dafts(db: AsyncSession = Depends(get_db), current_user=Depends(get_current_user)):
+async def get_all_dafts(db: AsyncSession = Depends(get_db_readonly), current_user=Depends(get_current_user)):
     # Загружаем черновики с контактным лицом, компанией и оборудованием
     q = select(Task).where(
         Task.is_draft == True,
@@ -1901,7 +1929,7 @@ async def get_all_dafts(db: AsyncSession = Depends(get_db), current_user=Depends
 
 
 @router.get("/tasks/history")
-async def logist_history(db: AsyncSession = Depends(get_db), current_user=Depends(get_current_user)):
+async def logist_history(db: AsyncSession = Depends(get_db_readonly), current_user=Depends(get_current_user)):
     q = select(Task).where(Task.status == TaskStatus.completed, Task.is_draft == False)
     res = await db.execute(q)
     tasks = res.scalars().all()
@@ -1925,7 +1953,7 @@ async def logist_filter_tasks(
     task_id: Optional[int] = Query(None, description="ID задачи"),
     equipment_id: Optional[str] = Query(None, description="ID оборудования через запятую"),
     search: Optional[str] = Query(None, description="Умный поиск по всем полям"),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db_readonly)
 ):
     query = select(Task).where(Task.is_draft != True)
 
@@ -2072,7 +2100,7 @@ async def logist_filter_completed_tasks(
     task_id: Optional[int] = Query(None, description="ID задачи"),
     equipment_id: Optional[str] = Query(None, description="ID оборудования через запятую"),
     search: Optional[str] = Query(None, description="Умный поиск по всем полям"),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     current_user=Depends(get_current_user)
 ):
     query = select(Task).where(
@@ -2226,7 +2254,7 @@ async def logist_filter_completed_tasks(
 @router.get("/tasks/{task_id}/history", response_model=List[TaskHistoryItem], dependencies=[Depends(require_roles(Role.logist, Role.admin))])
 async def get_task_full_history(
     task_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     current_user=Depends(get_current_user) # Для проверки существования задачи и прав (упрощенно)
 ):
     """
@@ -2272,7 +2300,7 @@ async def get_task_full_history(
 @router.get("/tasks/{task_id}")
 async def task_detail(
     task_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     current_user=Depends(get_current_user)
 ):
     # Используем Task вместо TaskView
@@ -2378,14 +2406,14 @@ async def task_detail(
 
 
 @router.get("/equipment")
-async def get_equipment(db:AsyncSession = Depends(get_db), current_user=Depends(get_current_user)):
+async def get_equipment(db:AsyncSession = Depends(get_db_readonly), current_user=Depends(get_current_user)):
     result = await db.execute(select(Equipment))
     equipment_list = result.scalars().all()
     return [{"id": eq.id, "name": eq.name} for eq in equipment_list]    
 
 
 @router.get("/work-types")
-async def get_work_types(db: AsyncSession = Depends(get_db), current_user=Depends(get_current_user)):
+async def get_work_types(db: AsyncSession = Depends(get_db_readonly), current_user=Depends(get_current_user)):
     result = await db.execute(select(WorkType))
     work_types = result.scalars().all()
     return [{"id": wt.id, "name": wt.name, "client_price": str(wt.client_price) , "mont_price": str(wt.mont_price)} for wt in work_types]
@@ -2393,14 +2421,14 @@ async def get_work_types(db: AsyncSession = Depends(get_db), current_user=Depend
 
 
 @router.get("/companies", dependencies=[Depends(require_roles(Role.logist, Role.admin,Role.tech_supp,Role.montajnik))])
-async def get_companies(db: AsyncSession = Depends(get_db)):
+async def get_companies(db: AsyncSession = Depends(get_db_readonly)):
     res = await db.execute(select(ClientCompany))
     companies = res.scalars().all()
     return [{"id": c.id, "name": c.name} for c in companies]
 
 
 @router.get("/companies/{company_id}/contacts", dependencies=[Depends(require_roles(Role.logist, Role.admin))])
-async def get_contact_persons(company_id: int, db: AsyncSession = Depends(get_db)):
+async def get_contact_persons(company_id: int, db: AsyncSession = Depends(get_db_readonly)):
     res = await db.execute(select(ContactPerson).where(ContactPerson.company_id == company_id))
     contacts = res.scalars().all()
     return [{"id": c.id, "name": c.name, "phone": c.phone, "position": c.position, "company_id": c.company_id} for c in contacts]
@@ -2442,7 +2470,7 @@ async def add_contact_person(company_id: int, payload: dict = Body(...), db: Asy
 @router.get("/contact-persons/{contact_person_id}/phone", dependencies=[Depends(require_roles(Role.logist, Role.admin))])
 async def get_contact_person_phone(
     contact_person_id: int,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db_readonly)
 ):
     """
     Получить телефон контактного лица по его ID.
@@ -2523,7 +2551,7 @@ async def logist_update_contact_person(
 
 
 @router.get("/me")
-async def logist_profile(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def logist_profile(db: AsyncSession = Depends(get_db_readonly), current_user: User = Depends(get_current_user)):
     """
     Личный кабинет логиста:
     - имя, фамилия, роль
@@ -2590,7 +2618,7 @@ async def logist_profile(db: AsyncSession = Depends(get_db), current_user: User
 @router.get("/completed-tasks/{task_id}")
 async def logist_completed_task_detail(
     task_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     current_user=Depends(get_current_user)
 ):
     _ensure_logist_or_403(current_user) # Проверяем, что пользователь - логист
@@ -2690,7 +2718,7 @@ async def logist_completed_task_detail(
 
 
 @router.get("/montajniks", dependencies=[Depends(require_roles(Role.logist, Role.admin,Role.montajnik,Role.tech_supp))])
-async def get_active_montajniks(db: AsyncSession = Depends(get_db)):
+async def get_active_montajniks(db: AsyncSession = Depends(get_db_readonly)):
     """
     Получить список активных монтажников.
     """
@@ -2856,7 +2884,7 @@ async def delete_archived_task(
 
 @router.get("/archived-tasks")
 async def logist_archive(
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     current_user=Depends(get_current_user)
 ):
     q = (
@@ -2898,7 +2926,7 @@ async def logist_archive(
 @router.get("/archived-tasks/{task_id}")
 async def logist_archive_task_detail(
     task_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     current_user=Depends(get_current_user)
 ):
     _ensure_logist_or_403(current_user) # Проверяем, что пользователь - логист
@@ -7,8 +7,8 @@ from datetime import datetime, timezone
 import json
 import logging
 from back.users.users_schemas import MontajnikReportReview, TaskHistoryItem, require_roles,Role
-from back.db.database import get_db
-from back.auth.auth import get_current_user
+from back.db.database import get_db, get_db_readonly
+from back.auth.auth import TokenPrincipal, get_current_principal, get_current_user
 from back.db.models import (
     AssignmentType,
     ClientCompany,
@@ -30,7 +30,9 @@ from back.db.models import (
     ReportApproval,
     WorkType,
 )
-from back.utils.notify import notify_user
+from back.utils.outbox import add_notification, add_role_notifications
+from back.utils.reminders import notify_reminders_changed
+from back.utils.skills import qualified_for_task
 from back.utils.selectel import get_s3_client
 from back.files.handlers import validate_and_process_attachment
 
@@ -65,7 +67,7 @@ def _ensure_montajnik_or_403(user: User):
 # --- Endpoints -------------------------------------------------------------
 
 @router.get("/tasks/mine", dependencies=[Depends(require_roles(Role.montajnik))])
-async def my_tasks(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def my_tasks(db: AsyncSession = Depends(get_db_readonly), current_user: TokenPrincipal = Depends(get_current_principal)):
     """
     Список задач для текущего монтажника:
     - назначенные (assigned_user_id == me)
@@ -124,29 +126,29 @@ async def my_tasks(db: AsyncSession = Depends(get_db), current_user: User = Depe
 
 
 @router.get("/tasks/available", dependencies=[Depends(require_roles(Role.montajnik, Role.logist, Role.tech_supp, Role.admin))])
-async def available_tasks(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def available_tasks(db: AsyncSession = Depends(get_db_readonly), current_user: TokenPrincipal = Depends(get_current_principal)):
     """
     Общие (broadcast) задачи, доступные всем активным монтажникам.
     Возвращает список рассылок (tasks with assignment_type == broadcast и is_draft == False).
+    Монтажнику показываются только задачи, подходящие под его навыки.
     """
-
-    # Сначала получаем количество задач
-    count_query = select(func.count(Task.id)).where(
-        Task.assignment_type == AssignmentType.broadcast,
+    filters = [
+        Task.assignment_type == AssignmentType.broadcast, # Используем Enum напрямую
         Task.is_draft == False,
         Task.status == TaskStatus.new,
-    )
+    ]
+    if current_user.role == Role.montajnik:
+        filters.append(qualified_for_task(current_user.id, Task.id))
+
+    # Сначала получаем количество задач
+    count_query = select(func.count(Task.id)).where(*filters)
     count_res = await db.execute(count_query)
     total_count = count_res.scalar() or 0
 
     # Загружаем задачи с контактным лицом и компанией
     res = await db.execute(
         select(Task)
-        .where(
-            Task.assignment_type == AssignmentType.broadcast, # Используем Enum напрямую
-            Task.is_draft == False,
-            Task.status == TaskStatus.new, 
-        )
+        .where(*filters)
         .options(
             selectinload(Task.contact_person).selectinload(ContactPerson.company),
             selectinload(Task.equipment_links).selectinload(TaskEquipment.equipment),
@@ -186,7 +188,7 @@ async def available_tasks(db: AsyncSession = Depends(get_db), current_user: User
 
 
 @router.get("/tasks/assigned", dependencies=[Depends(require_roles(Role.montajnik, Role.logist, Role.tech_supp, Role.admin))])
-async def assigned_tasks(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def assigned_tasks(db: AsyncSession = Depends(get_db_readonly), current_user: TokenPrincipal = Depends(get_current_principal)):
     # Сначала получаем количество задач
     count_query = select(func.count(Task.id)).where(
         Task.assignment_type == AssignmentType.individual,
@@ -246,7 +248,7 @@ async def assigned_tasks(db: AsyncSession = Depends(get_db), current_user: User
 @router.get("/tasks/available/{task_id}")
 async def available_task_detail(
     task_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     current_user=Depends(get_current_user)
 ):
     # Загружаем задачу с контактным лицом и компанией
@@ -343,7 +345,7 @@ async def available_task_detail(
 @router.get("/tasks/assigned/{task_id}")
 async def assigned_task_detail(
     task_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     current_user=Depends(get_current_user)
 ):
     
@@ -441,7 +443,7 @@ async def assigned_task_detail(
 @router.get("/tasks/{task_id}")
 async def mont_task_detail(
     task_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     current_user=Depends(get_current_user)
 ):
     # Загружаем задачу с контактным лицом, компанией и другими связями
@@ -539,7 +541,7 @@ async def mont_task_detail(
 
 
 @router.get("/tasks/history")
-async def logist_history(db: AsyncSession = Depends(get_db), current_user=Depends(get_current_user)):
+async def logist_history(db: AsyncSession = Depends(get_db_readonly), current_user: TokenPrincipal = Depends(get_current_principal)):
     # Загружаем завершённые задачи с контактным лицом и компанией
     q = select(Task).where(
         Task.status == TaskStatus.completed,
@@ -570,7 +572,7 @@ async def logist_history(db: AsyncSession = Depends(get_db), current_user=Depend
 @router.get("/tasks/{task_id}/history", response_model=List[TaskHistoryItem], dependencies=[Depends(require_roles(Role.logist, Role.admin, Role.montajnik))])
 async def mont_get_task_full_history(
     task_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     current_user=Depends(get_current_user) 
 ):
     
@@ -694,6 +696,13 @@ async def accept_task(
         work_types_snapshot=work_types_snapshot_for_history, # <--- Добавлено
     )
     db.add(hist)
+    if task.created_by:
+        add_notification(
+            db,
+            task.created_by,
+            f"Монтажник {current_user.name} {current_user.lastname} принял задачу #{task.id}",
+            task.id
+        )
     try:
         await db.flush()
         await db.commit()
@@ -705,13 +714,8 @@ async def accept_task(
             logger.exception("rollback failed")
         raise HTTPException(status_code=500, detail="Ошибка при принятии задачи")
 
-    if task.created_by:
-        background_tasks.add_task(
-            notify_user,
-            task.created_by,
-            f"Монтажник {current_user.name} {current_user.lastname} принял задачу #{task.id}",
-            task.id
-        )
+    # задача стала принятой — по ней появилось ожидающее напоминание
+    await notify_reminders_changed()
     return {"detail": "accepted"}
 
 
@@ -797,21 +801,21 @@ async def reject_task(
     )
     db.add(hist)
 
-    try:
-        await db.commit()
-    except Exception as e:
-        await db.rollback()
-        raise HTTPException(status_code=500, detail=f"Ошибка при отклонении задачи: {e}")
-
     # уведомляем логиста/создателя, если есть
     if task.created_by:
-        background_tasks.add_task(
-            notify_user,
+        add_notification(
+            db,
             task.created_by,
             f"Монтажник {current_user.name} {current_user.lastname} отклонил задачу #{task.id}",
             task.id
         )
 
+    try:
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Ошибка при отклонении задачи: {e}")
+
     return {"detail": "rejected"}
 
 
@@ -1171,6 +1175,13 @@ async def submit_report_for_review(
             work_types_snapshot=work_types_snapshot_for_history,
         )
         db.add(hist)
+
+        if notify_logist and task.created_by:
+            add_notification(db, task.created_by, f"По задаче #{task.id} отправлен отчёт на проверку", task.id)
+
+        if notify_tech:
+            await add_role_notifications(db, Role.tech_supp, f"По задаче #{task.id} отправлен отчёт на проверку (требуется тех.проверка)", task.id)
+
         await db.commit()
     except Exception as e:
         logger.exception("Failed to submit report: %s", e)
@@ -1180,20 +1191,11 @@ async def submit_report_for_review(
             logger.exception("rollback failed")
         raise HTTPException(status_code=500, detail="Ошибка при отправке отчёта на проверку")
 
-    if notify_logist and task.created_by:
-        background_tasks.add_task(notify_user, task.created_by, f"По задаче #{task.id} отправлен отчёт на проверку", task.id)
-
-    if notify_tech:
-        tech_q = await db.execute(select(User).where(User.role == Role.tech_supp, User.is_active == True))
-        techs = tech_q.scalars().all()
-        for tuser in techs:
-            background_tasks.add_task(notify_user, tuser.id, f"По задаче #{task.id} отправлен отчёт на проверку (требуется тех.проверка)", task.id)
-
     return {"detail": "sent for review"}
 
 
 @router.get("/me")
-async def my_profile(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def my_profile(db: AsyncSession = Depends(get_db_readonly), current_user: User = Depends(get_current_user)):
     """
     Личный кабинет монтажника:
     - имя, фамилия, роль
@@ -1242,8 +1244,8 @@ async def montajnik_filter_completed_tasks(
     work_type_id: Optional[str] = Query(None, description="ID типов работ через запятую"),
     equipment_id: Optional[str] = Query(None, description="ID оборудования через запятую"),
     search: Optional[str] = Query(None, description="Умный поиск по всем полям"),
-    db: AsyncSession = Depends(get_db),
-    current_user=Depends(get_current_user)
+    db: AsyncSession = Depends(get_db_readonly),
+    current_user: TokenPrincipal = Depends(get_current_principal)
 ):
     query = select(Task).where(
         Task.assigned_user_id == current_user.id,
@@ -1393,8 +1395,8 @@ async def montajnik_earnings_by_period(
     start_month: Optional[int] = Query(None, description="Месяц начала (1-12)"),
     end_year: Optional[int] = Query(None, description="Год окончания (например, 2025)"),
     end_month: Optional[int] = Query(None, description="Месяц окончания (1-12)"),
-    db: AsyncSession = Depends(get_db),
-    current_user=Depends(get_current_user)
+    db: AsyncSession = Depends(get_db_readonly),
+    current_user: TokenPrincipal = Depends(get_current_principal)
 ):
     from datetime import date
     import calendar
@@ -1450,8 +1452,8 @@ async def montajnik_earnings_by_period(
 @router.get("/completed-tasks/{task_id}")
 async def mont_completed_task_detail(
     task_id: int,
-    db: AsyncSession = Depends(get_db),
-    current_user=Depends(get_current_user)
+    db: AsyncSession = Depends(get_db_readonly),
+    current_user: TokenPrincipal = Depends(get_current_principal)
 ):
     _ensure_montajnik_or_403(current_user) # Проверяем, что пользователь - монтажник
 
@@ -1553,8 +1555,8 @@ async def mont_completed_task_detail(
 
 @router.get("/my_reports_reviews", response_model=List[MontajnikReportReview], dependencies=[Depends(require_roles(Role.montajnik))])
 async def get_my_reports_reviews(
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db_readonly),
+    current_user: TokenPrincipal = Depends(get_current_principal),
 ):
     """
     Получить все отчёты текущего монтажника и связанные с ними ревью (ответы логиста/техспеца).
@@ -1644,14 +1646,14 @@ async def get_my_reports_reviews(
 
 
 @router.get("/companies", dependencies=[Depends(require_roles(Role.montajnik))])
-async def mont_get_companies(db: AsyncSession = Depends(get_db)):
+async def mont_get_companies(db: AsyncSession = Depends(get_db_readonly)):
     res = await db.execute(select(ClientCompany))
     companies = res.scalars().all()
     return [{"id": c.id, "name": c.name} for c in companies]
 
 
 @router.get("/companies/{company_id}/contacts", dependencies=[Depends(require_roles(Role.montajnik))])
-async def mont_get_contact_persons(company_id: int, db: AsyncSession = Depends(get_db)):
+async def mont_get_contact_persons(company_id: int, db: AsyncSession = Depends(get_db_readonly)):
     res = await db.execute(select(ContactPerson).where(ContactPerson.company_id == company_id))
     contacts = res.scalars().all()
     return [{"id": c.id, "name": c.name, "phone": c.phone, "position": c.position, "company_id": c.company_id} for c in contacts]
@@ -1660,7 +1662,7 @@ async def mont_get_contact_persons(company_id: int, db: AsyncSession = Depends(g
 @router.get("/contact-persons/{contact_person_id}/phone", dependencies=[Depends(require_roles(Role.montajnik))])
 async def get_mont_contact_person_phone(
     contact_person_id: int,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db_readonly)
 ):
     res = await db.execute(
         select(ContactPerson.phone).where(ContactPerson.id == contact_person_id)
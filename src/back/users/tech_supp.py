@@ -7,7 +7,7 @@ from datetime import datetime, timezone
 from typing import List, Optional, Dict, Any
 import logging
 
-from back.db.database import get_db
+from back.db.database import get_db, get_db_readonly
 from back.auth.auth import get_current_user
 from back.db.models import (
     ClientCompany,
@@ -27,7 +27,7 @@ from back.db.models import (
     Role,
     WorkType,
 )
-from back.utils.notify import notify_user
+from back.utils.outbox import add_notification
 from back.users.users_schemas import ReportReviewIn, TaskHistoryItem, require_roles,Role
 from back.utils.selectel import get_s3_client
 from back.files.handlers import validate_and_process_attachment
@@ -63,7 +63,7 @@ async def _add_history(db: AsyncSession, task: Task, user: User, action: TaskSta
 
 
 @router.get("/tasks/active", dependencies=[Depends(require_roles(Role.tech_supp))])
-async def tech_active_tasks(db: AsyncSession = Depends(get_db), current_user=Depends(get_current_user)):
+async def tech_active_tasks(db: AsyncSession = Depends(get_db_readonly), current_user=Depends(get_current_user)):
     """
     Список активных задач для тех.специалиста.
     Возвращаются задачи, которые не в состоянии completed или archived, не являются черновиками,
@@ -119,7 +119,7 @@ async def tech_active_tasks(db: AsyncSession = Depends(get_db), current_user=Dep
 
 
 @router.get("/tasks/history", dependencies=[Depends(require_roles(Role.tech_supp))])
-async def tech_history(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def tech_history(db: AsyncSession = Depends(get_db_readonly), current_user: User = Depends(get_current_user)):
     """
     История выполненных задач (only completed), доступная тех.спецу.
     """
@@ -305,6 +305,17 @@ async def tech_review_report(
             )
             db.add(hist)
 
+        if task.assigned_user_id:
+            # Если оба одобрены - уведомляем монтажника о завершении
+            if (report.approval_tech == ReportApproval.approved and 
+                report.approval_logist == ReportApproval.approved):
+                montajnik_msg = f"Работы по задаче {task_id} проверены и выполнены"
+            else:
+                # Только тех.спец одобрил - уведомляем о тех.проверке
+                montajnik_msg = f"Отчет по задаче {task_id} одобрен тех.специалистом"
+            
+            add_notification(db, task.assigned_user_id, montajnik_msg, task_id)
+
         await db.flush()
         await db.commit()
     except Exception as e:
@@ -316,22 +327,6 @@ async def tech_review_report(
         raise HTTPException(status_code=500, detail="Failed to review report")
 
 
-    if task.assigned_user_id:
-        # Если оба одобрены - уведомляем монтажника о завершении
-        if (report.approval_tech == ReportApproval.approved and 
-            report.approval_logist == ReportApproval.approved):
-            montajnik_msg = f"Работы по задаче {task_id} проверены и выполнены"
-        else:
-            # Только тех.спец одобрил - уведомляем о тех.проверке
-            montajnik_msg = f"Отчет по задаче {task_id} одобрен тех.специалистом"
-        
-        background_tasks.add_task(
-            notify_user,
-            task.assigned_user_id,
-            montajnik_msg,
-            task_id
-        )
-
     return {"detail": "Reviewed", "approval": "approved"}
 
 
@@ -339,7 +334,7 @@ async def tech_review_report(
 @router.get("/tasks/{task_id}")
 async def tech_task_detail(
     task_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     current_user=Depends(get_current_user)
 ):
     res = await db.execute(
@@ -435,7 +430,7 @@ async def tech_task_detail(
 @router.get("/tasks/{task_id}/history", response_model=List[TaskHistoryItem], dependencies=[Depends(require_roles(Role.tech_supp))])
 async def get_tech_task_full_history(
     task_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     current_user=Depends(get_current_user) # Для проверки существования задачи и прав (упрощенно)
 ):
      # 1. Проверить существование задачи (можно добавить проверку прав)
@@ -474,14 +469,14 @@ async def get_tech_task_full_history(
 
 
 @router.get("/companies", dependencies=[Depends(require_roles(Role.tech_supp))])
-async def tech_get_companies(db: AsyncSession = Depends(get_db)):
+async def tech_get_companies(db: AsyncSession = Depends(get_db_readonly)):
     res = await db.execute(select(ClientCompany))
     companies = res.scalars().all()
     return [{"id": c.id, "name": c.name} for c in companies]
 
 
 @router.get("/companies/{company_id}/contacts", dependencies=[Depends(require_roles(Role.tech_supp))])
-async def tech_get_contact_persons(company_id: int, db: AsyncSession = Depends(get_db)):
+async def tech_get_contact_persons(company_id: int, db: AsyncSession = Depends(get_db_readonly)):
     res = await db.execute(select(ContactPerson).where(ContactPerson.company_id == company_id))
     contacts = res.scalars().all()
     return [{"id": c.id, "name": c.name} for c in contacts]
@@ -490,7 +485,7 @@ async def tech_get_contact_persons(company_id: int, db: AsyncSession = Depends(g
 @router.get("/contact-persons/{contact_person_id}/phone", dependencies=[Depends(require_roles(Role.tech_supp))])
 async def tech_get_contact_person_phone(
     contact_person_id: int,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db_readonly)
 ):
 
     res = await db.execute(
@@ -506,7 +501,7 @@ async def tech_get_contact_person_phone(
 
 
 @router.get("/me")
-async def tech_supp_profile(db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def tech_supp_profile(db: AsyncSession = Depends(get_db_readonly), current_user: User = Depends(get_current_user)):
     """
     Личный кабинет тех.спеца:
     - имя, фамилия, роль
@@ -582,7 +577,7 @@ async def tech_supp_filter_tasks(
     task_id: Optional[int] = Query(None, description="ID задачи"),
     equipment_id: Optional[str] = Query(None, description="ID оборудования через запятую"),
     search: Optional[str] = Query(None, description="Умный поиск по всем полям"),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db_readonly)
 ):
     query = select(Task).where(
         Task.is_draft != True,
@@ -735,7 +730,7 @@ async def tech_supp_filter_completed_tasks(
     work_type_id: Optional[str] = Query(None, description="ID типов работ через запятую"),
     equipment_id: Optional[str] = Query(None, description="ID оборудования через запятую"),
     search: Optional[str] = Query(None, description="Умный поиск по всем полям"),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     current_user=Depends(get_current_user)
 ):
     # Сначала находим ID задач, где тех.спец проверял отчёты
@@ -895,7 +890,7 @@ async def tech_supp_filter_completed_tasks(
 @router.get("/completed-tasks/{task_id}")
 async def tech_supp_completed_task_detail(
     task_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_db_readonly),
     current_user=Depends(get_current_user)
 ):
     _ensure_tech_supp_or_403(current_user) # Проверяем, что пользователь - тех.спец
@@ -5,11 +5,11 @@ from decimal import Decimal
 from enum import Enum
 from typing import Annotated, Literal
 from fastapi import Depends, HTTPException
-from back.db.models import Role, User
-from back.auth.auth import get_current_user
+from back.db.models import Role
+from back.auth.auth import TokenPrincipal, get_current_principal
 
 def require_roles(*allowed_roles: Role):
-    async def _checker(current_user: User = Depends(get_current_user)):
+    async def _checker(current_user: TokenPrincipal = Depends(get_current_principal)):
         if current_user.role not in allowed_roles:
             raise HTTPException(status_code=403, detail="Недостаточно прав")
         return current_user
@@ -233,4 +233,8 @@ class UpdateUserRequest(BaseModel):
     lastname: Optional[str] = None
     login: Optional[str] = None
     password: Optional[str] = None  
-    role: Optional[str] = None      
\ No newline at end of file
+    role: Optional[str] = None      
+
+
+class UserSkillsUpdate(BaseModel):
+    categories: List[str]  # категории работ (WorkType.category), которые выполняет монтажник
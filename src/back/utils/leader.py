@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable, Optional
+
+from back.db.config import LEADER_LEASE_TTL, LEADER_RENEW_INTERVAL
+from back.utils.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Уникальный id процесса: хост, pid и случайный суффикс (pid может повториться после рестарта контейнера)
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Захват: только если аренды нет; fencing token — монотонный счётчик эпох лидерства
+_ACQUIRE_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return 0
+end
+local token = redis.call('incr', KEYS[2])
+redis.call('set', KEYS[1], token .. ':' .. ARGV[1], 'PX', ARGV[2])
+return token
+"""
+
+# Продление и освобождение — только своей аренды (сравнение значения вместе с токеном)
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaderLease:
+    """
+    Аренда лидерства в Redis: ключ leader:<name> с TTL, значение "<token>:<instance_id>".
+    token растёт при каждой смене лидера, поэтому продлить или снять аренду
+    может только тот, кто её получил, даже если между ними успел побывать другой лидер.
+    """
+
+    def __init__(self, name: str, ttl: float = LEADER_LEASE_TTL):
+        self.name = name
+        self.key = f"leader:{name}"
+        self.epoch_key = f"leader:{name}:epoch"
+        self.ttl_ms = int(ttl * 1000)
+        self.token: Optional[int] = None
+        self._value: Optional[str] = None
+
+    async def try_acquire(self) -> bool:
+        token = int(await redis_client.eval(_ACQUIRE_SCRIPT, 2, self.key, self.epoch_key, INSTANCE_ID, self.ttl_ms))
+        if not token:
+            return False
+        self.token = token
+        self._value = f"{token}:{INSTANCE_ID}"
+        return True
+
+    async def renew(self) -> bool:
+        if self._value is None:
+            return False
+        return bool(await redis_client.eval(_RENEW_SCRIPT, 1, self.key, self._value, self.ttl_ms))
+
+    async def release(self) -> None:
+        if self._value is None:
+            return
+        value, self._value, self.token = self._value, None, None
+        await redis_client.eval(_RELEASE_SCRIPT, 1, self.key, value)
+
+
+async def _stop_job(job_task: asyncio.Task) -> None:
+    if job_task.done():
+        return
+    job_task.cancel()
+    try:
+        await job_task
+    except BaseException:
+        pass
+
+
+async def _hold_lease(lease: LeaderLease, job_task: asyncio.Task, renew_interval: float) -> None:
+    """
+    Продлевает аренду, пока работает задача. Возвращается, когда задача завершилась
+    или аренда потеряна / не продлевается так долго, что её может забрать другой процесс.
+    """
+    ttl = lease.ttl_ms / 1000
+    renewed_at = time.monotonic()
+    while True:
+        done, _ = await asyncio.wait({job_task}, timeout=renew_interval)
+        if done:
+            return
+        try:
+            if await lease.renew():
+                renewed_at = time.monotonic()
+                continue
+            logger.warning(f"Аренда лидера {lease.name} потеряна (token {lease.token}), останавливаем задачу")
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Не удалось продлить аренду лидера {lease.name}: {e}")
+        # останавливаемся заранее, чтобы не работать одновременно с новым лидером
+        if time.monotonic() - renewed_at >= ttl - renew_interval:
+            logger.warning(f"Аренда лидера {lease.name} истекает без продления, останавливаем задачу")
+            return
+
+
+async def run_as_leader(
+    name: str,
+    job: Callable[[], Awaitable[None]],
+    ttl: float = LEADER_LEASE_TTL,
+    renew_interval: float = LEADER_RENEW_INTERVAL,
+) -> None:
+    """
+    Запускает job только в одном процессе среди всех воркеров и хостов.
+    Остальные процессы ждут и забирают аренду не позже чем через ttl после падения лидера;
+    при штатной остановке аренда снимается сразу.
+    """
+    lease = LeaderLease(name, ttl)
+    while True:
+        try:
+            acquired = await lease.try_acquire()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Выборы лидера {name} недоступны: {e}")
+            acquired = False
+        if not acquired:
+            await asyncio.sleep(renew_interval)
+            continue
+
+        logger.info(f"Процесс {INSTANCE_ID} стал лидером {name} (fencing token {lease.token})")
+        job_task = asyncio.create_task(job())
+        try:
+            await _hold_lease(lease, job_task, renew_interval)
+        finally:
+            await _stop_job(job_task)
+            try:
+                await lease.release()
+            except Exception as e:
+                logger.warning(f"Не удалось снять аренду лидера {name}: {e}")
+
+        if job_task.done() and not job_task.cancelled() and job_task.exception() is not None:
+            logger.error(f"Задача лидера {name} завершилась с ошибкой: {job_task.exception()!r}")
+        # пауза перед повторными выборами — даём шанс другим процессам
+        await asyncio.sleep(renew_interval)
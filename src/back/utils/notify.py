@@ -1,27 +1,231 @@
 import asyncio
-from datetime import datetime, timedelta
+from dataclasses import dataclass
+import importlib.util
 import logging
 import os
-from typing import Optional
+import time
+from typing import Any, Dict, Iterable, Optional
 from sqlalchemy import select
-from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.asyncio import AsyncSession
-from back.db.models import Task, TaskStatus, User
-from back.db.database import DATABASE_URL
-from back.db.config import TOKEN  # предполагаем, что тут есть TOKEN
+from back.db.models import User
+from back.utils.skills import qualified_for_task
+from back.db.database import SessionLocal as AsyncSessionLocal
+from back.db.config import (
+    TOKEN,  # предполагаем, что тут есть TOKEN
+    TELEGRAM_API_BASE_URL,
+    TELEGRAM_HTTP_TIMEOUT,
+    TELEGRAM_HTTP_MAX_CONNECTIONS,
+    TELEGRAM_HTTP_MAX_KEEPALIVE,
+    TELEGRAM_HTTP2,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_PER_CHAT_INTERVAL,
+    TELEGRAM_SEND_CONCURRENCY,
+    TELEGRAM_MAX_RETRIES,
+)
 import httpx
 
 logger = logging.getLogger(__name__)
 
+# Для нагрузочных тестов можно указать локальную заглушку (python -m back.devtools.fake_telegram)
+TELEGRAM_API_URL = TELEGRAM_API_BASE_URL
 
-engine = create_async_engine(DATABASE_URL)
-AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+class TelegramApiClient:
+    """
+    Долгоживущий HTTP-клиент Bot API: одно keep-alive соединение (пул) на процесс
+    вместо нового TCP+TLS на каждое сообщение. Открывается в lifespan, закрывается при остановке.
+    Ведёт простые счётчики запросов, ошибок и задержек.
+    """
+
+    def __init__(self, token: Optional[str], base_url: str = TELEGRAM_API_URL):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self._client: Optional[httpx.AsyncClient] = None
+        self.requests_total = 0
+        self.errors_total = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.status_counts: Dict[str, int] = {}
+
+    def _create_client(self) -> httpx.AsyncClient:
+        http2 = TELEGRAM_HTTP2 and importlib.util.find_spec("h2") is not None
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=TELEGRAM_HTTP_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=TELEGRAM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=TELEGRAM_HTTP_MAX_KEEPALIVE,
+            ),
+            http2=http2,
+        )
+
+    async def start(self) -> None:
+        if self._client is None:
+            self._client = self._create_client()
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # вне lifespan (скрипты, отдельные воркеры) клиент создаётся по первому запросу
+        if self._client is None:
+            self._client = self._create_client()
+        return self._client
+
+    def _record(self, status: str, elapsed: float) -> None:
+        self.requests_total += 1
+        self.latency_total += elapsed
+        if elapsed > self.latency_max:
+            self.latency_max = elapsed
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    async def call(self, method: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Вызов метода Bot API. Возвращает JSON-ответ Telegram (ok, result / description, parameters).
+        Сетевые ошибки пробрасываются.
+        """
+        started = time.perf_counter()
+        try:
+            response = await self.client.post(f"/bot{self.token}/{method}", json=payload)
+        except Exception:
+            self.errors_total += 1
+            self._record("network_error", time.perf_counter() - started)
+            raise
+        self._record(str(response.status_code), time.perf_counter() - started)
+        try:
+            result = response.json()
+        except ValueError:
+            result = {"ok": False, "error_code": response.status_code, "description": response.text[:200]}
+        if not result.get("ok"):
+            self.errors_total += 1
+        return result
+
+    def reset_stats(self) -> None:
+        self.requests_total = 0
+        self.errors_total = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.status_counts = {}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "open": self._client is not None,
+            "requests_total": self.requests_total,
+            "errors_total": self.errors_total,
+            "latency_avg_ms": round(self.latency_total * 1000 / self.requests_total, 3) if self.requests_total else 0.0,
+            "latency_max_ms": round(self.latency_max * 1000, 3),
+            "status_counts": dict(self.status_counts),
+        }
+
+
+telegram_client = TelegramApiClient(TOKEN)
+
+
+class TokenBucket:
+    """
+    Token bucket: не больше rate операций в секунду с допустимым всплеском capacity.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class PerChatLimiter:
+    """
+    Минимальный интервал между сообщениями в один чат (лимит Telegram ~1 сообщение/с на чат).
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next_allowed: Dict[int, float] = {}
+
+    async def acquire(self, chat_id: int) -> None:
+        now = time.monotonic()
+        if len(self._next_allowed) > 10000:
+            self._next_allowed = {k: v for k, v in self._next_allowed.items() if v > now}
+        slot = max(now, self._next_allowed.get(chat_id, 0.0))
+        self._next_allowed[chat_id] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+# Лимиты общие для всех отправок процесса
+_global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE)
+_chat_limiter = PerChatLimiter(TELEGRAM_PER_CHAT_INTERVAL)
+
+
+@dataclass
+class SendOutcome:
+    """
+    Результат одной попытки отправки: ok, либо через сколько секунд повторить (429),
+    либо признак постоянной ошибки (400/403 — чат недоступен, повтор не поможет).
+    """
+    ok: bool
+    retry_after: Optional[float] = None
+    permanent: bool = False
+    error: Optional[str] = None
+
+
+async def send_telegram_message_once(chat_id: int, text: str) -> SendOutcome:
+    """
+    Одна попытка отправки с учётом глобального и per-chat лимитов, без повторов.
+    Повторы решает вызывающий: send_telegram_message — сразу, outbox — через next_attempt_at.
+    """
+    await _global_bucket.acquire()
+    await _chat_limiter.acquire(chat_id)
+    try:
+        result = await telegram_client.call(
+            "sendMessage",
+            {
+                "chat_id": chat_id,
+                "text": text,
+                "parse_mode": "HTML"
+            }
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при отправке сообщения в Telegram: {e}")
+        return SendOutcome(ok=False, error=f"network: {e}")
+
+    if result.get("ok"):
+        logger.info(f"Сообщение отправлено в чат {chat_id}: {text}")
+        return SendOutcome(ok=True)
+
+    error_code = result.get("error_code") or 0
+    description = result.get("description")
+    if error_code == 429:
+        retry_after = (result.get("parameters") or {}).get("retry_after", 1)
+        logger.warning(f"Telegram 429 для чата {chat_id}, повтор через {retry_after} с")
+        return SendOutcome(ok=False, retry_after=float(retry_after), error=f"429: {description}")
+    logger.error(f"Ошибка Telegram API: {description}")
+    return SendOutcome(
+        ok=False,
+        permanent=400 <= error_code < 500,
+        error=f"{error_code}: {description}",
+    )
 
 
 async def send_telegram_message(chat_id: int, text: str) -> bool:
     """
-    Отправка сообщения в Telegram через Bot API
+    Отправка сообщения в Telegram через Bot API.
+    Соблюдает глобальный и per-chat лимиты, на 429 ждёт retry_after, на 5xx/сетевые ошибки повторяет с backoff.
     """
     if not chat_id:
         logger.warning(f"Нет Telegram ID для отправки сообщения: {text}")
@@ -32,32 +236,17 @@ async def send_telegram_message(chat_id: int, text: str) -> bool:
         logger.warning("Telegram bot token не настроен")
         return False
 
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        try:
-            response = await client.post(
-                url,
-                json={
-                    "chat_id": chat_id,
-                    "text": text,
-                    "parse_mode": "HTML"
-                }
-            )
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("ok"):
-                    logger.info(f"Сообщение отправлено в чат {chat_id}: {text}")
-                    return True
-                else:
-                    logger.error(f"Ошибка Telegram API: {result.get('description')}")
-                    return False
-            else:
-                logger.error(f"HTTP ошибка при отправке в Telegram: {response.status_code}")
-                return False
-        except Exception as e:
-            logger.error(f"Ошибка при отправке сообщения в Telegram: {e}")
+    for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+        outcome = await send_telegram_message_once(chat_id, text)
+        if outcome.ok:
+            return True
+        if outcome.permanent or attempt >= TELEGRAM_MAX_RETRIES:
             return False
+        if outcome.retry_after is not None:
+            await asyncio.sleep(outcome.retry_after)
+        else:
+            await asyncio.sleep(0.5 * 2 ** attempt)
+    return False
 
 
 async def get_user_telegram_in_new_session(user_id: int) -> Optional[int]:
@@ -88,18 +277,61 @@ async def notify_user(user_id: int, message: str, task_id: Optional[int] = None)
     return await send_telegram_message(chat_id, message)
 
 
+async def resolve_chat_ids(user_ids: Iterable[int]) -> Dict[int, Optional[int]]:
+    """
+    Telegram ID для списка пользователей одним запросом. Для неизвестных id — None.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    chat_ids: Dict[int, Optional[int]] = {user_id: None for user_id in user_ids}
+    if not user_ids:
+        return chat_ids
+    async with AsyncSessionLocal() as session:
+        try:
+            result = await session.execute(
+                select(User.id, User.telegram_id).where(User.id.in_(user_ids))
+            )
+            for user_id, telegram_id in result.all():
+                chat_ids[user_id] = telegram_id
+        except Exception as e:
+            logger.error(f"Ошибка при получении Telegram ID пользователей: {e}")
+    return chat_ids
+
+
+async def send_to_chats(chat_ids: Dict[int, Optional[int]], message: str) -> Dict[int, bool]:
+    """
+    Параллельная отправка одного сообщения нескольким пользователям с ограничением конкурентности.
+    chat_ids: {user_id: telegram_id}. Возвращает {user_id: success}.
+    """
+    semaphore = asyncio.Semaphore(TELEGRAM_SEND_CONCURRENCY)
+
+    async def _send(user_id: int, chat_id: Optional[int]) -> bool:
+        if not chat_id:
+            logger.warning(f"Нет Telegram ID для пользователя {user_id}")
+            return False
+        async with semaphore:
+            return await send_telegram_message(chat_id, message)
+
+    user_ids = list(chat_ids.keys())
+    outcomes = await asyncio.gather(
+        *(_send(user_id, chat_ids[user_id]) for user_id in user_ids),
+        return_exceptions=True,
+    )
+    results = {}
+    for user_id, outcome in zip(user_ids, outcomes):
+        if isinstance(outcome, BaseException):
+            logger.error(f"Ошибка при отправке уведомления пользователю {user_id}: {outcome}")
+            outcome = False
+        results[user_id] = outcome
+    return results
+
+
 async def notify_multiple_users(user_ids: list[int], message: str, task_id: Optional[int] = None) -> dict:
     """
     Отправка уведомлений нескольким пользователям
     Возвращает словарь с результатами {user_id: success}
     """
-    results = {}
-    for user_id in user_ids:
-        success = await notify_user(user_id, message, task_id)
-        results[user_id] = success
-        await asyncio.sleep(0.1)  # небольшая задержка между сообщениями
-    
-    return results
+    chat_ids = await resolve_chat_ids(user_ids)
+    return await send_to_chats(chat_ids, message)
 
 
 async def notify_task_assignment(task_id: int, assigned_user_id: int) -> bool:
@@ -118,72 +350,26 @@ async def notify_task_update(task_id: int, user_ids: list[int]) -> dict:
     return await notify_multiple_users(user_ids, message, task_id)
 
 
-async def notify_broadcast_task(task_id: int, exclude_user_id: Optional[int] = None) -> dict:
+async def notify_broadcast_task(task_id: int, exclude_user_id: Optional[int] = None, message: Optional[str] = None) -> dict:
     """
-    Уведомление всех активных монтажников о новой задаче (рассылка)
+    Уведомление активных монтажников, подходящих по навыкам, о новой задаче (рассылка)
     """
     async with AsyncSessionLocal() as session:
         try:
-            query = select(User.id).where(
+            # id и telegram_id одним запросом — без отдельного поиска чата на каждого монтажника
+            query = select(User.id, User.telegram_id).where(
                 User.role == 'montajnik',
-                User.is_active == True
+                User.is_active == True,
+                qualified_for_task(User.id, task_id),
             )
             if exclude_user_id:
                 query = query.where(User.id != exclude_user_id)
             
             result = await session.execute(query)
-            user_ids = [row[0] for row in result.fetchall()]
-            
-            message = f"Новая задача для бригады #{task_id} (рассылка)"
-            return await notify_multiple_users(user_ids, message, task_id)
+            chat_ids = {user_id: telegram_id for user_id, telegram_id in result.all()}
         except Exception as e:
             logger.error(f"Ошибка при рассылке задачи {task_id}: {e}")
             return {}
-        
-
-async def notify_montajniks_of_upcoming_tasks():
-    logger.info("Запуск проверки задач для уведомления монтажников за час до начала.")
-    now = datetime.now() 
-    one_hour_later = now + timedelta(hours=1)
-    buffer_minutes = 5
-    lower_bound = one_hour_later - timedelta(minutes=buffer_minutes)
-    upper_bound = one_hour_later + timedelta(minutes=buffer_minutes)
-
-    async with AsyncSessionLocal() as session:
-        try:
-            query = select(Task).where(
-                Task.scheduled_at >= lower_bound,
-                Task.scheduled_at <= upper_bound,
-                Task.status == TaskStatus.accepted,
-                Task.assigned_user_id.isnot(None)
-            )
-            result = await session.execute(query)
-            upcoming_tasks = result.scalars().all()
 
-            logger.info(f"Найдено {len(upcoming_tasks)} задач для уведомления.")
-
-            for task in upcoming_tasks:
-                user_id = task.assigned_user_id
-                message = f"Задача #{task.id} начнется примерно через час. Время начала: {task.scheduled_at.strftime('%d.%m.%Y %H:%M')}."
-
-                logger.info(f"Отправка уведомления монтажнику (ID: {user_id}) о задаче #{task.id}")
-                success = await notify_user(user_id, message, task.id)
-                if success:
-                    logger.info(f"Уведомление о задаче #{task.id} успешно отправлено монтажнику {user_id}.")
-                else:
-                    logger.warning(f"Не удалось отправить уведомление о задаче #{task.id} монтажнику {user_id}.")
-
-        except Exception as e:
-            logger.error(f"Ошибка при проверке и отправке уведомлений о предстоящих задачах: {e}")
-
-
-async def periodic_notification_task():
-    """
-    Фоновая задача, которая запускает проверку каждые 5 минут.
-    """
-    while True:
-        try:
-            await notify_montajniks_of_upcoming_tasks()
-        except Exception as e:
-            logger.error(f"Ошибка в фоновой задаче уведомлений: {e}")
-        await asyncio.sleep(5 * 60) 
\ No newline at end of file
+    message = message or f"Новая задача для бригады #{task_id} (рассылка)"
+    return await send_to_chats(chat_ids, message)
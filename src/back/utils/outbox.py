@@ -0,0 +1,287 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Integer, Text, bindparam, func, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from back.db.config import (
+    TOKEN,
+    NOTIFY_OUTBOX_BATCH_SIZE,
+    NOTIFY_OUTBOX_POLL_INTERVAL,
+    NOTIFY_OUTBOX_MAX_ATTEMPTS,
+    NOTIFY_OUTBOX_BACKOFF_BASE,
+    NOTIFY_OUTBOX_BACKOFF_MAX,
+    NOTIFY_OUTBOX_LEASE,
+    TELEGRAM_SEND_CONCURRENCY,
+)
+from back.db.database import SessionLocal
+from back.db.models import Notification, Role, User, now_ekb
+from back.utils.notify import SendOutcome, send_telegram_message_once
+from back.utils.skills import qualified_for_task
+
+logger = logging.getLogger(__name__)
+
+
+# --- Запись в outbox (в транзакции бизнес-операции, до commit) ---
+
+def add_notification(
+    db: AsyncSession,
+    user_id: int,
+    message: str,
+    task_id: Optional[int] = None,
+    kind: Optional[str] = None,
+    payload: Optional[Any] = None,
+    delay: float = 0,
+) -> Notification:
+    """
+    Положить уведомление в outbox. Запись фиксируется тем же commit, что и изменение задачи,
+    поэтому уведомление не теряется при рестарте и не уходит, если транзакция откатилась.
+    delay откладывает отправку (окно склейки однотипных уведомлений).
+    """
+    notification = Notification(
+        user_id=user_id,
+        task_id=task_id,
+        message=message,
+        kind=kind,
+        payload=payload,
+        next_attempt_at=now_ekb() + timedelta(seconds=delay),
+    )
+    db.add(notification)
+    return notification
+
+
+async def find_pending_notification(
+    db: AsyncSession,
+    user_id: int,
+    task_id: Optional[int],
+    kind: str,
+) -> Optional[Notification]:
+    """
+    Ещё не отправленное уведомление того же типа, ожидающее конца окна склейки.
+    Строка блокируется до commit; занятую воркером пропускаем — тогда создаётся новое уведомление.
+    """
+    result = await db.execute(
+        select(Notification)
+        .where(
+            Notification.user_id == user_id,
+            Notification.task_id == task_id,
+            Notification.kind == kind,
+            Notification.is_sent == False,
+            Notification.attempts == 0,
+            Notification.next_attempt_at > func.now(),
+        )
+        .order_by(Notification.id.desc())
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    return result.scalars().first()
+
+
+def add_notifications(db: AsyncSession, user_ids: Iterable[int], message: str, task_id: Optional[int] = None) -> None:
+    for user_id in dict.fromkeys(user_ids):
+        add_notification(db, user_id, message, task_id)
+
+
+async def add_role_notifications(
+    db: AsyncSession,
+    role: Role,
+    message: str,
+    task_id: Optional[int] = None,
+    exclude_user_id: Optional[int] = None,
+    only_qualified: bool = False,
+) -> None:
+    """
+    Уведомление всем активным пользователям роли одним INSERT ... SELECT,
+    без выборки списка получателей в приложение.
+    only_qualified — только тем, чьи навыки подходят под работы задачи task_id.
+    """
+    query = select(
+        User.id,
+        literal(task_id, Integer).label("task_id"),
+        literal(message, Text).label("message"),
+    ).where(User.role == role, User.is_active == True)
+    if exclude_user_id:
+        query = query.where(User.id != exclude_user_id)
+    if only_qualified and task_id is not None:
+        query = query.where(qualified_for_task(User.id, task_id))
+    await db.execute(
+        insert(Notification).from_select(["user_id", "task_id", "message"], query)
+    )
+
+
+# --- Воркер outbox ---
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(NOTIFY_OUTBOX_BACKOFF_MAX, NOTIFY_OUTBOX_BACKOFF_BASE * 2 ** max(attempts - 1, 0)))
+
+
+async def claim_outbox_batch(batch_size: int = NOTIFY_OUTBOX_BATCH_SIZE) -> List[Tuple[int, int, str, Optional[int]]]:
+    """
+    Забрать пачку готовых уведомлений. Строки выбираются FOR UPDATE SKIP LOCKED и в той же
+    короткой транзакции сдвигаются на NOTIFY_OUTBOX_LEASE вперёд с учётом попытки:
+    блокировки не держатся на время отправки, а пачка упавшего воркера вернётся в очередь по таймауту.
+    Засчитанная попытка выводит строку из окна склейки (find_pending_notification берёт только attempts == 0).
+    Возвращает [(id, номер попытки, текст, telegram_id)].
+    """
+    async with SessionLocal() as db:
+        due = (
+            select(Notification.id)
+            .where(
+                Notification.is_sent == False,
+                Notification.next_attempt_at <= func.now(),
+                Notification.attempts < NOTIFY_OUTBOX_MAX_ATTEMPTS,
+            )
+            .order_by(Notification.next_attempt_at, Notification.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        claimed = (
+            update(Notification)
+            .where(Notification.id.in_(due))
+            .values(
+                next_attempt_at=func.now() + timedelta(seconds=NOTIFY_OUTBOX_LEASE),
+                attempts=Notification.attempts + 1,
+            )
+            .returning(Notification.id, Notification.user_id, Notification.attempts, Notification.message)
+            .cte("claimed")
+        )
+        result = await db.execute(
+            select(claimed.c.id, claimed.c.attempts, claimed.c.message, User.telegram_id)
+            .select_from(claimed)
+            .outerjoin(User, User.id == claimed.c.user_id)
+        )
+        rows = [tuple(row) for row in result.all()]
+        await db.commit()
+        return rows
+
+
+def _outcome_params(notification_id: int, attempt: int, outcome: SendOutcome, now: datetime) -> Dict[str, Any]:
+    """
+    Параметры строки для _record_outcomes: все поля заданы явно, чтобы пачка ушла одним executemany.
+    """
+    params = dict(
+        b_id=notification_id,
+        b_attempt=attempt,
+        is_sent=outcome.ok,
+        sent_at=now if outcome.ok else None,
+        last_error=None if outcome.ok else (outcome.error or "")[:1000],
+        attempts=attempt,
+        next_attempt_at=now,
+    )
+    if outcome.ok:
+        return params
+    if outcome.retry_after is not None:
+        # 429 — ошибка не уведомления, а темпа: попытку не засчитываем
+        params.update(attempts=attempt - 1, next_attempt_at=now + timedelta(seconds=outcome.retry_after))
+    elif outcome.permanent:
+        params.update(attempts=NOTIFY_OUTBOX_MAX_ATTEMPTS)
+    else:
+        params.update(next_attempt_at=now + _backoff(attempt))
+    return params
+
+
+async def _record_outcomes(rows: List[Dict[str, Any]]) -> None:
+    """
+    Результаты всей пачки — одной короткой транзакцией (executemany на одном соединении).
+    Условие на attempts: если аренда истекла и строку забрал другой воркер, результат пишет только он.
+    """
+    table = Notification.__table__
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam("b_id"), table.c.attempts == bindparam("b_attempt"))
+        .values(
+            is_sent=bindparam("is_sent"),
+            sent_at=bindparam("sent_at"),
+            last_error=bindparam("last_error"),
+            attempts=bindparam("attempts"),
+            next_attempt_at=bindparam("next_attempt_at"),
+        )
+    )
+    async with SessionLocal() as db:
+        conn = await db.connection()
+        await conn.execute(stmt, rows)
+        await db.commit()
+
+
+async def drain_outbox_batch(batch_size: int = NOTIFY_OUTBOX_BATCH_SIZE) -> int:
+    """
+    Обработать одну пачку готовых к отправке уведомлений. Возвращает размер пачки.
+    Отправка идёт без открытой транзакции, результаты пишутся одной транзакцией в конце;
+    если воркер упадёт раньше, пачка вернётся в очередь по истечении аренды.
+    """
+    rows = await claim_outbox_batch(batch_size)
+    if not rows:
+        return 0
+
+    semaphore = asyncio.Semaphore(TELEGRAM_SEND_CONCURRENCY)
+
+    async def _send(message: str, chat_id: Optional[int]) -> SendOutcome:
+        if not chat_id:
+            return SendOutcome(ok=False, permanent=True, error="У пользователя нет Telegram ID")
+        try:
+            async with semaphore:
+                return await send_telegram_message_once(chat_id, message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return SendOutcome(ok=False, error=repr(e))
+
+    outcomes = await asyncio.gather(*(_send(message, chat_id) for _, _, message, chat_id in rows))
+    now = now_ekb()
+    await _record_outcomes([
+        _outcome_params(notification_id, attempt, outcome, now)
+        for (notification_id, attempt, _, _), outcome in zip(rows, outcomes)
+    ])
+    logger.info(f"Outbox: отправлено {sum(1 for o in outcomes if o.ok)} из {len(rows)}")
+    return len(rows)
+
+
+async def run_outbox_worker():
+    """
+    Цикл воркера outbox: полные пачки разбираются подряд, пустая очередь опрашивается
+    раз в NOTIFY_OUTBOX_POLL_INTERVAL секунд.
+    """
+    if not TOKEN:
+        logger.warning("Telegram bot token не настроен, воркер outbox не запущен")
+        return
+    logger.info("Воркер outbox уведомлений запущен")
+    while True:
+        try:
+            processed = await drain_outbox_batch()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Ошибка при обработке outbox уведомлений")
+            processed = 0
+        if processed < NOTIFY_OUTBOX_BATCH_SIZE:
+            await asyncio.sleep(NOTIFY_OUTBOX_POLL_INTERVAL)
+
+
+async def get_outbox_stats(db: AsyncSession) -> Dict[str, Any]:
+    """
+    Глубина и возраст очереди: сколько ждёт отправки, сколько уже пора отправить,
+    сколько исчерпали попытки, и возраст самого старого неотправленного уведомления.
+    """
+    pending = Notification.is_sent == False
+    alive = Notification.attempts < NOTIFY_OUTBOX_MAX_ATTEMPTS
+    row = (await db.execute(
+        select(
+            func.count().filter(pending, alive).label("pending"),
+            func.count().filter(pending, alive, Notification.next_attempt_at <= func.now()).label("due"),
+            func.count().filter(pending, Notification.attempts >= NOTIFY_OUTBOX_MAX_ATTEMPTS).label("dead"),
+            func.min(Notification.created_at).filter(pending, alive).label("oldest_created_at"),
+        ).where(pending)
+    )).one()
+    oldest_age = None
+    if row.oldest_created_at is not None:
+        oldest_age = round((datetime.now(timezone.utc) - row.oldest_created_at).total_seconds(), 1)
+    return {
+        "pending": row.pending,
+        "due": row.due,
+        "dead": row.dead,
+        "oldest_pending_age_seconds": oldest_age,
+        "max_attempts": NOTIFY_OUTBOX_MAX_ATTEMPTS,
+    }
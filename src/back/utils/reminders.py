@@ -0,0 +1,183 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import and_, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from back.db.config import TASK_REMINDER_LEAD_MINUTES, TASK_REMINDER_MAX_SLEEP
+from back.db.database import SessionLocal
+from back.db.models import Task, TaskStatus, UTC_PLUS_5
+from back.utils.outbox import add_notification
+from back.utils.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+REMINDERS_CHANNEL = "task_reminders_changed"
+
+REMINDER_LEAD = timedelta(minutes=TASK_REMINDER_LEAD_MINUTES)
+
+
+def _reminder_pending():
+    # напоминание ещё не отправлено для текущего scheduled_at (в т.ч. после переноса задачи)
+    return and_(
+        Task.status == TaskStatus.accepted,
+        Task.assigned_user_id.isnot(None),
+        Task.scheduled_at.isnot(None),
+        Task.reminder_sent_for.is_distinct_from(Task.scheduled_at),
+    )
+
+
+def _plural(n: int, one: str, few: str, many: str) -> str:
+    if n % 10 == 1 and n % 100 != 11:
+        return one
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return few
+    return many
+
+
+def _lead_text(minutes: int) -> str:
+    # "через час", "через 2 часа", "через 30 минут" — по TASK_REMINDER_LEAD_MINUTES
+    if minutes % 60 == 0:
+        hours = minutes // 60
+        return "час" if hours == 1 else f"{hours} {_plural(hours, 'час', 'часа', 'часов')}"
+    return f"{minutes} {_plural(minutes, 'минуту', 'минуты', 'минут')}"
+
+
+REMINDER_LEAD_TEXT = _lead_text(TASK_REMINDER_LEAD_MINUTES)
+
+
+def _reminder_message(task_id: int, scheduled_at: datetime) -> str:
+    local_time = scheduled_at.astimezone(UTC_PLUS_5)
+    return (
+        f"Задача #{task_id} начнется примерно через {REMINDER_LEAD_TEXT}. "
+        f"Время начала: {local_time.strftime('%d.%m.%Y %H:%M')}."
+    )
+
+
+async def send_due_reminders(db: AsyncSession) -> int:
+    """
+    Отметить и поставить в outbox все напоминания, время которых наступило.
+    Отметка (reminder_sent_for = scheduled_at) и уведомление пишутся одной транзакцией;
+    условие в UPDATE перепроверяется под блокировкой строки, поэтому параллельный
+    планировщик не отправит то же напоминание второй раз.
+    """
+    result = await db.execute(
+        update(Task)
+        .where(
+            _reminder_pending(),
+            Task.scheduled_at > func.now(),
+            Task.scheduled_at <= func.now() + REMINDER_LEAD,
+        )
+        .values(reminder_sent_for=Task.scheduled_at)
+        .returning(Task.id, Task.assigned_user_id, Task.scheduled_at)
+        .execution_options(synchronize_session=False)
+    )
+    rows = result.all()
+    for task_id, user_id, scheduled_at in rows:
+        add_notification(db, user_id, _reminder_message(task_id, scheduled_at), task_id)
+    await db.commit()
+    if rows:
+        logger.info(f"Поставлено напоминаний о задачах: {len(rows)}")
+    return len(rows)
+
+
+async def next_reminder_at(db: AsyncSession) -> Optional[datetime]:
+    """
+    Момент ближайшего ожидающего напоминания (по индексу scheduled_at) или None.
+    """
+    scheduled_at = await db.scalar(
+        select(func.min(Task.scheduled_at)).where(_reminder_pending(), Task.scheduled_at > func.now())
+    )
+    return scheduled_at - REMINDER_LEAD if scheduled_at is not None else None
+
+
+async def notify_reminders_changed() -> None:
+    """
+    Разбудить планировщик после изменения scheduled_at/статуса задачи,
+    чтобы он пересчитал время следующего напоминания.
+    """
+    try:
+        await redis_client.publish(REMINDERS_CHANNEL, "1")
+    except Exception as e:
+        # планировщик всё равно перепроверит задачи через TASK_REMINDER_MAX_SLEEP
+        logger.warning(f"Не удалось уведомить планировщик напоминаний: {e}")
+
+
+async def _process_reminders() -> float:
+    async with SessionLocal() as db:
+        await send_due_reminders(db)
+        due_at = await next_reminder_at(db)
+    if due_at is None:
+        return TASK_REMINDER_MAX_SLEEP
+    delay = (due_at - datetime.now(timezone.utc)).total_seconds()
+    return min(max(delay, 1.0), TASK_REMINDER_MAX_SLEEP)
+
+
+async def _wait_for_change(pubsub, timeout: float) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return
+        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+        if message is not None:
+            return
+
+
+async def _close(pubsub) -> None:
+    try:
+        await pubsub.aclose()
+    except Exception:
+        pass
+
+
+async def _subscribe():
+    pubsub = redis_client.pubsub()
+    try:
+        # подписка до расчёта следующего напоминания — изменения за время расчёта не теряются
+        await pubsub.subscribe(REMINDERS_CHANNEL)
+        return pubsub
+    except Exception as e:
+        logger.warning(f"Подписка на изменения задач недоступна: {e}")
+        await _close(pubsub)
+        return None
+
+
+async def run_task_reminders():
+    """
+    Планировщик напоминаний: спит до ближайшего напоминания и просыпается раньше,
+    если задачу перенесли или приняли (канал task_reminders_changed).
+    """
+    logger.info("Планировщик напоминаний о задачах запущен")
+    pubsub = None
+    try:
+        while True:
+            if pubsub is None:
+                pubsub = await _subscribe()
+
+            try:
+                sleep_for = await _process_reminders()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка при отправке напоминаний о задачах")
+                sleep_for = 60.0
+
+            if pubsub is None:
+                # без Redis работаем по таймеру, подписку пробуем восстановить позже
+                await asyncio.sleep(min(sleep_for, 30))
+                continue
+            try:
+                await _wait_for_change(pubsub, sleep_for)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Подписка на изменения задач прервана: {e}")
+                await _close(pubsub)
+                pubsub = None
+    finally:
+        if pubsub is not None:
+            await _close(pubsub)
@@ -1,14 +1,32 @@
-from contextlib import asynccontextmanager
+from contextlib import AsyncExitStack, asynccontextmanager
+import logging
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+import time
+from typing import Iterable, List, Dict, Any, Optional
 from datetime import datetime, timezone
+from aiobotocore.config import AioConfig
 from aiobotocore.session import get_session
-from back.db.config import ACCESS_KEY_S3, SECRET_KEY_S3, ENDPOINT_URL_S3, BUCKET_NAME_S3
+from back.db.config import (
+    ACCESS_KEY_S3,
+    SECRET_KEY_S3,
+    ENDPOINT_URL_S3,
+    BUCKET_NAME_S3,
+    S3_MAX_POOL_CONNECTIONS,
+    S3_CONNECT_TIMEOUT,
+    S3_READ_TIMEOUT,
+    S3_MAX_ATTEMPTS,
+    S3_RETRY_MODE,
+    S3_PRESIGN_CACHE_BUCKET,
+)
+from back.utils.redis_client import redis_client
 import asyncio 
 from uuid import uuid4
 
 DEFAULT_PART_SIZE = 50 * 1024 * 1024  # 50 MiB
 ALLOWED_IMAGE_MIMES = {"image/jpeg", "image/png", "image/webp"}
+PRESIGN_CACHE_PREFIX = "presign:"
+
+logger = logging.getLogger(__name__)
 
 
 class S3Client:
@@ -28,18 +46,52 @@ class S3Client:
         self.region_name = region_name
         self.part_size = int(part_size)
         self.session = get_session()
+        self._client = None
+        self._exit_stack: Optional[AsyncExitStack] = None
+        self._lock = asyncio.Lock()
+
+    def _client_config(self) -> AioConfig:
+        return AioConfig(
+            max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+            connect_timeout=S3_CONNECT_TIMEOUT,
+            read_timeout=S3_READ_TIMEOUT,
+            retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": S3_RETRY_MODE},
+        )
+
+    async def start(self) -> None:
+        """
+        Создаёт один долгоживущий botocore-клиент (и пул соединений) на процесс.
+        Вызывается из lifespan; вне его клиент создаётся при первом обращении.
+        """
+        async with self._lock:
+            if self._client is not None:
+                return
+            stack = AsyncExitStack()
+            # передаём aws_access_key_id и aws_secret_access_key явно, endpoint_url отдельно
+            self._client = await stack.enter_async_context(
+                self.session.create_client(
+                    "s3",
+                    aws_access_key_id=self.access_key,
+                    aws_secret_access_key=self.secret_key,
+                    endpoint_url=self.endpoint_url,
+                    region_name=self.region_name,
+                    config=self._client_config(),
+                )
+            )
+            self._exit_stack = stack
+
+    async def close(self) -> None:
+        async with self._lock:
+            if self._exit_stack is not None:
+                stack, self._exit_stack, self._client = self._exit_stack, None, None
+                await stack.aclose()
 
     @asynccontextmanager
     async def get_client(self):
-        # передаём aws_access_key_id и aws_secret_access_key явно, endpoint_url отдельно
-        async with self.session.create_client(
-            "s3",
-            aws_access_key_id=self.access_key,
-            aws_secret_access_key=self.secret_key,
-            endpoint_url=self.endpoint_url,
-            region_name=self.region_name,
-        ) as client:
-            yield client
+        # общий клиент процесса: на выходе из контекста соединения остаются в пуле
+        if self._client is None:
+            await self.start()
+        yield self._client
 
     # ========== Simple upload (put_object) - fallback для небольших файлов ==========
     async def put_object(
@@ -115,17 +167,68 @@ class S3Client:
             await client.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
 
     # ========== Head object (get metadata) ==========
-    async def head_object(self, key: str) -> Dict[str, Any]:
+    async def head_object(self, key: str, checksum: bool = False) -> Dict[str, Any]:
+        """
+        checksum=True запрашивает сохранённые хранилищем контрольные суммы (ChecksumSHA256 и др.),
+        если объект загружен с ними; иначе в ответе их просто нет.
+        """
         async with self.get_client() as client:
-            resp = await client.head_object(Bucket=self.bucket_name, Key=key)
+            params = {"Bucket": self.bucket_name, "Key": key}
+            if checksum:
+                params["ChecksumMode"] = "ENABLED"
+            resp = await client.head_object(**params)
             return resp
 
     # ========== Generate presigned GET URL ==========
     async def presign_get(self, key: str, expires: int = 3600) -> str:
+        urls = await self.presign_get_many([key], expires)
+        return urls[key]
+
+    # ========== Bulk presigned GET URLs (кэш в Redis) ==========
+    async def presign_get_many(self, keys: Iterable[str], expires: int = 3600) -> Dict[str, str]:
+        """
+        Подписанные GET-ссылки для набора ключей: один MGET в Redis и локальная подпись
+        только промахов, без запросов к S3. Кэш общий для всех воркеров, ключ —
+        storage key + интервал времени (S3_PRESIGN_CACHE_BUCKET). Ссылка подписывается
+        с запасом на длину интервала, поэтому выданная из кэша живёт не меньше expires.
+        Возвращает {storage_key: url}.
+        """
+        keys = [k for k in dict.fromkeys(keys) if k]
+        if not keys:
+            return {}
+        bucket_len = S3_PRESIGN_CACHE_BUCKET
+        bucket = int(time.time() // bucket_len)
+        cache_keys = {k: f"{PRESIGN_CACHE_PREFIX}{self.bucket_name}:{expires}:{bucket}:{k}" for k in keys}
+
+        urls: Dict[str, str] = {}
+        try:
+            cached = await redis_client.mget([cache_keys[k] for k in keys])
+        except Exception as e:
+            logger.warning(f"Кэш подписанных ссылок недоступен: {e}")
+            cached = [None] * len(keys)
+        missing = []
+        for key, value in zip(keys, cached):
+            if value:
+                urls[key] = value.decode() if isinstance(value, bytes) else value
+            else:
+                missing.append(key)
+        if not missing:
+            return urls
+
         async with self.get_client() as client:
-            params = {"Bucket": self.bucket_name, "Key": key}
-            url = await self._generate_presigned_url(client, "get_object", params, expires)
-            return url
+            for key in missing:
+                params = {"Bucket": self.bucket_name, "Key": key}
+                urls[key] = await self._generate_presigned_url(client, "get_object", params, expires + bucket_len)
+
+        ttl = max(1, int((bucket + 1) * bucket_len - time.time()))
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for key in missing:
+                    pipe.set(cache_keys[key], urls[key], ex=ttl)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить подписанные ссылки в кэш: {e}")
+        return urls
 
     # ========== Delete object ==========
     async def delete_object(self, key: str) -> Dict[str, Any]:
@@ -0,0 +1,29 @@
+from sqlalchemy import exists, literal, or_, select
+
+from back.db.models import TaskWork, UserSkill, WorkType
+
+
+def qualified_for_task(user_id, task_id):
+    """
+    SQL-условие "монтажник подходит для задачи": его навыки покрывают все категории работ задачи.
+    Монтажник без единого навыка считается универсальным (как до введения навыков),
+    работы без категории ограничений не добавляют.
+    user_id / task_id — колонки внешнего запроса или значения.
+    """
+    # correlate_except: users (и work_types во внутреннем EXISTS) берутся из внешних запросов,
+    # иначе при user_id = User.id подзапрос получает собственный FROM users и не зависит от строки
+    has_skills = exists().where(UserSkill.user_id == user_id).correlate_except(UserSkill)
+    missing_category = (
+        select(literal(1))
+        .select_from(TaskWork)
+        .join(WorkType, WorkType.id == TaskWork.work_type_id)
+        .where(
+            TaskWork.task_id == task_id,
+            WorkType.category.isnot(None),
+            ~exists()
+            .where(UserSkill.user_id == user_id, UserSkill.category == WorkType.category)
+            .correlate_except(UserSkill),
+        )
+        .exists()
+    )
+    return or_(~has_skills, ~missing_category)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# пакет back лежит в src (приложение запускается из этого каталога)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
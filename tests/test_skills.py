@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from back.db.models import Role, TaskWork, User, UserSkill, WorkType
+from back.utils.skills import qualified_for_task
+
+TASK_ID = 7
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    tables = [User.__table__, UserSkill.__table__, WorkType.__table__, TaskWork.__table__]
+    User.metadata.create_all(engine, tables=tables)
+    with Session(engine) as session:
+        session.add_all([
+            User(id=1, name="A", lastname="A", role=Role.montajnik, login="skilled", hashed_password="!"),
+            User(id=2, name="B", lastname="B", role=Role.montajnik, login="other_skill", hashed_password="!"),
+            User(id=3, name="C", lastname="C", role=Role.montajnik, login="no_skills", hashed_password="!"),
+            UserSkill(user_id=1, category="tacho"),
+            UserSkill(user_id=2, category="gps"),
+            WorkType(id=1, name="Тахограф", category="tacho", client_price=0, mont_price=0),
+            TaskWork(task_id=TASK_ID, work_type_id=1, quantity=1),
+        ])
+        session.commit()
+        yield session
+    engine.dispose()
+
+
+def test_user_column_is_correlated(db):
+    # путь рассылок: user_id — колонка внешнего запроса по users
+    ids = db.scalars(select(User.id).where(qualified_for_task(User.id, TASK_ID)).order_by(User.id)).all()
+    assert ids == [1, 3]
+
+
+@pytest.mark.parametrize("user_id, expected", [(1, True), (2, False), (3, True)])
+def test_literal_user_id(db, user_id, expected):
+    assert db.scalar(select(qualified_for_task(user_id, TASK_ID))) is expected
+
+
+def test_task_without_categories_fits_everyone(db):
+    ids = db.scalars(select(User.id).where(qualified_for_task(User.id, TASK_ID + 1)).order_by(User.id)).all()
+    assert ids == [1, 2, 3]